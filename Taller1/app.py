@@ -1,22 +1,50 @@
-from fastapi import FastAPI, HTTPException, Form, Depends, Request, Query, File, UploadFile
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, HTTPException, Form, Depends, Request, Response, Query, File, UploadFile
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from anyio import to_thread
+import asyncio
+import base64
+import functools
+import json
+import threading
+import time
 import pandas as pd
 import numpy as np
 import joblib
 import os
+import shutil
+import tempfile
 from pydantic import BaseModel
-from sqlalchemy import asc, desc
+from sqlalchemy import asc, desc, insert
 from sqlalchemy.orm import Session
 from db.models import User as DBUser, movie as DBMovie, rating as DBRating
 from db.loadtables import create_movie, create_rating
+from db.migrate import schema_outdated
+from db.ratings import upsert_ratings
 from db.session import get_db
-from sqlalchemy import func
+from db.database import SessionLocal
+from db.jobs import JobQueue
+from recommender.catalog import CatalogStore
+from recommender.popularity import PopularityRanking
+from recommender.users import UserRegistry
+from recommender.cache import RecommendationCache
+from recommender.singleflight import SingleFlight
+from recommender.prefetch import PrefetchQueue
+from recommender.candidates import ScoredCandidates
+from recommender.scoring import ScoringService
+from recommender.registry import ModelRegistry, ModelSource
+from recommender.updates import IncrementalUpdater
+from recommender.precompute import PrecomputedStore, changed_users
+from recommender.metrics import MetricsRegistry, start_request, mark_handled
+from recommender.logs import SampledLogger
+from recommender.profiling import RequestProfiler, current_profile
 
 # Modelos para la API
 class User(BaseModel):
@@ -34,6 +62,13 @@ class Rating(BaseModel):
     rating: float
     timestamp: datetime
 
+class RatingInput(BaseModel):
+    movieId: int
+    rating: float
+
+class RatingBatch(BaseModel):
+    ratings: List[RatingInput]
+
 class NewUser(BaseModel):
     username: str
     rating: List[Dict[str, float]]  # Lista de {movieId: rating}
@@ -51,10 +86,43 @@ class PaginatedResponse(BaseModel):
     limit: int
     offset: int
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cargar en memoria el catálogo de películas, la popularidad y los usuarios al iniciar el servidor
+    db = SessionLocal()
+    try:
+        if schema_outdated(db.get_bind()):
+            print("❌ Las tablas user o rating tienen el esquema anterior: ejecutar python -m db.migrate --apply")
+        movie_catalog.get(db).title_index()
+        popularity.ranked(db)
+        user_registry.max_id(db)
+    except Exception as e:
+        print(f"Error cargando el catálogo de películas, la popularidad y los usuarios: {e}")
+    finally:
+        db.close()
+    load_precomputed()
+    # Limitar los hilos que atienden rutas síncronas (acceso a base de datos)
+    to_thread.current_default_thread_limiter().total_tokens = DB_THREADS
+    # Iniciar los procesos de puntuación y la carga de los modelos en segundo plano
+    scoring_service.start()
+    model_registry.start()
+    model_updater.start()
+    recommendations_cache.start()
+    prefetch_queue.start()
+    yield
+    await prefetch_queue.stop()
+    model_updater.stop()
+    model_registry.stop()
+    recommendations_cache.stop()
+    upload_jobs.shutdown()
+    scoring_executor.shutdown(wait=False, cancel_futures=True)
+    scoring_service.shutdown()
+
 # Inicializar FastAPI
 app = FastAPI(
     title="Sistema de Recomendación de Películas",
-    description="API para el Taller 1 de Sistemas de Recomendación"
+    description="API para el Taller 1 de Sistemas de Recomendación",
+    lifespan=lifespan
     )
 
 # Configurar CORS
@@ -64,96 +132,218 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Métricas del servidor (/metrics): latencia por ruta y por etapa del cálculo de
+# recomendaciones, origen de las recomendaciones servidas, caché y modelos
+metrics = MetricsRegistry()
+request_latency = metrics.histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP", ("method", "route", "status"))
+stage_latency = metrics.histogram(
+    "recommendation_stage_duration_seconds", "Latencia de cada etapa del cálculo de recomendaciones",
+    ("model", "stage"))
+recommendations_served = metrics.counter(
+    "recommendations_served_total",
+    "Páginas de recomendaciones servidas según su origen (coalesced: esperó el cálculo de otra petición)",
+    ("model", "source"))
+recommendation_timeouts = metrics.counter(
+    "recommendation_timeouts_total", "Peticiones que agotaron la espera del cálculo de recomendaciones", ("model",))
+
+# Registro estructurado de las rutas de alto tráfico; se escribe solo una
+# fracción de los eventos (LOG_SAMPLE_RATE, entre 0 y 1)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+log = SampledLogger("recommender", sample_rate=LOG_SAMPLE_RATE)
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    start = time.perf_counter()
+    timings = start_request()
+    response = await call_next(request)
+    end = time.perf_counter()
+
+    # Etiquetar por la plantilla de la ruta (no por la URL) para acotar las series
+    route = request.scope.get("route")
+    path = getattr(route, "path", "desconocida")
+    request_latency.observe(end - start, method=request.method, route=path, status=response.status_code)
+    if "handled" in timings:
+        stage_latency.observe(end - timings["handled"], model=timings["model"], stage="serialization")
+    if response.status_code >= 500:
+        log.error("request_failed", method=request.method, route=path, status=response.status_code,
+                  ms=round(1000 * (end - start), 2))
+    return response
+
+# Perfiles bajo demanda: una petición con la cabecera X-Profile-Token (o el
+# parámetro profile) igual a PROFILE_TOKEN se ejecuta con un perfilador de
+# muestreo; sin token configurado el perfilado está desactivado. Se perfila a
+# lo sumo una petición cada PROFILE_MIN_INTERVAL segundos
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_MIN_INTERVAL = int(os.getenv("PROFILE_MIN_INTERVAL", "10"))
+PROFILES_DIR = "data/profiles"
+request_profiler = RequestProfiler(PROFILE_TOKEN, PROFILES_DIR, min_interval=PROFILE_MIN_INTERVAL)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    # Las peticiones normales pasan sin cambios
+    if not request_profiler.requested(request):
+        return await call_next(request)
+
+    profile = request_profiler.start()
+    if profile is None:
+        response = await call_next(request)
+        response.headers["X-Profile"] = "limitado"
+        return response
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        request_profiler.finish(profile, method=request.method, path=request.url.path, status=500)
+        raise
+    route = request.scope.get("route")
+    metadata = request_profiler.finish(profile, method=request.method, path=request.url.path,
+                                       endpoint=getattr(route, "path", None),
+                                       userId=request.scope.get("path_params", {}).get("userId"),
+                                       status=response.status_code)
+    response.headers["X-Profile"] = metadata["id"]
+    return response
+
+# Verifica el token de administración de las rutas de perfiles
+def require_admin(request: Request):
+    if not request_profiler.authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+
 # Configurar Jinja2 para templates HTML
 templates = Jinja2Templates(directory="templates")
 
 # Cargar los modelos de recomendación
 MODEL_USER_PATH = "data/modelUser_pearson.joblib"
 MODEL_ITEM_PATH = "data/modelItem_pearson.joblib"
+# Índice podado de vecinos ítem-ítem (python -m recommender.item_index)
+ITEM_INDEX_PATH = "data/itemIndex_pearson.npz"
+# Artefactos con memoria mapeada (python -m recommender.artifacts); si existen,
+# se usan en lugar de los archivos anteriores
+MODEL_USER_ARTIFACT = "data/models/user"
+MODEL_ITEM_ARTIFACT = "data/models/item"
+# Modelo de factorización matricial (python -m recommender.mf); opcional
+MODEL_MF_ARTIFACT = "data/models/mf"
+# Recomendaciones precalculadas por lotes (python -m recommender.precompute)
+PRECOMPUTED_DIR = "data/precomputed"
+
+# Procesos para la puntuación de recomendaciones (0: en el proceso del servidor)
+SCORING_PROCESSES = int(os.getenv("SCORING_PROCESSES", "0"))
+# Segundos entre revisiones de nuevas versiones de los modelos en disco (0: desactivado)
+MODEL_WATCH_INTERVAL = int(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+# Segundos entre lotes de ratings aplicados a los modelos (0: desactivado) y
+# ratings pendientes (o MB de cambios pendientes) que disparan la exportación
+# de una versión compactada
+MODEL_UPDATE_INTERVAL = int(os.getenv("MODEL_UPDATE_INTERVAL", "5"))
+MODEL_COMPACT_THRESHOLD = int(os.getenv("MODEL_COMPACT_THRESHOLD", "10000"))
+MODEL_COMPACT_MB = int(os.getenv("MODEL_COMPACT_MB", "256"))
+
+scoring_service = ScoringService(processes=SCORING_PROCESSES)
+
+# Los modelos se cargan en segundo plano al iniciar el servidor y se pueden
+# recargar en caliente (/models/reload); mientras cargan, las rutas de
+# recomendación responden 503
+model_registry = ModelRegistry(scoring_service, {
+    "user": ModelSource(MODEL_USER_ARTIFACT, MODEL_USER_PATH),
+    "item": ModelSource(MODEL_ITEM_ARTIFACT, MODEL_ITEM_PATH, ITEM_INDEX_PATH),
+    "mf": ModelSource(MODEL_MF_ARTIFACT, required=False),
+}, watch_interval=MODEL_WATCH_INTERVAL)
+
+# Los ratings nuevos se aplican por lotes a los modelos publicados, sin reentrenarlos;
+# al publicar cada lote se descartan las recomendaciones en caché de sus usuarios
+def invalidate_updated_users(userIds):
+    for userId in userIds:
+        invalidate_user_recommendations(userId)
+
+model_updater = IncrementalUpdater(model_registry, interval=MODEL_UPDATE_INTERVAL,
+                                   compact_threshold=MODEL_COMPACT_THRESHOLD,
+                                   compact_bytes=MODEL_COMPACT_MB * 2 ** 20,
+                                   on_publish=invalidate_updated_users)
+
+# Tiempo de expiración de la caché (por ejemplo, 1 hora) y número máximo de entradas.
+# Las entradas se identifican por la revisión del modelo (versión y ratings
+# incrementales aplicados): al publicar una nueva versión o un lote de ratings,
+# que cambia las similitudes de todos los usuarios, las recomendaciones
+# anteriores dejan de usarse sin esperar el TTL
+CACHE_EXPIRY = timedelta(seconds=int(os.getenv("CACHE_TTL_SECONDS", "3600")))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+# Caché de recomendaciones acotada (LRU), con expiración en segundo plano
+recommendations_cache = RecommendationCache(max_entries=CACHE_MAX_ENTRIES,
+                                            ttl=CACHE_EXPIRY.total_seconds())
+
+# Las peticiones simultáneas que no encuentran en caché las recomendaciones de
+# un mismo usuario, modelo y versión esperan un solo cálculo, a lo sumo
+# RECOMMENDATION_TIMEOUT_SECONDS segundos (0: sin límite)
+RECOMMENDATION_TIMEOUT = int(os.getenv("RECOMMENDATION_TIMEOUT_SECONDS", "30"))
+recommendation_flights = SingleFlight(timeout=RECOMMENDATION_TIMEOUT or None)
+
+# Descarta las recomendaciones en caché de un usuario y desvincula sus cálculos
+# en curso: las peticiones siguientes calculan de nuevo en lugar de esperar un
+# cálculo con los ratings anteriores (que tampoco se guarda en caché)
+def invalidate_user_recommendations(userId):
+    recommendations_cache.invalidate_user(userId)
+    recommendation_flights.forget(lambda key: key[1] == userId)
+
+# Las rutas con acceso a base de datos son síncronas y se ejecutan en un pool
+# de hilos acotado; el cálculo de recomendaciones usa un pool dedicado para no
+# acaparar los hilos de las rutas ligeras (login, catálogo, ratings).
+# La puntuación en el proceso del servidor compite por el GIL: más hilos no
+# aumentan el rendimiento y sí la latencia de las demás rutas, por eso el valor
+# por defecto es 1, o uno por proceso de puntuación (SCORING_PROCESSES)
+DB_THREADS = int(os.getenv("DB_THREADS", "40"))
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", str(max(1, SCORING_PROCESSES))))
+scoring_executor = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix="scoring")
+
+# Usuarios existentes en memoria (se recarga al cargar un nuevo archivo de ratings)
+user_registry = UserRegistry()
+
+# Catálogo de películas en memoria (se recarga al cargar un nuevo archivo de películas)
+movie_catalog = CatalogStore()
+
+# Función para obtener el catálogo de películas vigente
+def get_catalog(db: Session):
+    return movie_catalog.get(db)
+
+# Cursor de paginación de /movies: clave (título, movieId) de la última película entregada
+def encode_movie_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_movie_cursor(cursor: str):
+    try:
+        title, movieId = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(title), int(movieId)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
 
-model_user = None
-model_item = None
-
-try:
-    model_user = joblib.load(MODEL_USER_PATH)
-    model_item = joblib.load(MODEL_ITEM_PATH)
-except Exception as e:
-    print(f"Error cargando los modelos: {e}")
-
-# Variable global para almacenar en caché las recomendaciones
-recommendations_cache = {}
-
-# Tiempo de expiración de la caché (por ejemplo, 1 hora)
-CACHE_EXPIRY = timedelta(hours=1)
-
-# Función para obtener el conjunto de usuarios y el ID máximo
-def get_users_set_and_max_id(db: Session):
-    
-    max_id_result = db.query(func.max(DBUser.userId)).scalar()
-    max_user_id = max_id_result if max_id_result else 0
-
-    users_set = {user_id for (user_id,) in db.query(DBUser.userId).all()}
+# Ranking de popularidad precalculado (se recalcula al cargar ratings)
+popularity = PopularityRanking()
 
-    return users_set, max_user_id
+# Número máximo de ratings por petición en /user/{userId}/ratings
+MAX_RATING_BATCH = int(os.getenv("MAX_RATING_BATCH", "1000"))
 
-# Función para obtener un diccionario de películas
-def get_movies_dict(db: Session):
-    movies = db.query(DBMovie).all()
-    return {
-        movie.movieId: {
-            'title': movie.title,
-            'genres': movie.genres
-        } for movie in movies
-    }
+# Cola de trabajos para la carga de archivos en segundo plano
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "1"))
+upload_jobs = JobQueue(max_workers=UPLOAD_WORKERS)
 
 def get_from_cache(key):
-    if key in recommendations_cache:
-        timestamp, data = recommendations_cache[key]
-        # Verificar si la caché ha expirado
-        if datetime.now() - timestamp < CACHE_EXPIRY:
-            return data
-        else:
-            # Borrar caché expirada
-            del recommendations_cache[key]
-    return None
-
-def set_in_cache(key, data):
-    recommendations_cache[key] = (datetime.now(), data)
+    return recommendations_cache.get(key)
+
+def set_in_cache(key, data, userId=None, generation=None):
+    return recommendations_cache.set(key, data, userId=userId, generation=generation)
 
 # Función para obtener las películas más populares (para nuevos usuarios)
 def get_popular_movies(db: Session, n=20):
-    # Contar número de ratings por película
-    popular_movies_query = (
-        db.query(
-            DBRating.movieId,
-            func.count(DBRating.id).label('count')
-        )
-        .group_by(DBRating.movieId)
-        .order_by(func.count(DBRating.id).desc())
-        .limit(n)
-    )
-    
-    popular_movie_ids = [movie.movieId for movie in popular_movies_query]
-    
-    # Obtener información de las películas populares
-    movies = (
-        db.query(DBMovie)
-        .filter(DBMovie.movieId.in_(popular_movie_ids))
-        .all()
-    )
+    # Tomar las películas con más ratings del ranking precalculado
+    popular_movie_ids = popularity.top(db, n).tolist()
     
-    # Crear resultado
-    result = []
-    for movie in movies:
-        result.append({
-            'movieId': movie.movieId,
-            'title': movie.title,
-            'genres': movie.genres
-        })
-    
-    return result
+    # Obtener información de las películas populares desde el catálogo
+    catalog = get_catalog(db)
+    movies = (catalog.get(movieId) for movieId in popular_movie_ids)
+
+    return [movie for movie in movies if movie is not None]
 
 # Función para obtener el historial de ratings de un usuario
 def get_user_ratings(db: Session, userId):
@@ -179,259 +369,326 @@ def get_user_ratings(db: Session, userId):
     
     return result
 
-# Función para generar recomendaciones user-user
-def get_user_based_recommendations(db: Session, userId, n=100, filter_ratings=None):
-    if model_user is None:
-        raise HTTPException(status_code=500, detail="Modelo user-user no disponible")
+# Función para convertir el parámetro filter_ratings en una lista de bandas
+def parse_filter_ratings(filter_ratings):
+    if not filter_ratings or filter_ratings == 'all':
+        return None
 
-    user_exists = db.query(func.count(DBUser.userId)).filter(DBUser.userId == userId).scalar() > 0
+    # Convertir filter_ratings a una lista de enteros si es una cadena separada por comas
+    try:
+        filter_list = [int(r) for r in str(filter_ratings).split(',')]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Filtro de ratings inválido")
+
+    log.info("filter_ratings", filter=filter_list)
+    return filter_list
+
+# Verifica que el modelo esté publicado; mientras se carga responde 503
+def require_model(name, description):
+    if name not in scoring_service:
+        if model_registry.status(name) in ("pending", "loading"):
+            raise HTTPException(status_code=503, detail=f"Modelo {description} cargando")
+        raise HTTPException(status_code=500, detail=f"Modelo {description} no disponible")
+
+# Ratings del usuario en la base de datos (movieId -> rating)
+def get_user_rating_map(db: Session, userId):
+    user_rated_query = db.query(DBRating.movieId, DBRating.rating).filter(DBRating.userId == userId)
+    return {rating.movieId: rating.rating for rating in user_rated_query}
+
+class PrefetchDiscarded(Exception):
+    """El usuario de un precálculo se invalidó antes de puntuar y el cálculo se abandonó."""
+
+# Precálculo en curso en cada hilo del pool de puntuación: función que indica
+# si se descartó (ver compute_recommendations)
+scoring_thread = threading.local()
+
+# Abandona el precálculo del hilo si se descartó (cierre de sesión, nuevo rating)
+# antes de enviarlo a puntuar. La puntuación ya iniciada, en el hilo o en un
+# proceso de puntuación, no se puede interrumpir: termina y su resultado no se
+# guarda en caché (la generación del usuario cambió)
+def check_discarded():
+    discarded = getattr(scoring_thread, "discarded", None)
+    if discarded is not None and discarded():
+        raise PrefetchDiscarded()
+
+# Función para generar recomendaciones user-user; se calculan una sola vez por
+# usuario y se filtran/paginan en cada petición
+def get_user_based_recommendations(db: Session, userId):
+    require_model("user", "user-user")
+
+    with stage_latency.time(model="user", stage="user_check"):
+        user_exists = user_registry.exists(db, userId)
     
     # Verificar si el usuario existe en los datos
     if not user_exists:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    # Obtener películas que el usuario ya calificó
-    user_rated_query = db.query(DBRating.movieId).filter(DBRating.userId == userId)
-    user_rated_movies = {rating.movieId for rating in user_rated_query}
+    # Obtener películas que el usuario ya calificó; sus ratings permiten puntuar
+    # a los usuarios creados después del entrenamiento del modelo
+    with stage_latency.time(model="user", stage="rated_query"):
+        user_ratings = get_user_rating_map(db, userId)
+    user_rated_movies = set(user_ratings)
 
-    # Obtener todas las películas
-    all_movies_query = db.query(DBMovie.movieId)
-    all_movies = {movie.movieId for movie in all_movies_query}
+    # Películas del catálogo no calificadas; para mejor rendimiento, limitar
+    # a las 500 más populares según el ranking precalculado
+    with stage_latency.time(model="user", stage="catalog"):
+        catalog = get_catalog(db)
+    with stage_latency.time(model="user", stage="popularity"):
+        movies_sample = popularity.top_unrated(db, catalog.movie_ids, user_rated_movies, 500).tolist()
 
-    # Filtrar películas a predecir
-    movies_to_predict = all_movies - user_rated_movies
-    
-    # Para mejor rendimiento, limitar el número de películas a predecir
-    movies_sample = list(movies_to_predict)
-    if len(movies_sample) > 500:
-        # Obtener las películas más populares
-        popular_movies_query = (
-            db.query(
-                DBRating.movieId,
-                func.count(DBRating.id).label('count')
-            )
-            .filter(DBRating.movieId.in_(movies_sample))
-            .group_by(DBRating.movieId)
-            .order_by(func.count(DBRating.id).desc())
-            .limit(500)
-        )
-        
-        movies_sample = [movie.movieId for movie in popular_movies_query]
-
-    # Obtener diccionario de películas
-    movies_dict = get_movies_dict(db)
-
-    # Preprocesar el filtro de ratings
-    filter_list = None
-    if filter_ratings and filter_ratings != 'all':
-        # Convertir filter_ratings a una lista de enteros si es una cadena separada por comas
-        if isinstance(filter_ratings, str):
-            try:
-                filter_list = [int(r) for r in filter_ratings.split(',')]
-            except ValueError:
-                # Si hay un error al convertir, usar el valor original
-                filter_list = [int(filter_ratings)]
-        else:
-            filter_list = [int(filter_ratings)]
-        
-        print(f"Filtrando resultados por ratings: {filter_list}")
-
-    recommendations = []
-    raw_predictions = []  # Almacenar todas las predicciones para filtrar después
-
-    for movieId in movies_sample:
-        try:
-            # Obtener predicción del modelo
-            prediction = model_user.predict(userId, movieId)
-
-            # Si la predicción es None, continuar con la siguiente
-            if prediction is None:
-                continue
-
-            # Extraer rating estimado y detalles
-            pred_rating = prediction.est
-            details = prediction.details if hasattr(prediction, 'details') else {}
-
-            # Validar si la predicción es imposible
-            if details.get('was_impossible', True):
-               continue  # Omitir predicciones imposibles
-
-            if movieId in movies_dict:
-                raw_predictions.append({
-                    'movieId': int(movieId),
-                    'title': movies_dict[movieId]['title'],
-                    'genres': movies_dict[movieId]['genres'],
-                    'predicted_rating': float(pred_rating)
-                })
-        except Exception as e:
-            print(f"❌ UserBaseRecommendations: Error prediciendo para película {movieId}: {e}")
-            continue  # Continuar con la siguiente película si hay error
-
-    # Aplicar filtro si existe
-    if filter_list:
-        for item in raw_predictions:
-            rating_value = round(item['predicted_rating'],1)
-            
-            for filter_value in filter_list:
-                if filter_value <= rating_value < filter_value + 1:
-                    recommendations.append({
-                        'movieId': item['movieId'],
-                        'title': item['title'],
-                        'genres': item['genres'],
-                        'predicted_rating': round(item['predicted_rating'], 2)
-                    })
-                    break  # Salir del bucle una vez que se ha encontrado una coincidencia
-    else:
-        # Si no hay filtro, usar todas las predicciones
-        recommendations = [{
-            'movieId': item['movieId'],
-            'title': item['title'],
-            'genres': item['genres'],
-            'predicted_rating': round(item['predicted_rating'], 2)
-        } for item in raw_predictions]
+    # Puntuar todas las películas candidatas en una sola operación vectorizada
+    check_discarded()
+    with stage_latency.time(model="user", stage="scoring"):
+        estimates, impossible = scoring_service.score("user", userId, movies_sample, ratings=user_ratings)
 
-    # Ordenar por rating estimado
-    recommendations.sort(key=lambda x: x['predicted_rating'], reverse=True)
+    with stage_latency.time(model="user", stage="ranking"):
+        candidates = ScoredCandidates.from_predictions(movies_sample, estimates, impossible, catalog)
 
-    print(f"🔹 UBR Total recomendaciones generadas: {len(recommendations)}")
-    if filter_list:
-        print(f"🔹 UBR Recomendaciones después del filtro {filter_list}: {len(recommendations)}")
+    log.info("recommendations", model="user", userId=userId, total=len(candidates))
 
-    # Limitar al número solicitado
-    return recommendations[:n]
+    return candidates
 
-# Función para generar recomendaciones item-item
-def get_item_based_recommendations(db: Session, userId, n=100, filter_ratings=None):
-    if model_item is None:
-        raise HTTPException(status_code=500, detail="Modelo item-item no disponible")
+# Función para generar recomendaciones item-item; se calculan una sola vez por
+# usuario y se filtran/paginan en cada petición
+def get_item_based_recommendations(db: Session, userId):
+    require_model("item", "item-item")
 
-    # Obtener el conjunto de usuarios
-    users_set, _ = get_users_set_and_max_id(db)
+    with stage_latency.time(model="item", stage="user_check"):
+        user_exists = user_registry.exists(db, userId)
 
     # Verificar si el usuario existe en los datos
-    if userId not in users_set:
+    if not user_exists:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    # Obtener películas que el usuario ya calificó
-    user_rated_query = db.query(DBRating.movieId).filter(DBRating.userId == userId)
-    user_rated_movies = {rating.movieId for rating in user_rated_query}
+    # Obtener películas que el usuario ya calificó; sus ratings permiten puntuar
+    # a los usuarios creados después del entrenamiento del modelo
+    with stage_latency.time(model="item", stage="rated_query"):
+        user_ratings = get_user_rating_map(db, userId)
+    user_rated_movies = set(user_ratings)
 
-    # Obtener todas las películas
-    all_movies_query = db.query(DBMovie.movieId)
-    all_movies = {movie.movieId for movie in all_movies_query}
+    # Películas del catálogo no calificadas; para mejor rendimiento, limitar
+    # a las 500 más populares según el ranking precalculado
+    with stage_latency.time(model="item", stage="catalog"):
+        catalog = get_catalog(db)
+    with stage_latency.time(model="item", stage="popularity"):
+        movies_sample = popularity.top_unrated(db, catalog.movie_ids, user_rated_movies, 500).tolist()
 
-    # Filtrar películas a predecir
-    movies_to_predict = all_movies - user_rated_movies
-    
-    # Para mejor rendimiento, limitar el número de películas a predecir
-    movies_sample = list(movies_to_predict)
-    if len(movies_sample) > 500:
-        # Obtener las películas más populares
-        popular_movies_query = (
-            db.query(
-                DBRating.movieId,
-                func.count(DBRating.id).label('count')
-            )
-            .filter(DBRating.movieId.in_(movies_sample))
-            .group_by(DBRating.movieId)
-            .order_by(func.count(DBRating.id).desc())
-            .limit(500)
-        )
-        
-        movies_sample = [movie.movieId for movie in popular_movies_query]
-
-    # Obtener diccionario de películas
-    movies_dict = get_movies_dict(db)
-
-    # Preprocesar el filtro de ratings
-    filter_list = None
-    if filter_ratings and filter_ratings != 'all':
-        # Convertir filter_ratings a una lista de enteros si es una cadena separada por comas
-        if isinstance(filter_ratings, str):
-            try:
-                filter_list = [int(r) for r in filter_ratings.split(',')]
-            except ValueError:
-                # Si hay un error al convertir, usar el valor original
-                filter_list = [int(filter_ratings)]
-        else:
-            filter_list = [int(filter_ratings)]
-        
-        print(f"Filtrando resultados por ratings: {filter_list}")
+    # Puntuar todas las candidatas cruzando sus vecinos con las películas calificadas
+    check_discarded()
+    with stage_latency.time(model="item", stage="scoring"):
+        estimates, impossible = scoring_service.score("item", userId, movies_sample, ratings=user_ratings)
 
-    recommendations = []
-    raw_predictions = []  # Almacenar todas las predicciones para filtrar después
+    with stage_latency.time(model="item", stage="ranking"):
+        candidates = ScoredCandidates.from_predictions(movies_sample, estimates, impossible, catalog)
 
-    for movieId in movies_sample:
-        try:
-            # Obtener predicción del modelo
-            prediction = model_item.predict(userId, movieId)
-
-            # Verificar si el modelo devolvió un resultado válido
-            if prediction is None:
-                continue
-
-            # Extraer rating estimado y detalles
-            pred_rating = getattr(prediction, "est", None)
-            details = getattr(prediction, "details", {})
-
-            # Si no hay rating, continuar
-            if pred_rating is None:
-                continue
-
-            # Validar si la predicción es imposible
-            if details.get('was_impossible', True):
-                continue  # Omitir predicciones imposibles
-            
-            if movieId in movies_dict:
-                raw_predictions.append({
-                    'movieId': int(movieId),
-                    'title': movies_dict[movieId]['title'],
-                    'genres': movies_dict[movieId]['genres'],
-                    'predicted_rating': float(pred_rating)
-                })
-        except Exception as e:
-            print(f"❌ ItemBaseRecommendations: Error prediciendo para película {movieId}: {e}")
-            continue  # Continuar con la siguiente película si hay error
-    
-    # For debugging
-    if filter_list:
-        for filter_value in filter_list:
-            ratings_in_range = [item['predicted_rating'] for item in raw_predictions 
-                            if filter_value <= round(item['predicted_rating'], 1) < filter_value + 1]
-            print(f"Filter {filter_value}: Found {len(ratings_in_range)} items with ratings {min(ratings_in_range, default=0)}-{max(ratings_in_range, default=0)}")
-
-    # Aplicar filtro si existe
-    if filter_list:
-        for item in raw_predictions:
-            rating_value = round(item['predicted_rating'],1)
-            
-            for filter_value in filter_list:
-                if filter_value <= rating_value < filter_value + 1:
-                    recommendations.append({
-                        'movieId': item['movieId'],
-                        'title': item['title'],
-                        'genres': item['genres'],
-                        'predicted_rating': round(item['predicted_rating'], 2)
-                    })
-                    break  # Salir del bucle una vez que se ha encontrado una coincidencia
-    else:
-        # Si no hay filtro, usar todas las predicciones
-        recommendations = [{
-            'movieId': item['movieId'],
-            'title': item['title'],
-            'genres': item['genres'],
-            'predicted_rating': round(item['predicted_rating'], 2)
-        } for item in raw_predictions]
+    log.info("recommendations", model="item", userId=userId, total=len(candidates))
+
+    return candidates
+
+# Función para generar recomendaciones con factorización matricial: el modelo
+# puntúa todo el catálogo, sin limitar las candidatas a las más populares
+def get_mf_recommendations(db: Session, userId):
+    require_model("mf", "de factorización")
 
-    # Ordenar por rating estimado
-    recommendations.sort(key=lambda x: x['predicted_rating'], reverse=True)
+    with stage_latency.time(model="mf", stage="user_check"):
+        user_exists = user_registry.exists(db, userId)
 
-    print(f"🔹 IBR Total recomendaciones generadas: {len(recommendations)}")
-    if filter_list:
-        print(f"🔹 IBR Recomendaciones después del filtro {filter_list}: {len(recommendations)}")
+    # Verificar si el usuario existe en los datos
+    if not user_exists:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    # Películas que el usuario ya calificó (se excluyen); sus ratings permiten
+    # proyectar a los usuarios creados después del entrenamiento del modelo
+    with stage_latency.time(model="mf", stage="rated_query"):
+        user_ratings = get_user_rating_map(db, userId)
+
+    # Un producto matriz-vector sobre todo el catálogo y selección parcial de las 500 mejores
+    check_discarded()
+    with stage_latency.time(model="mf", stage="scoring"):
+        movieIds, estimates = scoring_service.top_n("mf", userId, 500, exclude=user_ratings, ratings=user_ratings)
+
+    with stage_latency.time(model="mf", stage="catalog"):
+        catalog = get_catalog(db)
+    with stage_latency.time(model="mf", stage="ranking"):
+        candidates = ScoredCandidates.from_predictions(movieIds, estimates, np.zeros(len(movieIds), dtype=bool), catalog)
+
+    log.info("recommendations", model="mf", userId=userId, total=len(candidates))
+
+    return candidates
+
+# Recomendaciones precalculadas vigentes por modelo (None si no hay)
+precomputed = {"user": None, "item": None}
+
+# Métricas leídas al exponer /metrics: caché, modelos publicados y precalculadas
+metrics.gauge("recommendation_cache_lookups_total", "Consultas a la caché de recomendaciones",
+              ("result",), kind="counter",
+              collect=lambda: [(("hit",), recommendations_cache.hits),
+                               (("miss",), recommendations_cache.misses)])
+metrics.gauge("recommendation_cache_hit_ratio", "Fracción de consultas resueltas por la caché",
+              collect=lambda: [((), recommendations_cache.stats()["hit_rate"])])
+metrics.gauge("recommendation_cache_entries", "Entradas en la caché de recomendaciones",
+              collect=lambda: [((), recommendations_cache.stats()["entries"])])
+metrics.gauge("recommendation_cache_stale_writes_total",
+              "Cálculos no guardados en caché porque el usuario se invalidó mientras se calculaban",
+              kind="counter", collect=lambda: [((), recommendations_cache.stale_writes)])
+metrics.gauge("recommender_model_info", "Versión publicada y estado de cada modelo",
+              ("model", "version", "status"),
+              collect=lambda: [((name, state["version"] or "", state["status"]), 1)
+                               for name, state in model_registry.stats().items()])
+metrics.gauge("recommender_model_incremental_updates", "Ratings integrados a la versión publicada",
+              ("model",), collect=lambda: [((name,), state["updates"])
+                                           for name, state in model_registry.stats().items()])
+metrics.gauge("recommendation_computations_in_flight", "Cálculos de recomendaciones en curso",
+              collect=lambda: [((), len(recommendation_flights))])
+metrics.gauge("recommendation_prefetch_total", "Precálculos de recomendaciones según su resultado",
+              ("result",), kind="counter",
+              collect=lambda: [((result,), count) for result, count in sorted(prefetch_queue.counts().items())])
+metrics.gauge("recommendation_prefetch_pending", "Precálculos de recomendaciones en cola",
+              collect=lambda: [((), len(prefetch_queue))])
+metrics.gauge("registered_users", "Usuarios en el registro en memoria",
+              collect=lambda: [((), user_registry.stats()["users"])])
+metrics.gauge("precomputed_stale_users", "Usuarios con recomendaciones precalculadas desactualizadas",
+              ("model", "version"),
+              collect=lambda: [((kind, store.version), store.stats()["stale_users"])
+                               for kind, store in precomputed.items() if store is not None])
+
+# Carga la versión vigente de las recomendaciones precalculadas; los usuarios con
+# ratings posteriores al cálculo se calculan en línea
+def load_precomputed():
+    db = SessionLocal()
+    try:
+        for kind in precomputed:
+            store = PrecomputedStore.load(os.path.join(PRECOMPUTED_DIR, kind))
+            if store is not None:
+                store.mark_stale(changed_users(db, store.built_at))
+                print(f"🔹 Recomendaciones {kind} precalculadas: versión {store.version}")
+            precomputed[kind] = store
+    except Exception as e:
+        print(f"❌ Error cargando las recomendaciones precalculadas: {e}")
+    finally:
+        db.close()
+
+# Página de recomendaciones precalculadas, si están vigentes para el usuario y el modelo.
+# Son una foto de la versión del modelo: los lotes de ratings incrementales solo
+# las invalidan para los usuarios que calificaron; las de los demás se usan hasta
+# publicar una nueva versión (por ejemplo, la compactada) y repetir el cálculo
+def get_precomputed_page(kind, userId, filter_list, offset, limit):
+    store = precomputed.get(kind)
+    catalog = movie_catalog.current()
+    if store is None or catalog is None or store.model_version != scoring_service.version(kind):
+        return None
+    return store.page(userId, catalog, filter_list, offset, limit)
+
+# Calcula las recomendaciones en un hilo del pool de puntuación, con su propia
+# sesión. ``discarded`` (precálculos) se revisa al tomar el hilo y antes de puntuar
+def compute_recommendations(recommender, userId, kind, submitted, discarded=None):
+    # Tiempo de espera por un hilo libre del pool de puntuación
+    stage_latency.observe(time.perf_counter() - submitted, model=kind, stage="queue")
+    scoring_thread.discarded = discarded
+    db = SessionLocal()
+    try:
+        check_discarded()
+        return recommender(db, userId)
+    finally:
+        scoring_thread.discarded = None
+        db.close()
+
+# Calcula las recomendaciones en el pool de puntuación y las guarda en caché. La
+# generación del usuario se toma antes de calcular: si se invalida mientras tanto
+# (nuevo rating, cierre de sesión, lote de ratings publicado en el modelo), el
+# resultado corresponde a los ratings anteriores y no se guarda. Un precálculo
+# (``prefetch``) en ese caso se abandona antes de puntuar (PrefetchDiscarded)
+async def compute_and_cache(kind, recommender, userId, cache_key, compute=compute_recommendations,
+                            prefetch=False):
+    loop = asyncio.get_running_loop()
+    generation = recommendations_cache.generation(userId)
+    discarded = None
+    if prefetch:
+        discarded = lambda: recommendations_cache.generation(userId) != generation
+    candidates = await loop.run_in_executor(scoring_executor, compute,
+                                            recommender, userId, kind, time.perf_counter(), discarded)
+    set_in_cache(cache_key, candidates, userId=userId, generation=generation)
+    return candidates
+
+# Recupera de caché o calcula las recomendaciones sin bloquear el event loop
+async def get_cached_recommendations(kind, recommender, userId):
+    cache_key = (kind, userId, scoring_service.revision(kind))
+
+    # Una petición perfilada siempre calcula, sin caché ni cálculos compartidos;
+    # se incluye en el perfil el hilo del pool que atiende la petición
+    profile = current_profile()
+    if profile is not None:
+        compute = functools.partial(profile.run_attached, compute_recommendations)
+        candidates = await compute_and_cache(kind, recommender, userId, cache_key, compute)
+        recommendations_served.inc(model=kind, source="computed")
+        return candidates
+
+    # Intentar recuperar de caché
+    candidates = get_from_cache(cache_key)
+    if candidates is not None:
+        recommendations_served.inc(model=kind, source="cache")
+        return candidates
+
+    # Si no está en caché, calcular las recomendaciones o esperar el cálculo en
+    # curso de otra petición (los errores, como un usuario inexistente, llegan a todas)
+    compute = lambda: compute_and_cache(kind, recommender, userId, cache_key)
+    try:
+        try:
+            candidates, coalesced = await recommendation_flights.run(cache_key, compute)
+        except PrefetchDiscarded:
+            # La petición esperaba un precálculo que se abandonó: el cálculo ya
+            # se desvinculó (invalidate_user_recommendations) y se inicia otro
+            candidates, coalesced = await recommendation_flights.run(cache_key, compute)
+    except asyncio.TimeoutError:
+        recommendation_timeouts.inc(model=kind)
+        raise HTTPException(status_code=504, detail="Tiempo de espera agotado calculando las recomendaciones")
+    recommendations_served.inc(model=kind, source="coalesced" if coalesced else "computed")
+    return candidates
+
+# Página de recomendaciones: primero las precalculadas y, si el usuario es nuevo
+# o está desactualizado, las calculadas en línea (con caché)
+async def get_recommendations_page(kind, recommender, userId, filter_list, offset, limit):
+    page = None
+    if current_profile() is None:
+        with stage_latency.time(model=kind, stage="precomputed"):
+            page = get_precomputed_page(kind, userId, filter_list, offset, limit)
+    if page is not None:
+        recommendations_served.inc(model=kind, source="precomputed")
+        return page
+
+    # Las predicciones se guardan en caché sin filtrar: todas las combinaciones
+    # de filter_ratings y de paginación comparten la misma entrada. Si no están
+    # en caché se calculan fuera del event loop (verifica que el usuario exista)
+    candidates = await get_cached_recommendations(kind, recommender, userId)
+
+    # Aplicar filtro y paginación
+    with stage_latency.time(model=kind, stage="filtering"):
+        return candidates.page(filter_list, offset, limit)
+
+# Funciones de recomendación de cada modelo
+RECOMMENDERS = {"user": get_user_based_recommendations, "item": get_item_based_recommendations,
+                "mf": get_mf_recommendations}
+
+# Al iniciar sesión o crear un usuario se precalculan en segundo plano sus
+# recomendaciones user-user e item-item, para que la primera página salga de
+# la caché. La cola guarda a lo sumo PREFETCH_QUEUE_SIZE precálculos (0 la
+# desactiva) y solo avanza cuando no hay cálculos de peticiones en curso
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", "1000"))
+PREFETCH_MODELS = ("user", "item")
+
+async def prefetch_recommendations(kind, userId):
+    cache_key = (kind, userId, scoring_service.revision(kind))
+    if get_from_cache(cache_key) is not None or get_precomputed_page(kind, userId, None, 0, 1) is not None:
+        return "skipped"
+    try:
+        await recommendation_flights.run(
+            cache_key, lambda: compute_and_cache(kind, RECOMMENDERS[kind], userId, cache_key, prefetch=True))
+    except PrefetchDiscarded:
+        return "discarded"
+    return "computed"
 
-    # Limitar al número solicitado
-    return recommendations[:n]
+prefetch_queue = PrefetchQueue(prefetch_recommendations, max_pending=PREFETCH_QUEUE_SIZE,
+                               busy=lambda: len(recommendation_flights) > 0)
 
 # Rutas de la API
 @app.get("/", response_class=HTMLResponse)
@@ -439,13 +696,14 @@ async def read_root(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.post("/login")
-async def login(request: Request, userId: int = Form(...), db: Session = Depends(get_db)):
-    # Verificar el usuario en la base de datos
-    user = db.query(DBUser).filter(DBUser.userId == userId).first()
-    
-    if not user:
+def login(request: Request, userId: int = Form(...), db: Session = Depends(get_db)):
+    # Verificar el usuario en el registro en memoria
+    if not user_registry.exists(db, userId):
         return templates.TemplateResponse("login.html", {"request": request, "error": "Usuario no encontrado"})
     
+    # Precalcular las recomendaciones mientras se carga la página principal
+    prefetch_queue.submit(userId, PREFETCH_MODELS)
+
     response = RedirectResponse(url=f"/index?userId={userId}", status_code=303)
     response.set_cookie(key="userId", value=str(userId))  # Guardar sesión
     return response
@@ -454,28 +712,17 @@ async def login(request: Request, userId: int = Form(...), db: Session = Depends
 async def logout(request: Request):
     # Intentar obtener el userId de la cookie
     userId = request.cookies.get("userId")
-    if userId:
-        # Convertir a entero si existe
-        try:
-            userId = int(userId)
-            print('userId',userId)
-            # Limpiar la caché para este usuario
-            keys_to_remove = []
-            for key in recommendations_cache.keys():
-                if key.startswith(f"user_{userId}"):
-                    keys_to_remove.append(key)
-            
-            for key in recommendations_cache.keys():
-                if key.startswith(f"item_{userId}"):
-                    keys_to_remove.append(key)
-
-            # Eliminar las claves de caché de este usuario
-            for key in keys_to_remove:
-                del recommendations_cache[key]
-            
-        except (ValueError, TypeError):
-            # Si la cookie no contiene un entero válido, ignorar
-            pass
+    # Convertir a entero si existe
+    try:
+        userId = int(userId) if userId else None
+    except (ValueError, TypeError):
+        # Si la cookie no contiene un entero válido, ignorar
+        userId = None
+
+    if userId is not None:
+        # Limpiar la caché, los cálculos en curso y los precálculos pendientes para este usuario
+        invalidate_user_recommendations(userId)
+        prefetch_queue.discard(userId)
     
     # Redirigir y eliminar cookie
     response = RedirectResponse(url="/")
@@ -487,30 +734,46 @@ async def index(request: Request, userId: int):
     return templates.TemplateResponse("index.html", {"request": request, "userId": userId})
 
 @app.get("/users", response_model=List[User])
-async def get_users(db: Session = Depends(get_db), limit: int = 300):
+def get_users(db: Session = Depends(get_db), limit: int = 300):
     users_db = db.query(DBUser).limit(limit).all()
     return [{"userId": user.userId, "username": user.userName or f"Usuario {user.userId}"} for user in users_db]
 
 @app.get("/movies", response_model=List[Movie])
-async def get_movies(
+def get_movies(
+    response: Response,
     db: Session = Depends(get_db), 
     limit: int = Query(100, gt=0, le=1000),  # Limita el número de resultados entre 1 y 1000
     offset: int = Query(0, ge=0),  # Permite paginación
-    order: str = Query("asc", regex="^(asc|desc)$")  # Permite ordenar dinámicamente
+    order: str = Query("asc", regex="^(asc|desc)$"),  # Permite ordenar dinámicamente
+    after: Optional[str] = Query(None)  # Cursor de la página anterior (X-Next-Cursor); reemplaza a offset
     ):
     
-    order_by_column = asc(DBMovie.title) if order == "asc" else desc(DBMovie.title)
-
-    movies_db = db.query(DBMovie).order_by(order_by_column).offset(offset).limit(limit).all()
-
-    return [{"movieId": movie.movieId, "title": movie.title, "genres": movie.genres} for movie in movies_db]
+    # Paginar sobre la vista del catálogo ordenada por título: por cursor
+    # (búsqueda binaria de la clave) o, si no se indica, por offset
+    catalog = get_catalog(db)
+    if after is None and offset > 0:
+        return catalog.page(offset=offset, limit=limit, order=order)
+
+    movies, last = catalog.page_after(decode_movie_cursor(after) if after else None, limit=limit, order=order)
+    if last is not None:
+        response.headers["X-Next-Cursor"] = encode_movie_cursor(last)
+    return movies
+
+@app.get("/movies/search", response_model=List[Movie])
+def search_movies(
+    db: Session = Depends(get_db),
+    q: str = Query(..., max_length=200),
+    limit: int = Query(20, gt=0, le=100)
+    ):
+    # Búsqueda por título sobre el índice en memoria del catálogo (búsqueda mientras se escribe)
+    return get_catalog(db).search(q, limit=limit)
 
 @app.get("/popular-movies", response_model=List[Movie])
-async def get_popular(db: Session = Depends(get_db)):
+def get_popular(db: Session = Depends(get_db)):
     return get_popular_movies(db)
 
 @app.get("/user/{userId}", response_model=User)
-async def get_user(userId: int, db: Session = Depends(get_db)):
+def get_user(userId: int, db: Session = Depends(get_db)):
     try:
         user = db.query(DBUser).filter(DBUser.userId == userId).first()
        
@@ -529,38 +792,19 @@ async def get_user(userId: int, db: Session = Depends(get_db)):
 
 
 @app.get("/user/{userId}/ratings", response_model=List[Dict])
-async def get_ratings(userId: int, db: Session = Depends(get_db)):
+def get_ratings(userId: int, db: Session = Depends(get_db)):
     return get_user_ratings(db, userId)
 
 @app.get("/user/{userId}/recommendations/user-based", response_model=PaginatedResponse)
-async def get_user_recommendations(userId: int, db: Session = Depends(get_db), limit: int = 9, offset: int = 0, filter_ratings: Optional[str] = None):
-    # Verificar si el usuario existe
-    user_exists = db.query(DBUser.userId).filter(DBUser.userId == userId).first() is not None
-    
-    if not user_exists:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
-    # Crear una clave de caché única
-    cache_key = f"user_{userId}_filter_{filter_ratings}"
-    
-    # Intentar recuperar de caché
-    all_recommendations = get_from_cache(cache_key)
-    
-    if all_recommendations is None:
-        # Si no está en caché, calcular las recomendaciones
-        all_recommendations = get_user_based_recommendations(db, userId, n=100, filter_ratings=filter_ratings)
-
-        # Ordenar de manera determinística
-        #all_recommendations.sort(key=lambda x: (-x["predicted_rating"], x["movieId"]))
-        
-        # Guardar en caché
-        set_in_cache(cache_key, all_recommendations)
-    
-    total = len(all_recommendations)
+async def get_user_recommendations(userId: int, limit: int = 9, offset: int = 0, filter_ratings: Optional[str] = None):
+    filter_list = parse_filter_ratings(filter_ratings)
 
-    # Aplicar paginación
-    paginated_recommendations = all_recommendations[offset:offset+limit]
+    # Recomendaciones precalculadas o, si no están vigentes, calculadas en línea
+    paginated_recommendations, total = await get_recommendations_page(
+        "user", get_user_based_recommendations, userId, filter_list, offset, limit)
 
+    # La validación y serialización de la respuesta se miden en el middleware
+    mark_handled("user")
     return {
         "items": paginated_recommendations,
         "total": total,
@@ -569,33 +813,14 @@ async def get_user_recommendations(userId: int, db: Session = Depends(get_db), l
     }
 
 @app.get("/user/{userId}/recommendations/item-based", response_model=PaginatedResponse)
-async def get_item_recommendations(userId: int, db: Session = Depends(get_db), limit: int = 9, offset: int = 0, filter_ratings: Optional[str] = None):
-    # Verificar si el usuario existe
-    user_exists = db.query(DBUser.userId).filter(DBUser.userId == userId).first() is not None
-    if not user_exists:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
-    # Crear una clave de caché única
-    cache_key = f"item_{userId}_filter_{filter_ratings}"
-    
-    # Intentar recuperar de caché
-    all_recommendations = get_from_cache(cache_key)
+async def get_item_recommendations(userId: int, limit: int = 9, offset: int = 0, filter_ratings: Optional[str] = None):
+    filter_list = parse_filter_ratings(filter_ratings)
 
-    if all_recommendations is None:
-        # Si no está en caché, calcular las recomendaciones
-        all_recommendations = get_item_based_recommendations(db, userId, n=100, filter_ratings=filter_ratings)
-        
-        # Ordenar de manera determinística
-        #all_recommendations.sort(key=lambda x: (-x["predicted_rating"], x["movieId"]))
-        
-        # Guardar en caché
-        set_in_cache(cache_key, all_recommendations)
-    
-    total = len(all_recommendations)
+    # Recomendaciones precalculadas o, si no están vigentes, calculadas en línea
+    paginated_recommendations, total = await get_recommendations_page(
+        "item", get_item_based_recommendations, userId, filter_list, offset, limit)
 
-    # Aplicar paginación
-    paginated_recommendations = all_recommendations[offset:offset+limit]
-    
+    mark_handled("item")
     # Retornar meta información para la paginación
     return {
         "items": paginated_recommendations,
@@ -604,137 +829,258 @@ async def get_item_recommendations(userId: int, db: Session = Depends(get_db), l
         "offset": offset
     }
 
+@app.get("/user/{userId}/recommendations/mf", response_model=PaginatedResponse)
+async def get_mf_recommendations_route(userId: int, limit: int = 9, offset: int = 0, filter_ratings: Optional[str] = None):
+    filter_list = parse_filter_ratings(filter_ratings)
+
+    paginated_recommendations, total = await get_recommendations_page(
+        "mf", get_mf_recommendations, userId, filter_list, offset, limit)
+
+    mark_handled("mf")
+    return {
+        "items": paginated_recommendations,
+        "total": total,
+        "limit": limit,
+        "offset": offset
+    }
+
 @app.post("/users/new")
-async def create_user(new_user: NewUser, db: Session = Depends(get_db)):
+def create_user(new_user: NewUser, db: Session = Depends(get_db)):
+    # Ratings iniciales (movieId -> rating); si una película se repite, se conserva su último rating
     try:
-        # Obtener el máximo ID de usuario
-        _, max_user_id = get_users_set_and_max_id(db)
-        
-        # Crear nuevo userId
-        new_id = max_user_id + 1
-        
-        # Crear el nuevo usuario en la base de datos
-        db_user = DBUser(userId=new_id, userName=new_user.username)  # Usar el nombre proporcionado
-        db.add(db_user)
-        
-        # Guardar ratings del nuevo usuario
-        timestamp = datetime.now().timestamp()
-        # Convertirlo a un objeto datetime 
-        timestamp_dt = datetime.fromtimestamp(timestamp)
+        ratings = {int(movieId): rating_value
+                   for rating_data in new_user.rating for movieId, rating_value in rating_data.items()}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Identificador de película inválido")
+    if not all(valid_rating(rating) for rating in ratings.values()):
+        raise HTTPException(status_code=400, detail="El rating debe estar entre 0.5 y 5.0, en medias estrellas")
+
+    # Verificar todas las películas en el catálogo en memoria; se omiten las que no existen
+    catalog = get_catalog(db)
+    ratings = {movieId: rating for movieId, rating in ratings.items() if movieId in catalog}
+
+    timestamp = datetime.now().timestamp()
+    # Convertirlo a un objeto datetime 
+    timestamp_dt = datetime.fromtimestamp(timestamp)
 
-        rating_count = 0
-        
-        for rating_data in new_user.rating:
-            for movieId, rating_value in rating_data.items():
-                # Verificar si existe la película
-                movie = db.query(DBMovie).filter(DBMovie.movieId == int(movieId)).first()
-                if movie:
-                    db_rating = DBRating(
-                        id=None,  # Autoincremento
-                        userId=new_id,
-                        movieId=int(movieId),
-                        rating=float(rating_value),
-                        timestamp=timestamp_dt
-                    )
-                    db.add(db_rating)
-                    rating_count += 1
-        
-        # Commit para guardar los cambios
+    try:
+        # La base de datos genera el userId, sin carreras entre registros simultáneos
+        new_id = db.execute(
+            insert(DBUser).values(userName=new_user.username).returning(DBUser.userId)
+        ).scalar_one()
+
+        # Guardar los ratings del nuevo usuario en una sola inserción
+        if ratings:
+            db.execute(insert(DBRating), [
+                {"userId": new_id, "movieId": movieId, "rating": rating, "timestamp": timestamp_dt}
+                for movieId, rating in ratings.items()
+            ])
         db.commit()
-        
-        return {"userId": new_id, "username": new_user.username, "num_ratings": rating_count}
-    
     except Exception as e:
         # Revertir transacción en caso de error
         db.rollback()
         print(f"Error al crear usuario: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error al crear usuario: {str(e)}")
 
-@app.post("/user/{userId}/rate")
-async def add_rating(userId: int, movieId: int, rating: float, db: Session = Depends(get_db)):
-    # Verificar si el usuario existe
-    user = db.query(DBUser).filter(DBUser.userId == userId).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
-    if rating < 0.5 or rating > 5.0:
-        raise HTTPException(status_code=400, detail="El rating debe estar entre 0.5 y 5.0")
-    
-    # Verificar si la película existe
-    movie = db.query(DBMovie).filter(DBMovie.movieId == movieId).first()
-    if not movie:
-        raise HTTPException(status_code=404, detail="Película no encontrada")
-    
-    # Verificar si ya existe un rating para este usuario y película
-    existing_rating = db.query(DBRating).filter(
-        DBRating.userId == userId,
-        DBRating.movieId == movieId
-    ).first()
-    
+    # Registrar el usuario y sumar sus ratings iniciales a la popularidad
+    user_registry.add([new_id])
+    popularity.increment(list(ratings))
+    prefetch_queue.submit(new_id, PREFETCH_MODELS)
+
+    return {"userId": new_id, "username": new_user.username, "num_ratings": len(ratings)}
+
+# Ratings en medias estrellas entre 0.5 y 5.0
+def valid_rating(rating):
+    return 0.5 <= rating <= 5.0 and float(rating * 2).is_integer()
+
+# Guarda los ratings de un usuario (movieId -> rating) en una transacción y
+# actualiza una sola vez la popularidad, las recomendaciones precalculadas, la
+# caché y la cola de actualización de los modelos
+def save_ratings(db: Session, userId, ratings):
+    if not all(valid_rating(rating) for rating in ratings.values()):
+        raise HTTPException(status_code=400, detail="El rating debe estar entre 0.5 y 5.0, en medias estrellas")
+
+    # Verificar en el catálogo en memoria que las películas existan
+    catalog = get_catalog(db)
+    missing = [movieId for movieId in ratings if movieId not in catalog]
+    if missing:
+        detail = "Película no encontrada" if len(ratings) == 1 else f"Películas no encontradas: {missing[:20]}"
+        raise HTTPException(status_code=404, detail=detail)
+
     timestamp = int(datetime.now().timestamp())
     # Convertirlo a un objeto datetime 
     timestamp_dt = datetime.fromtimestamp(timestamp)
-    
-    if existing_rating:
-        # Actualizar rating existente
-        existing_rating.rating = rating
-        existing_rating.timestamp = timestamp_dt
-    else:
-        # Agregar nuevo rating
-        new_rating = DBRating(
-            id=None,  # Autoincremento
-            userId=userId,
-            movieId=movieId,
-            rating=rating,
-            timestamp=timestamp_dt
-        )
-        db.add(new_rating)
-    
-    # Guardar cambios
-    db.commit()
 
-    # Limpiar la caché para este usuario
-    for key in list(recommendations_cache.keys()):
-        if key.startswith(f"user_{userId}") or key.startswith(f"item_{userId}"):
-            del recommendations_cache[key]
-    
-    return {"message": "Calificación guardada", "userId": userId, "movieId": movieId, "rating": rating}
+    # Una sola sentencia inserta o actualiza los ratings y verifica que el usuario exista
+    try:
+        inserted = upsert_ratings(db, userId, ratings, timestamp_dt)
+        if inserted is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
 
-@app.post("/upload/movie", tags=['Upload'])
-def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    # Leer datos del CSV
-    movie_data = pd.read_csv(file.file, 
-                             delimiter=',',
-                             index_col=False, 
-                             header=0)
-    
-    # Verificar que las columnas sean las correctas
-    expected_columns = {'movieId', 'title', 'genres'}
-    if not expected_columns.issubset(movie_data.columns):
-        return {"error": "El archivo CSV no tiene las columnas esperadas."}
-    
-    # Cargar 
-    create_movie(db, movie_data)
-
-    return {"message": "CSV movie uploaded successfully!"}
-
-@app.post("/upload/rating", tags=['Upload'])
-def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    # Leer datos del CSV
-    rating_data = pd.read_csv(file.file, 
-                             delimiter=',',
-                             index_col=False, 
-                             header=0)
-    
-    # Verificar que las columnas sean las correctas
-    expected_columns = {'userId','movieId','rating','timestamp'}
-    if not expected_columns.issubset(rating_data.columns):
-        return {"error": "El archivo CSV no tiene las columnas esperadas."}
-    
-    # Cargar 
-    create_rating(db, rating_data)
+    # Los ratings nuevos suman a la popularidad de las películas
+    popularity.increment(inserted)
 
-    return {"message": "CSV rating uploaded successfully!"}
+    # Las recomendaciones precalculadas del usuario quedan desactualizadas
+    for store in precomputed.values():
+        if store is not None:
+            store.mark_stale([userId])
+
+    # Aplicar los ratings a los modelos en el siguiente lote
+    if MODEL_UPDATE_INTERVAL > 0:
+        model_updater.add_many((userId, movieId, rating) for movieId, rating in ratings.items())
+
+    # Limpiar la caché para este usuario; las peticiones siguientes no esperan
+    # los cálculos en curso, que usan los ratings anteriores
+    invalidate_user_recommendations(userId)
+    prefetch_queue.discard(userId)
+    return inserted
+
+@app.post("/user/{userId}/rate")
+def add_rating(userId: int, movieId: int, rating: float, db: Session = Depends(get_db)):
+    save_ratings(db, userId, {movieId: rating})
+    return {"message": "Calificación guardada", "userId": userId, "movieId": movieId, "rating": rating}
+
+@app.post("/user/{userId}/ratings")
+def add_ratings(userId: int, batch: RatingBatch, db: Session = Depends(get_db)):
+    if not batch.ratings:
+        raise HTTPException(status_code=400, detail="No se enviaron ratings")
+    if len(batch.ratings) > MAX_RATING_BATCH:
+        raise HTTPException(status_code=400, detail=f"Se admiten a lo sumo {MAX_RATING_BATCH} ratings por petición")
+
+    # Si una película se repite, se conserva su último rating
+    ratings = {item.movieId: item.rating for item in batch.ratings}
+    inserted = save_ratings(db, userId, ratings)
+    return {"message": "Calificaciones guardadas", "userId": userId, "saved": len(ratings),
+            "inserted": len(inserted), "updated": len(ratings) - len(inserted)}
+
+# Guardar en disco el archivo recibido para procesarlo en segundo plano
+def save_upload(file: UploadFile):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp:
+        shutil.copyfileobj(file.file, tmp, length=1024 * 1024)
+        return tmp.name
+
+# Invalidar de una sola vez los datos derivados de la tabla cargada
+def invalidate_after_upload(kind):
+    if kind == "movie":
+        movie_catalog.invalidate()
+    else:
+        popularity.invalidate()
+        user_registry.invalidate()
+    recommendations_cache.clear()
+    # Las recomendaciones precalculadas dejan de usarse hasta el siguiente lote
+    for store in precomputed.values():
+        if store is not None:
+            store.invalidate()
+
+def load_movie_job(job, path):
+    db = SessionLocal()
+    try:
+        # Leer datos del CSV
+        movie_data = pd.read_csv(path, 
+                                 delimiter=',',
+                                 index_col=False, 
+                                 header=0)
+
+        # Verificar que las columnas sean las correctas
+        expected_columns = {'movieId', 'title', 'genres'}
+        if not expected_columns.issubset(movie_data.columns):
+            raise ValueError("El archivo CSV no tiene las columnas esperadas.")
+
+        # Cargar 
+        create_movie(db, movie_data[['movieId', 'title', 'genres']])
+        job.update(len(movie_data))
+        return {"rows": len(movie_data)}
+    finally:
+        db.close()
+
+def load_rating_job(job, path):
+    db = SessionLocal()
+    try:
+        # Cargar el CSV por bloques, reportando el avance en el trabajo
+        return create_rating(db, path, progress=job.update)
+    finally:
+        db.close()
+
+def submit_upload(kind, load_func, file: UploadFile):
+    path = save_upload(file)
+    job = upload_jobs.submit(kind, load_func, path,
+                             on_success=lambda: invalidate_after_upload(kind),
+                             on_finish=lambda: os.remove(path))
+    return {"message": "Carga encolada", "job_id": job.id, "status": job.status}
+
+@app.post("/upload/movie", tags=['Upload'], status_code=202)
+def upload_csv(file: UploadFile = File(...)):
+    return submit_upload("movie", load_movie_job, file)
+
+@app.post("/upload/rating", tags=['Upload'], status_code=202)
+def upload_csv(file: UploadFile = File(...)):
+    return submit_upload("rating", load_rating_job, file)
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    # Contadores de la caché de recomendaciones para monitoreo
+    return recommendations_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Histogramas de latencia, caché y versión de los modelos en formato de Prometheus
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready")
+async def get_ready():
+    # Disponible cuando todos los modelos requeridos están cargados
+    status_code = 200 if model_registry.ready() else 503
+    return JSONResponse(status_code=status_code,
+                        content={"ready": status_code == 200, "models": model_registry.stats()})
+
+@app.get("/models", tags=['Models'])
+async def get_models():
+    return model_registry.stats()
+
+@app.get("/models/updates", tags=['Models'])
+async def get_model_updates():
+    # Ratings pendientes y aplicados de forma incremental a los modelos
+    return model_updater.stats()
+
+@app.post("/models/reload", tags=['Models'], status_code=202)
+async def reload_models(model: Optional[str] = None):
+    # Recargar en segundo plano; las peticiones en curso terminan con la versión anterior
+    if model is not None and model not in model_registry.sources:
+        raise HTTPException(status_code=404, detail="Modelo no encontrado")
+    names = model_registry.reload([model] if model else None)
+    # Publicar también la versión vigente de las recomendaciones precalculadas
+    threading.Thread(target=load_precomputed, name="precomputed-load", daemon=True).start()
+    return {"message": "Recarga iniciada", "models": names}
+
+@app.get("/models/precomputed", tags=['Models'])
+async def get_precomputed():
+    return {kind: store.stats() if store is not None else None for kind, store in precomputed.items()}
+
+@app.get("/profiles", tags=['Profiling'], dependencies=[Depends(require_admin)])
+async def get_profiles():
+    # Perfiles guardados (userId, end-point, duración y muestras de cada uno)
+    return {"limited": request_profiler.limited, "profiles": request_profiler.list()}
+
+@app.get("/profiles/{profile_id}", tags=['Profiling'], dependencies=[Depends(require_admin)],
+         response_class=PlainTextResponse)
+async def get_profile(profile_id: str):
+    # Pilas colapsadas del perfil (flamegraph.pl, speedscope)
+    path = request_profiler.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    with open(path) as f:
+        return PlainTextResponse(f.read())
+
+@app.get("/jobs/{job_id}", tags=['Upload'])
+async def get_job(job_id: str):
+    job = upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job.to_dict()
 
 # Montar archivos estáticos
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -0,0 +1,55 @@
+# python -m benchmark.compare benchmark/results/antes.json benchmark/results/despues.json
+
+import argparse
+import json
+
+"""
+Comparación de dos resultados de la prueba de carga (por ejemplo, de dos commits)
+"""
+
+
+def _change(before, after):
+    if not before:
+        return "      -"
+    return f"{100 * (after - before) / before:+7.1f}%"
+
+
+def compare(before, after):
+    """Imprime las latencias de ambos resultados y su variación porcentual."""
+    print(f"antes: {before['commit']} ({before['date']})   después: {after['commit']} ({after['date']})")
+    print(f"{'end-point':<26}{'p50 antes':>11}{'p50 desp.':>11}{'var.':>9}"
+          f"{'p95 antes':>11}{'p95 desp.':>11}{'var.':>9}{'p99 antes':>11}{'p99 desp.':>11}{'var.':>9}")
+    rows = [name for name in after["endpoints"] if name in before["endpoints"]]
+    for name in rows + ["total"]:
+        old = before["total"] if name == "total" else before["endpoints"][name]
+        new = after["total"] if name == "total" else after["endpoints"][name]
+        line = f"{name:<26}"
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            line += f"{old[key]:>11.2f}{new[key]:>11.2f}{_change(old[key], new[key]):>9}"
+        print(line)
+
+    for label, key in (("Rendimiento (peticiones/s)", "throughput_rps"), ("RSS máximo (MB)", "peak_rss_mb"),
+                       ("Inicio del servidor (s)", "startup_seconds")):
+        old, new = before.get(key), after.get(key)
+        if old is not None and new is not None:
+            print(f"{label}: {old} -> {new} ({_change(old, new).strip()})")
+
+    stages = [labels for labels in after.get("stages_mean_ms", {}) if labels in before.get("stages_mean_ms", {})]
+    if stages:
+        print("Etapas (media, ms):")
+        for labels in stages:
+            old, new = before["stages_mean_ms"][labels], after["stages_mean_ms"][labels]
+            print(f"  {labels:<40}{old:>10.3f}{new:>10.3f}{_change(old, new):>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara dos resultados de python -m benchmark.loadtest")
+    parser.add_argument("before", help="Resultado de referencia (JSON)")
+    parser.add_argument("after", help="Resultado a comparar (JSON)")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    compare(before, after)
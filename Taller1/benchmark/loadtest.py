@@ -0,0 +1,295 @@
+# python -m benchmark.loadtest bench --concurrency 16 --sessions 500
+# SCORING_PROCESSES=4 python -m benchmark.loadtest bench --concurrency 32 --duration 60
+
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmark.dataset import ROOT
+
+"""
+Prueba de carga de la API: reproduce sesiones concurrentes de usuarios y
+reporta latencias, rendimiento y memoria máxima del servidor
+"""
+
+RESULTS_DIR = os.path.join(ROOT, "benchmark", "results")
+PERCENTILES = (50, 95, 99)
+
+
+class Client:
+    """Conexión HTTP persistente de un hilo de la prueba, con registro de latencias."""
+
+    def __init__(self, host, port, record):
+        self.connection = http.client.HTTPConnection(host, port, timeout=120)
+        self.record = record
+
+    def request(self, name, method, path, body=None, headers=None):
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers or {})
+            response = self.connection.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            data, status = b"", 0
+        self.record(name, time.perf_counter() - start, status)
+        return status, data
+
+
+def run_session(client, userId, rng, rate_fraction):
+    """
+    Una sesión como la de la interfaz web: login, películas populares y
+    catálogo, historial de ratings, ambas pestañas de recomendaciones (a veces
+    con una segunda página) y, en una fracción de las sesiones, un rating.
+    """
+    form = urllib.parse.urlencode({"userId": userId})
+    client.request("login", "POST", "/login", form, {"Content-Type": "application/x-www-form-urlencoded"})
+    client.request("popular-movies", "GET", "/popular-movies")
+    client.request("movies", "GET", "/movies?limit=100&offset=100&order=asc")
+    client.request("ratings", "GET", f"/user/{userId}/ratings")
+
+    recommended = []
+    for kind in ("user-based", "item-based"):
+        status, data = client.request(kind, "GET", f"/user/{userId}/recommendations/{kind}")
+        if status == 200:
+            recommended += [item["movieId"] for item in json.loads(data)["items"]]
+        if rng.random() < 0.5:
+            client.request(f"{kind} (página 2)", "GET", f"/user/{userId}/recommendations/{kind}?offset=9&limit=9")
+
+    if recommended and rng.random() < rate_fraction:
+        movieId = rng.choice(recommended)
+        rating = rng.randint(1, 10) / 2
+        client.request("rate", "POST", f"/user/{userId}/rate?movieId={movieId}&rating={rating}")
+
+
+def _process_rss(pid):
+    # RSS (bytes) de un proceso y sus descendientes, leído de /proc (Linux)
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return total
+    return total + sum(_process_rss(child) for child in children)
+
+
+class RSSMonitor:
+    """Registra periódicamente el RSS máximo del servidor (con sus procesos de puntuación)."""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-monitor", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _process_rss(self.pid))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+
+def start_server(workdir, database_url, port):
+    env = dict(os.environ, DATABASE_URL=database_url,
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    with open(os.path.join(workdir, "server.log"), "w") as log:
+        return subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+                                 "--port", str(port), "--no-access-log"],
+                                cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(server, port, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("❌ El servidor terminó al iniciar; ver server.log en el directorio de trabajo")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/ready")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit("❌ El servidor no estuvo listo a tiempo")
+
+
+def fetch_metrics(port):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("GET", "/metrics")
+    return connection.getresponse().read().decode()
+
+
+def _stage_totals(metrics_text):
+    totals = {}
+    for line in metrics_text.splitlines():
+        for index, suffix in enumerate(("_sum{", "_count{")):
+            prefix = "recommendation_stage_duration_seconds" + suffix
+            if line.startswith(prefix):
+                labels, value = line[len(prefix):].rsplit("} ", 1)
+                totals.setdefault(labels.replace('"', ""), [0.0, 0.0])[index] = float(value)
+    return totals
+
+
+def stage_means(metrics_text, baseline_text=""):
+    """
+    Latencia media (ms) de cada etapa del cálculo de recomendaciones, a partir
+    de los histogramas de /metrics (descontando los valores de ``baseline_text``).
+    """
+    totals, baseline = _stage_totals(metrics_text), _stage_totals(baseline_text)
+    means = {}
+    for labels, (total, count) in sorted(totals.items()):
+        base_total, base_count = baseline.get(labels, (0.0, 0.0))
+        if count > base_count:
+            means[labels] = round(1000 * (total - base_total) / (count - base_count), 3)
+    return means
+
+
+def summarize(samples):
+    latencies = np.array([seconds for seconds, _ in samples]) * 1000
+    errors = sum(1 for _, status in samples if status == 0 or status >= 400)
+    summary = {"count": len(samples), "errors": errors, "mean_ms": round(float(latencies.mean()), 3)}
+    for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        summary[f"p{p}_ms"] = round(float(value), 3)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(workdir, concurrency=16, sessions=500, duration=None, warmup=0, rate_fraction=0.3, port=8765, seed=0):
+    """
+    Inicia el servidor sobre el conjunto de pruebas, ejecuta las sesiones
+    concurrentes y devuelve el resumen de resultados.
+    """
+    with open(os.path.join(workdir, "dataset.json")) as f:
+        dataset = json.load(f)
+    user_ids = dataset.pop("user_ids")
+
+    server = start_server(workdir, dataset["database_url"], port)
+    monitor = RSSMonitor(server.pid)
+    monitor.start()
+    try:
+        start = time.perf_counter()
+        wait_ready(server, port)
+        startup = time.perf_counter() - start
+
+        lock = threading.Lock()
+        samples = {}
+        measuring = threading.Event()
+        remaining = [warmup]
+        begin = [0.0]
+
+        def record(name, seconds, status):
+            if measuring.is_set():
+                with lock:
+                    samples.setdefault(name, []).append((seconds, status))
+
+        def next_session():
+            with lock:
+                if measuring.is_set() and duration:
+                    return time.perf_counter() - begin[0] < duration
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+                return True
+
+        def worker(index):
+            rng = random.Random(seed * 1000 + index)
+            client = Client("127.0.0.1", port, record)
+            while next_session():
+                run_session(client, rng.choice(user_ids), rng, rate_fraction)
+
+        # Las sesiones de calentamiento se ejecutan primero y no se registran
+        for phase in ("warmup", "measure"):
+            if phase == "measure":
+                baseline = fetch_metrics(port)
+                remaining[0] = sessions
+                begin[0] = time.perf_counter()
+                measuring.set()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(worker, range(concurrency)))
+        elapsed = time.perf_counter() - begin[0]
+
+        metrics_text = fetch_metrics(port)
+    finally:
+        server.terminate()
+        server.wait()
+        peak_rss = monitor.stop()
+
+    all_samples = [sample for values in samples.values() for sample in values]
+    return {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "dataset": dataset,
+        "config": {"concurrency": concurrency, "sessions": sessions, "duration": duration, "warmup": warmup,
+                   "rate_fraction": rate_fraction,
+                   "scoring_processes": int(os.getenv("SCORING_PROCESSES", "0"))},
+        "startup_seconds": round(startup, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(len(all_samples) / elapsed, 2),
+        "peak_rss_mb": round(peak_rss / 2**20, 1) if peak_rss else None,
+        "total": summarize(all_samples),
+        "endpoints": {name: summarize(values) for name, values in sorted(samples.items())},
+        "stages_mean_ms": stage_means(metrics_text, baseline),
+    }
+
+
+def print_report(result):
+    print(f"{'end-point':<26}{'n':>7}{'errores':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, summary in list(result["endpoints"].items()) + [("total", result["total"])]:
+        print(f"{name:<26}{summary['count']:>7}{summary['errors']:>9}{summary['p50_ms']:>10.2f}"
+              f"{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}")
+    print(f"Rendimiento: {result['throughput_rps']} peticiones/s; RSS máximo: {result['peak_rss_mb']} MB; "
+          f"inicio del servidor: {result['startup_seconds']} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API de recomendaciones")
+    parser.add_argument("workdir", help="Directorio creado con python -m benchmark.dataset")
+    parser.add_argument("--concurrency", type=int, default=16, help="Sesiones simultáneas")
+    parser.add_argument("--sessions", type=int, default=500, help="Sesiones medidas")
+    parser.add_argument("--duration", type=float, help="Segundos de medición (en lugar de --sessions)")
+    parser.add_argument("--warmup", type=int, default=0, help="Sesiones de calentamiento (no se miden)")
+    parser.add_argument("--rate-fraction", type=float, default=0.3, help="Fracción de sesiones que califican una película")
+    parser.add_argument("--port", type=int, default=8765, help="Puerto del servidor de pruebas")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de la selección de usuarios")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto, en benchmark/results)")
+    args = parser.parse_args()
+
+    result = run(os.path.abspath(args.workdir), concurrency=args.concurrency, sessions=args.sessions,
+                 duration=args.duration, warmup=args.warmup, rate_fraction=args.rate_fraction,
+                 port=args.port, seed=args.seed)
+    print_report(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{result['commit'] or 'local'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Resultados guardados en {output}")
@@ -0,0 +1,120 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Cola de trabajos en segundo plano para la carga de archivos
+"""
+
+# Número máximo de trabajos terminados que se conservan para consulta
+MAX_FINISHED_JOBS = 100
+
+
+class Job:
+    """
+    Trabajo de carga en segundo plano.
+
+    Atributos:
+        id (str): Identificador del trabajo.
+        kind (str): Tipo de carga (movie, rating).
+        status (str): queued, running, completed o failed.
+        rows_processed (int): Filas procesadas hasta el momento.
+        error (str): Mensaje de error si el trabajo falló.
+        result (dict): Resultado devuelto por la carga.
+    """
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.rows_processed = 0
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def update(self, rows_processed):
+        self.rows_processed = rows_processed
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "rows_processed": self.rows_processed,
+            "elapsed_seconds": round(elapsed, 2),
+            "rows_per_second": round(self.rows_processed / elapsed) if elapsed > 0 else 0,
+            "error": self.error,
+            "result": self.result
+        }
+
+
+class JobQueue:
+    """
+    Ejecuta trabajos en un pool de hilos y conserva su estado para consulta.
+
+    Args:
+        max_workers (int): Número de trabajos ejecutados en paralelo.
+    """
+
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def submit(self, kind, func, *args, on_success=None, on_finish=None):
+        """
+        Encola un trabajo.
+
+        Args:
+            kind (str): Tipo de trabajo.
+            func (callable): Función ``func(job, *args)`` que realiza la carga y
+                devuelve su resultado.
+            on_success (callable): Se ejecuta tras una carga exitosa.
+            on_finish (callable): Se ejecuta siempre al terminar (limpieza).
+
+        Returns:
+            Job: El trabajo encolado.
+        """
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func, args, on_success, on_finish)
+        return job
+
+    def _run(self, job, func, args, on_success, on_finish):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = func(job, *args)
+            if on_success:
+                on_success()
+            job.status = "completed"
+        except Exception as e:
+            # Para errores de base de datos, conservar solo el mensaje del motor
+            job.error = str(getattr(e, "orig", None) or e)
+            job.status = "failed"
+            print(f"❌ Error en trabajo de carga {job.kind} {job.id}: {job.error}")
+        finally:
+            job.finished_at = time.time()
+            if on_finish:
+                on_finish()
+
+    def _prune(self):
+        # Descartar los trabajos terminados más antiguos
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,11 @@
-from sqlalchemy import text
+import io
+import time
+import pandas as pd
+from sqlalchemy import BigInteger, Column, Index, MetaData, Table, text
 from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
 from db.database import engine
+from db.migrate import partition_bounds, sync_user_sequence
 from db.models import movie as DBMovie, rating as DBRating, User as DBUser
 from db.session import get_db
 
@@ -8,6 +13,14 @@ from db.session import get_db
 Carga tablas en la base de datos
 """
 
+# Número de filas leídas y cargadas por bloque al procesar el archivo de ratings
+CHUNK_SIZE = 100_000
+
+RATING_COLUMNS = ['userId', 'movieId', 'rating', 'timestamp']
+# Tabla auxiliar donde se cargan los ratings y tabla que reemplaza a rating
+STAGING_TABLE = "rating_load"
+NEW_TABLE = "rating_new"
+
 def create_movie(db: Session, movie_data: list):
     
     # Limpiar tabla antes de insertar información
@@ -22,25 +35,210 @@ def create_movie(db: Session, movie_data: list):
     db.commit()
 
 
-def create_rating(db: Session, rating_data: list):
-    # Limpiar tabla antes de insertar información
-    db.query(DBMovie).delete()
+def read_rating_chunks(rating_source, chunksize=CHUNK_SIZE):
+    """
+    Lee el archivo CSV de ratings por bloques, sin cargarlo completo en memoria.
 
-    ratings = [DBRating(userId=userId,
-                        movieId=movieId,
-                        rating=rating,
-                        timestamp=timestamp) 
-                        for userId,movieId,rating,timestamp in rating_data.itertuples(index=False, name=None)]
-    db.add_all(ratings)
-    db.commit()
+    Args:
+        rating_source: Ruta o archivo (file-like) con el CSV de ratings.
+        chunksize (int): Número de filas por bloque.
+
+    Returns:
+        Iterator[DataFrame]: Bloques con las columnas de la tabla rating.
+    """
+    reader = pd.read_csv(rating_source,
+                         delimiter=',',
+                         index_col=False,
+                         header=0,
+                         chunksize=chunksize)
+    for chunk in reader:
+        # Verificar que las columnas sean las correctas
+        if not set(RATING_COLUMNS).issubset(chunk.columns):
+            raise ValueError("El archivo CSV no tiene las columnas esperadas.")
+
+        chunk = chunk[RATING_COLUMNS].astype({'userId': 'int64', 'movieId': 'int64', 'rating': 'float64'})
+        # Timestamps en formato epoch (segundos) o texto se convierten a fecha
+        if pd.api.types.is_numeric_dtype(chunk['timestamp']):
+            chunk['timestamp'] = pd.to_datetime(chunk['timestamp'], unit='s')
+        else:
+            chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+        yield chunk
+
+
+def _copy_chunk(db: Session, chunk):
+    # PostgreSQL: carga masiva con COPY desde un buffer CSV en memoria. COPY
+    # no pasa por el tipo de la columna: el rating se escribe en medias
+    # estrellas (entero pequeño, ver db.models.HalfStars)
+    chunk = chunk.assign(rating=(chunk['rating'] * 2).round().astype('int16'), line=chunk.index)
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY {STAGING_TABLE} ("userId", "movieId", rating, timestamp, line) FROM STDIN WITH (FORMAT csv)',
+            buffer)
+    finally:
+        cursor.close()
+
+
+def _insert_chunk(db: Session, chunk, table):
+    # Otros motores (SQLite): inserción por lotes (executemany); los valores
+    # faltantes (NaN, NaT) se insertan como NULL
+    chunk = chunk.assign(line=chunk.index)
+    db.execute(table.insert(), chunk.astype(object).where(chunk.notna(), None).to_dict(orient='records'))
+
+
+def _staging_table():
+    # Tabla de carga: las columnas de rating, sin clave ni índices y admitiendo
+    # nulos, más la línea del archivo (desempate entre ratings repetidos)
+    return Table(STAGING_TABLE, MetaData(),
+                 *[Column(column.name, column.type) for column in DBRating.__table__.columns],
+                 Column("line", BigInteger))
+
+
+def _new_rating_table(db: Session, is_postgres):
+    # Tabla con el esquema de rating que reemplaza a la actual. En PostgreSQL
+    # los nombres de la clave, los índices y las particiones son únicos en el
+    # esquema: se crean con el sufijo de la tabla nueva y se renombran al final
+    table = DBRating.__table__.to_metadata(MetaData(), name=NEW_TABLE)
+    partitions = 0
+    if is_postgres:
+        table.primary_key.name = f"{NEW_TABLE}_pkey"
+        # Conservar las particiones por rangos de userId de la tabla actual (db.migrate --partitions)
+        partitions = db.execute(text("SELECT COUNT(*) FROM pg_inherits "
+                                     "WHERE inhparent = 'rating'::regclass")).scalar()
+        if partitions:
+            table.dialect_options["postgresql"]["partition_by"] = 'RANGE ("userId")'
+
+    db.execute(CreateTable(table))
+    if not partitions:
+        return table, 0
+    bounds = partition_bounds(db.connection(), partitions, STAGING_TABLE)
+    bounds = ["MINVALUE"] + [str(bound) for bound in bounds] + ["MAXVALUE"]
+    for i, (lower, upper) in enumerate(zip(bounds, bounds[1:])):
+        db.execute(text(f"CREATE TABLE {NEW_TABLE}_p{i} PARTITION OF {NEW_TABLE} "
+                        f"FOR VALUES FROM ({lower}) TO ({upper})"))
+    return table, len(bounds) - 1
+
+
+def _swap_rating_table(db: Session, is_postgres, partitions):
+    # Reemplaza la tabla rating por la nueva en la transacción actual: el
+    # bloqueo exclusivo sobre rating dura solo los cambios de nombre
+    db.execute(text("DROP TABLE rating"))
+    db.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO rating"))
+    if is_postgres:
+        db.execute(text(f'ALTER TABLE rating RENAME CONSTRAINT "{NEW_TABLE}_pkey" TO rating_pkey'))
+        for index in DBRating.__table__.indexes:
+            db.execute(text(f'ALTER INDEX "{index.name}_new" RENAME TO "{index.name}"'))
+        for i in range(partitions):
+            db.execute(text(f"ALTER TABLE {NEW_TABLE}_p{i} RENAME TO rating_p{i}"))
+    else:
+        # SQLite no renombra índices: se crean con su nombre tras el cambio
+        # (la base de datos admite un solo escritor durante la carga)
+        for index in DBRating.__table__.indexes:
+            index.create(bind=db.connection())
+
+
+def create_rating(db: Session, rating_source, chunksize=CHUNK_SIZE, progress=None):
+    """
+    Carga el archivo de ratings por bloques con memoria acotada, sin
+    bloquear las lecturas de la tabla rating durante la carga.
+
+    Los ratings se cargan en una tabla auxiliar sin índices; luego se copian
+    a una tabla nueva con el esquema de rating (conservando, de los pares
+    usuario-película repetidos, el más reciente y, a igual fecha, el último
+    del archivo), se crean sus índices y, en una transacción corta, la tabla
+    nueva reemplaza a la actual y se actualiza la tabla user. Si la carga
+    falla, la tabla rating no cambia.
+
+    Args:
+        db (Session): Sesión de base de datos.
+        rating_source: Ruta o archivo (file-like) con el CSV de ratings.
+        chunksize (int): Número de filas por bloque.
+        progress (callable): Opcional, recibe el número de filas cargadas
+            después de cada bloque.
+
+    Returns:
+        dict: Filas cargadas, filas descartadas (pares repetidos o
+        incompletos), duración en segundos y filas por segundo.
+    """
+    start = time.perf_counter()
+    is_postgres = db.get_bind().dialect.name == "postgresql"
+    staging = _staging_table()
+
+    try:
+        # Tablas auxiliares de una carga anterior interrumpida
+        db.execute(text(f"DROP TABLE IF EXISTS {STAGING_TABLE}"))
+        db.execute(text(f"DROP TABLE IF EXISTS {NEW_TABLE}"))
+        staging.create(bind=db.connection())
+        db.commit()
+
+        rows = 0
+        for chunk in read_rating_chunks(rating_source, chunksize):
+            if is_postgres:
+                _copy_chunk(db, chunk)
+            else:
+                _insert_chunk(db, chunk, staging)
+            rows += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"🔹 Ratings cargados: {rows} ({rows / elapsed:.0f} filas/s)")
+            if progress:
+                progress(rows)
+        db.commit()
+
+        table, partitions = _new_rating_table(db, is_postgres)
+        db.execute(text(f"""
+            INSERT INTO {NEW_TABLE} ("userId", "movieId", rating, timestamp)
+            SELECT "userId", "movieId", rating, timestamp
+            FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY "userId", "movieId"
+                                               ORDER BY timestamp DESC NULLS LAST, line DESC) AS position
+                  FROM {STAGING_TABLE}
+                  WHERE "userId" IS NOT NULL AND "movieId" IS NOT NULL AND rating IS NOT NULL) AS ranked
+            WHERE position = 1
+            ORDER BY "userId", "movieId"
+        """))
+        if is_postgres:
+            for index in DBRating.__table__.indexes:
+                columns = [table.c[column.name] for column in index.columns]
+                Index(f"{index.name}_new", *columns).create(bind=db.connection())
+        loaded = db.execute(text(f"SELECT COUNT(*) FROM {NEW_TABLE}")).scalar()
+        db.commit()
+
+        # Insertar userId únicos en la tabla user desde los ratings nuevos
+        db.query(DBUser).delete()
+        db.execute(text(f"""
+            INSERT INTO "user" ("userId")
+            SELECT DISTINCT "userId"
+            FROM   {NEW_TABLE}
+            ORDER BY "userId" ASC;
+        """))
+        if is_postgres:
+            # Los usuarios nuevos continúan después del mayor userId cargado
+            sync_user_sequence(db.connection())
+        _swap_rating_table(db, is_postgres, partitions)
+        db.execute(text(f"DROP TABLE {STAGING_TABLE}"))
+        db.commit()
+    except Exception:
+        db.rollback()
+        db.execute(text(f"DROP TABLE IF EXISTS {STAGING_TABLE}"))
+        db.execute(text(f"DROP TABLE IF EXISTS {NEW_TABLE}"))
+        db.commit()
+        raise
+
+    if rows > loaded:
+        print(f"🔹 Ratings descartados (pares repetidos o incompletos): {rows - loaded}")
 
+    if is_postgres:
+        # Actualizar estadísticas del planificador tras la carga masiva
+        db.execute(text("ANALYZE rating"))
+        db.execute(text('ANALYZE "user"'))
+        db.commit()
 
-    db.query(DBUser).delete()
-    # Insertar userId únicos en la tabla user desde rating
-    db.execute(text("""
-        INSERT INTO "user" ("userId")
-        SELECT DISTINCT "userId"
-        FROM   rating 
-        ORDER BY "userId" ASC;
-    """))
-    db.commit()
\ No newline at end of file
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": loaded,
+        "discarded": rows - loaded,
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round(rows / elapsed) if elapsed > 0 else rows
+    }
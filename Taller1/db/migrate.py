@@ -0,0 +1,348 @@
+# python -m db.migrate --benchmark
+# python -m db.migrate --apply --benchmark --output rating_schema.json
+# python -m db.migrate --apply --partitions 8
+
+import argparse
+import json
+import random
+import time
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.types import BigInteger, Integer
+from db.models import User as DBUser, rating as DBRating
+
+"""
+Migración de las tablas user y rating al esquema de db.models (userId
+generado por la base de datos; en rating, clave compuesta (userId, movieId)
+con índice de cobertura, ids enteros y rating en medias estrellas) y
+medición de las consultas habituales antes y después
+"""
+
+# Usuarios muestreados para medir las consultas por usuario
+BENCHMARK_USERS = 200
+
+# Consultas habituales de la aplicación sobre la tabla rating (válidas en ambos esquemas)
+QUERIES = {
+    "historial": 'SELECT "movieId", rating FROM rating WHERE "userId" = :userId',
+    "historial con películas": ('SELECT r."movieId", r.rating, r.timestamp, m.title, m.genres '
+                                'FROM rating r JOIN movie m ON m."movieId" = r."movieId" '
+                                'WHERE r."userId" = :userId'),
+    "existe rating": 'SELECT 1 FROM rating WHERE "userId" = :userId AND "movieId" = :movieId',
+    "popularidad": 'SELECT "movieId", COUNT(*) FROM rating GROUP BY "movieId"',
+}
+
+
+def rating_outdated(engine):
+    """Indica si la tabla rating existe y aún tiene el esquema anterior (id sustituto y rating float)."""
+    inspector = inspect(engine)
+    if not inspector.has_table("rating"):
+        return False
+    columns = {column["name"]: column for column in inspector.get_columns("rating")}
+    primary_key = inspector.get_pk_constraint("rating")["constrained_columns"]
+    return (primary_key != ["userId", "movieId"]
+            or not isinstance(columns["rating"]["type"], Integer))
+
+
+def user_outdated(engine):
+    """Indica si la tabla user existe y la base de datos no genera el userId de los usuarios nuevos."""
+    inspector = inspect(engine)
+    if not inspector.has_table("user"):
+        return False
+    column = {column["name"]: column for column in inspector.get_columns("user")}["userId"]
+    if engine.dialect.name == "postgresql":
+        return "nextval" not in str(column.get("default") or "")
+    # SQLite: solo una columna INTEGER PRIMARY KEY (no BIGINT) es autoincremental
+    return isinstance(column["type"], BigInteger)
+
+
+def missing_indexes(engine):
+    """Índices de db.models que faltan en la tabla rating (por ejemplo, agregados después de migrarla)."""
+    inspector = inspect(engine)
+    if not inspector.has_table("rating"):
+        return []
+    existing = {index["name"] for index in inspector.get_indexes("rating")}
+    return [index for index in DBRating.__table__.indexes if index.name not in existing]
+
+
+def create_missing_indexes(engine):
+    """Crea los índices que faltan en la tabla rating; devuelve sus nombres."""
+    indexes = missing_indexes(engine)
+    with engine.begin() as connection:
+        for index in indexes:
+            index.create(bind=connection)
+    return [index.name for index in indexes]
+
+
+def schema_outdated(engine):
+    """Indica si las tablas user o rating tienen el esquema anterior o les faltan índices."""
+    return rating_outdated(engine) or user_outdated(engine) or bool(missing_indexes(engine))
+
+
+def migrate_users(engine):
+    """
+    Hace que la base de datos genere el userId de los usuarios nuevos: en
+    PostgreSQL, con una secuencia que continúa después del mayor userId; en
+    SQLite, reconstruyendo la tabla con una columna INTEGER PRIMARY KEY.
+    """
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            connection.execute(text('CREATE SEQUENCE IF NOT EXISTS "user_userId_seq" OWNED BY "user"."userId"'))
+            connection.execute(text('ALTER TABLE "user" ALTER COLUMN "userId" '
+                                    'SET DEFAULT nextval(\'"user_userId_seq"\')'))
+            sync_user_sequence(connection)
+        else:
+            connection.execute(text('ALTER TABLE "user" RENAME TO user_old'))
+            connection.execute(CreateTable(DBUser.__table__))
+            connection.execute(text('INSERT INTO "user" ("userId", "userName") '
+                                    'SELECT "userId", "userName" FROM user_old'))
+            connection.execute(text("DROP TABLE user_old"))
+
+
+def sync_user_sequence(connection):
+    """PostgreSQL: continúa la secuencia del userId después del mayor userId (tras cargas masivas)."""
+    connection.execute(text("SELECT setval(pg_get_serial_sequence('\"user\"', 'userId'), "
+                            'COALESCE(MAX("userId"), 0) + 1, false) FROM "user"'))
+
+
+def partition_bounds(connection, partitions, source="rating_old"):
+    """PostgreSQL: límites de userId que reparten los ratings de ``source`` en particiones de tamaño similar."""
+    fractions = ", ".join(str(i / partitions) for i in range(1, partitions))
+    bounds = connection.execute(text(
+        f'SELECT percentile_disc(ARRAY[{fractions}]) WITHIN GROUP (ORDER BY "userId") FROM {source}'
+    )).scalar() or []
+    return sorted(set(bound for bound in bounds if bound is not None))
+
+
+def migrate(engine, partitions=0, keep_old=False):
+    """
+    Reconstruye la tabla rating con el esquema de db.models, en una
+    transacción: renombra la tabla actual a rating_old, crea la nueva (en
+    PostgreSQL, opcionalmente particionada por rangos de userId), copia los
+    ratings ordenados por (userId, movieId) conservando el más reciente de
+    cada par repetido, crea los índices y elimina la tabla anterior (salvo
+    con ``keep_old``). Al final actualiza las estadísticas del planificador.
+    El servidor debe estar detenido durante la migración.
+
+    Args:
+        engine (Engine): Motor de la base de datos.
+        partitions (int): Particiones por rangos de userId (solo PostgreSQL; 0 sin particiones).
+        keep_old (bool): Conservar la tabla anterior como rating_old.
+
+    Returns:
+        dict: Filas copiadas, filas descartadas (pares repetidos o nulos) y duración en segundos.
+    """
+    is_postgres = engine.dialect.name == "postgresql"
+    if partitions and not is_postgres:
+        raise ValueError("Las particiones solo están disponibles en PostgreSQL")
+
+    start = time.perf_counter()
+    inspector = inspect(engine)
+    if inspector.has_table("rating_old"):
+        raise ValueError("Ya existe la tabla rating_old; eliminarla antes de migrar")
+    legacy = rating_outdated(engine)
+    old_indexes = [index["name"] for index in inspector.get_indexes("rating")]
+    old_primary_key = inspector.get_pk_constraint("rating").get("name")
+
+    table = DBRating.__table__.to_metadata(MetaData())
+    if partitions:
+        table.dialect_options["postgresql"]["partition_by"] = 'RANGE ("userId")'
+
+    with engine.begin() as connection:
+        # Liberar los nombres de la tabla y sus índices para la tabla nueva
+        connection.execute(text("ALTER TABLE rating RENAME TO rating_old"))
+        for name in old_indexes:
+            connection.execute(text(f'DROP INDEX "{name}"'))
+        if is_postgres and old_primary_key:
+            connection.execute(text(f'ALTER TABLE rating_old RENAME CONSTRAINT "{old_primary_key}" '
+                                    'TO rating_old_pkey'))
+
+        connection.execute(CreateTable(table))
+        if partitions:
+            bounds = ["MINVALUE"] + [str(bound) for bound in partition_bounds(connection, partitions)] + ["MAXVALUE"]
+            for i, (lower, upper) in enumerate(zip(bounds, bounds[1:])):
+                connection.execute(text(f"CREATE TABLE rating_p{i} PARTITION OF rating "
+                                        f"FOR VALUES FROM ({lower}) TO ({upper})"))
+
+        # El esquema anterior guarda el rating como float; el nuevo, en medias estrellas
+        value = "CAST(ROUND(rating * 2) AS SMALLINT)" if legacy else "rating"
+        # Entre repetidos se conserva el más reciente; los ratings sin fecha van al
+        # final (PostgreSQL ordena los NULL primero en DESC) y, a igual fecha, gana
+        # el último insertado (mayor id del esquema anterior)
+        order = "timestamp DESC NULLS LAST" + (", id DESC" if legacy else "")
+        connection.execute(text(f"""
+            INSERT INTO rating ("userId", "movieId", rating, timestamp)
+            SELECT "userId", "movieId", {value}, timestamp
+            FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY "userId", "movieId"
+                                               ORDER BY {order}) AS position
+                  FROM rating_old
+                  WHERE "userId" IS NOT NULL AND "movieId" IS NOT NULL AND rating IS NOT NULL) AS ranked
+            WHERE position = 1
+            ORDER BY "userId", "movieId"
+        """))
+        for index in table.indexes:
+            index.create(bind=connection)
+
+        rows = connection.execute(text("SELECT COUNT(*) FROM rating")).scalar()
+        old_rows = connection.execute(text("SELECT COUNT(*) FROM rating_old")).scalar()
+        if not keep_old:
+            connection.execute(text("DROP TABLE rating_old"))
+
+    # VACUUM marca las páginas como visibles, requisito de las lecturas solo del índice
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if is_postgres:
+            connection.execute(text("VACUUM (ANALYZE) rating"))
+        else:
+            connection.execute(text("VACUUM"))
+            connection.execute(text("ANALYZE rating"))
+
+    return {"rows": rows, "discarded": old_rows - rows, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _plan_summary(connection, query, params):
+    # PostgreSQL: tipos de recorrido del plan y bloques leídos (en caché y de disco)
+    plan = connection.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}"), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    scans, pending = [], [root]
+    while pending:
+        node = pending.pop()
+        if "Scan" in node["Node Type"]:
+            scans.append(node["Node Type"])
+        pending.extend(node.get("Plans", []))
+    return {"scans": sorted(set(scans)),
+            "shared_blocks": root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0)}
+
+
+def _table_size(connection):
+    # PostgreSQL: tamaño de la tabla y de sus índices (sumando las particiones)
+    heap, indexes = connection.execute(text(
+        "SELECT SUM(pg_table_size(relid)), SUM(pg_indexes_size(relid)) FROM pg_partition_tree('rating')"
+    )).one()
+    return {"table_mb": round(int(heap) / 2**20, 1), "indexes_mb": round(int(indexes) / 2**20, 1)}
+
+
+def benchmark(engine, users=BENCHMARK_USERS, repeat=3, seed=0):
+    """
+    Mide las consultas habituales sobre la tabla rating: el historial de una
+    muestra de usuarios (con y sin las películas), la existencia de un rating
+    y el conteo de popularidad. Con la misma semilla se muestrean los mismos
+    usuarios, de modo que las mediciones antes y después son comparables.
+
+    Returns:
+        dict: Latencias p50/p95/media (ms) por consulta y, en PostgreSQL, el
+        plan de cada consulta y el tamaño de la tabla.
+    """
+    with engine.connect() as connection:
+        user_ids = [row[0] for row in connection.execute(text('SELECT "userId" FROM "user" ORDER BY "userId"'))]
+        sample = random.Random(seed).sample(user_ids, min(users, len(user_ids)))
+        if not sample:
+            raise ValueError("La tabla user está vacía")
+
+        timings = {name: [] for name in QUERIES}
+        existence_params = []
+        for userId in sample:
+            for name in ("historial", "historial con películas"):
+                begin = time.perf_counter()
+                rows = connection.execute(text(QUERIES[name]), {"userId": userId}).all()
+                timings[name].append(time.perf_counter() - begin)
+            existence_params.append({"userId": userId, "movieId": rows[0][0] if rows else 0})
+        for params in existence_params:
+            begin = time.perf_counter()
+            connection.execute(text(QUERIES["existe rating"]), params).all()
+            timings["existe rating"].append(time.perf_counter() - begin)
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            connection.execute(text(QUERIES["popularidad"])).all()
+            timings["popularidad"].append(time.perf_counter() - begin)
+
+        result = {"database": engine.dialect.name, "users": len(sample), "queries": {}}
+        for name, values in timings.items():
+            values = [1000 * value for value in values]
+            result["queries"][name] = {"p50_ms": round(_percentile(values, 50), 3),
+                                       "p95_ms": round(_percentile(values, 95), 3),
+                                       "mean_ms": round(sum(values) / len(values), 3)}
+        if engine.dialect.name == "postgresql":
+            params = {"userId": sample[0], "movieId": existence_params[0]["movieId"]}
+            for name, query in QUERIES.items():
+                result["queries"][name].update(_plan_summary(connection, query, params))
+            result["size"] = _table_size(connection)
+    return result
+
+
+def _change(before, after):
+    if not before:
+        return "-"
+    return f"{100 * (after - before) / before:+.1f}%"
+
+
+def print_report(before, after=None):
+    """Imprime las latencias de una medición o la comparación de dos (antes y después)."""
+    if after is None:
+        print(f"{'consulta':<26}{'p50 ms':>10}{'p95 ms':>10}{'media ms':>10}  plan")
+        for name, values in before["queries"].items():
+            print(f"{name:<26}{values['p50_ms']:>10.3f}{values['p95_ms']:>10.3f}{values['mean_ms']:>10.3f}"
+                  f"  {', '.join(values.get('scans', []))}")
+        if "size" in before:
+            print(f"Tamaño: tabla {before['size']['table_mb']} MB, índices {before['size']['indexes_mb']} MB")
+        return
+
+    print(f"{'consulta':<26}{'p50 antes':>11}{'p50 desp.':>11}{'var.':>9}{'p95 antes':>11}{'p95 desp.':>11}{'var.':>9}")
+    for name, old in before["queries"].items():
+        new = after["queries"][name]
+        print(f"{name:<26}{old['p50_ms']:>11.3f}{new['p50_ms']:>11.3f}{_change(old['p50_ms'], new['p50_ms']):>9}"
+              f"{old['p95_ms']:>11.3f}{new['p95_ms']:>11.3f}{_change(old['p95_ms'], new['p95_ms']):>9}")
+        if "scans" in old:
+            print(f"  plan: {', '.join(old['scans'])} ({old['shared_blocks']} bloques) -> "
+                  f"{', '.join(new['scans'])} ({new['shared_blocks']} bloques)")
+    if "size" in before:
+        for label, key in (("Tabla (MB)", "table_mb"), ("Índices (MB)", "indexes_mb")):
+            old, new = before["size"][key], after["size"][key]
+            print(f"{label}: {old} -> {new} ({_change(old, new)})")
+
+
+if __name__ == "__main__":
+    from db.database import engine
+
+    parser = argparse.ArgumentParser(description="Migra las tablas user y rating al esquema actual y mide sus consultas")
+    parser.add_argument("--apply", action="store_true", help="Migrar la tabla rating (con el servidor detenido)")
+    parser.add_argument("--partitions", type=int, default=0, help="Particiones por rangos de userId (solo PostgreSQL)")
+    parser.add_argument("--keep-old", action="store_true", help="Conservar la tabla anterior como rating_old")
+    parser.add_argument("--benchmark", action="store_true", help="Medir las consultas habituales (antes y después con --apply)")
+    parser.add_argument("--users", type=int, default=BENCHMARK_USERS, help="Usuarios muestreados en la medición")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de la muestra de usuarios")
+    parser.add_argument("--output", help="Archivo JSON con las mediciones")
+    args = parser.parse_args()
+
+    report = {}
+    if args.benchmark:
+        report["before"] = benchmark(engine, users=args.users, seed=args.seed)
+    if args.apply:
+        if user_outdated(engine):
+            migrate_users(engine)
+            print("🔹 Tabla user migrada: la base de datos genera el userId de los usuarios nuevos")
+        if not rating_outdated(engine) and not args.partitions:
+            created = create_missing_indexes(engine)
+            if created:
+                print(f"🔹 Índices creados en la tabla rating: {', '.join(created)}")
+            print("🔹 La tabla rating ya tiene el esquema actual")
+        else:
+            try:
+                report["migration"] = migrate(engine, partitions=args.partitions, keep_old=args.keep_old)
+            except ValueError as e:
+                raise SystemExit(f"❌ {e}")
+            print(f"🔹 Tabla rating migrada: {report['migration']['rows']} ratings "
+                  f"({report['migration']['discarded']} descartados) en {report['migration']['seconds']} s")
+            if args.benchmark:
+                report["after"] = benchmark(engine, users=args.users, seed=args.seed)
+    if args.benchmark:
+        print_report(report["before"], report.get("after"))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Mediciones guardadas en {args.output}")
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, BIGINT, TIMESTAMP, BigInteger
+from sqlalchemy import Column, Integer, String, Float, BIGINT, TIMESTAMP, BigInteger, SmallInteger, PrimaryKeyConstraint
+from sqlalchemy.types import TypeDecorator
 from db.database import Base
 
 class User(Base):
@@ -12,34 +13,57 @@ class User(Base):
     __tablename__ = "user"
 
     #id = Column(Integer, primary_key=True, index=False, autoincrement=True)
-    userId = Column(BigInteger, primary_key=True, index=False, autoincrement=False)
+    # La base de datos genera el userId de los usuarios nuevos (secuencia en
+    # PostgreSQL; en SQLite solo una columna INTEGER PRIMARY KEY es autoincremental)
+    userId = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=False, autoincrement=True)
     userName  = Column(String, index=False, default="")
 
     def __init__(self, userId, userName ):
         self.userId = userId
         self.userName = userName 
 
+class HalfStars(TypeDecorator):
+    """
+    Rating en medias estrellas (0.5 a 5.0) guardado como entero pequeño: la
+    columna almacena el doble del rating (1 a 10) y en Python se lee y se
+    escribe como float.
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else int(round(float(value) * 2))
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else value / 2
+
 class rating(Base):
     """
     Tabla de rating
 
     Atributos:
-        id (int): Identificador único.
         userId (int): Identificador de usuario.
         movieId (int): Identificador de película.
-        rating (float): Calificación de película.
+        rating (float): Calificación de película (medias estrellas).
         timestamp (datetime): Fecha y hora de calificación.
     """
     __tablename__ = "rating"
+    __table_args__ = (
+        # Un rating por usuario y película. En PostgreSQL el índice de la clave
+        # incluye rating y timestamp, de modo que el historial de un usuario se
+        # lee solo del índice; en SQLite la tabla se ordena por la clave
+        PrimaryKeyConstraint("userId", "movieId", name="rating_pkey",
+                             postgresql_include=["rating", "timestamp"]),
+        {"sqlite_with_rowid": False},
+    )
 
-    id = Column(BigInteger, primary_key=True, index=False, autoincrement=True)
-    userId = Column(BigInteger, index=True)
-    movieId = Column(BigInteger, index=True)
-    rating = Column(Float, index=False)
-    timestamp = Column(TIMESTAMP, index=False)
+    userId = Column(Integer, nullable=False)
+    movieId = Column(Integer, index=True, nullable=False)
+    rating = Column(HalfStars, index=False, nullable=False)
+    # Índice para consultar los ratings recientes (usuarios con ratings nuevos)
+    timestamp = Column(TIMESTAMP, index=True)
 
-    def __init__(self, id, userId, movieId, rating, timestamp):
-        self.id = id
+    def __init__(self, userId, movieId, rating, timestamp):
         self.userId = userId
         self.movieId = movieId
         self.rating = rating
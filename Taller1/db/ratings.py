@@ -0,0 +1,82 @@
+import json
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.orm import Session
+from db.models import rating as DBRating
+
+"""
+Escritura de ratings con una sola sentencia de inserción o actualización
+"""
+
+# INSERT ... ON CONFLICT sobre la clave (userId, movieId). El SELECT sobre la
+# tabla user valida al usuario en la misma sentencia: si no existe, no se
+# escribe nada. Los ratings se envían como un arreglo (PostgreSQL) o como un
+# JSON (SQLite) para escribir el lote completo en un solo viaje.
+_UPSERT = {
+    "postgresql": """
+        INSERT INTO rating ("userId", "movieId", rating, timestamp)
+        SELECT u."userId", v."movieId", v.rating, :timestamp
+        FROM "user" u
+        CROSS JOIN unnest(CAST(:movieIds AS integer[]), CAST(:ratings AS smallint[])) AS v("movieId", rating)
+        WHERE u."userId" = :userId
+        ON CONFLICT ("userId", "movieId") DO UPDATE
+        SET rating = excluded.rating, timestamp = excluded.timestamp
+        RETURNING "movieId", (xmax = 0) AS inserted
+    """,
+    "sqlite": """
+        INSERT INTO rating ("userId", "movieId", rating, timestamp)
+        SELECT u."userId", json_extract(v.value, '$[0]'), json_extract(v.value, '$[1]'), :timestamp
+        FROM "user" u, json_each(:rows) AS v
+        WHERE u."userId" = :userId
+        ON CONFLICT ("userId", "movieId") DO UPDATE
+        SET rating = excluded.rating, timestamp = excluded.timestamp
+        RETURNING "movieId"
+    """,
+}
+
+
+def upsert_ratings(db: Session, userId, ratings, timestamp):
+    """
+    Inserta o actualiza los ratings de un usuario en una sola sentencia
+    (PostgreSQL o SQLite), sin confirmar la transacción.
+
+    Args:
+        db (Session): Sesión de base de datos.
+        userId (int): Identificador de usuario.
+        ratings (dict): movieId -> rating; las películas ya deben estar validadas.
+            Si un movieId se repite (como int y como str), queda el último.
+        timestamp (datetime): Fecha y hora de los ratings.
+
+    Returns:
+        list: movieId de los ratings nuevos (los demás se actualizaron), o
+        None si el usuario no existe.
+    """
+    dialect = db.get_bind().dialect
+    if dialect.name not in _UPSERT:
+        raise NotImplementedError(f"Motor de base de datos no soportado: {dialect.name}")
+    if not ratings:
+        return []
+
+    # Un par repetido (por ejemplo 10 y "10") debe llegar una sola vez a la
+    # sentencia: ON CONFLICT no actualiza dos veces la misma fila. Queda el último
+    ratings = {int(movieId): value for movieId, value in ratings.items()}
+    # La sentencia no pasa por el tipo de la columna: el rating va en medias estrellas
+    movieIds = list(ratings)
+    values = [DBRating.rating.type.process_bind_param(value, dialect) for value in ratings.values()]
+    statement = text(_UPSERT[dialect.name]).bindparams(bindparam("timestamp", type_=DBRating.timestamp.type))
+
+    if dialect.name == "postgresql":
+        rows = db.execute(statement, {"userId": userId, "movieIds": movieIds, "ratings": values,
+                                      "timestamp": timestamp}).all()
+        if not rows:
+            return None
+        return [movieId for movieId, inserted in rows if inserted]
+
+    # SQLite no indica en RETURNING si la fila se insertó o se actualizó:
+    # se consultan antes los pares existentes
+    existing = set(db.execute(select(DBRating.movieId).where(DBRating.userId == userId,
+                                                             DBRating.movieId.in_(movieIds))).scalars())
+    rows = db.execute(statement, {"userId": userId, "rows": json.dumps(list(zip(movieIds, values))),
+                                  "timestamp": timestamp}).all()
+    if not rows:
+        return None
+    return [movieId for (movieId,) in rows if movieId not in existing]
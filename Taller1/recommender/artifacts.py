@@ -0,0 +1,180 @@
+# python -m recommender.artifacts data/modelUser_pearson.joblib data/models/user
+# python -m recommender.artifacts data/modelItem_pearson.joblib data/models/item --neighbors 200
+
+import argparse
+import json
+import os
+import shutil
+import time
+import joblib
+import numpy as np
+from recommender.knn import KNNParams, UserKNNScorer
+from recommender.item_index import DEFAULT_NEIGHBORS, ItemNeighborIndex
+from recommender.mf import MFScorer
+
+"""
+Formato de artefactos de modelo: un directorio versionado con un archivo .npy
+por arreglo y un manifiesto JSON, que se carga con memoria mapeada
+"""
+
+# Versión del formato del manifiesto
+ARTIFACT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+# Archivo con el nombre de la versión vigente dentro del directorio del modelo
+LATEST_FILE = "LATEST"
+
+SCORER_TYPES = {cls.__name__: cls for cls in (UserKNNScorer, ItemNeighborIndex, MFScorer)}
+
+
+def export_artifact(scorer, directory, version=None, source=None):
+    """
+    Guarda un motor de puntuación como una nueva versión del artefacto.
+
+    La versión se escribe en un directorio temporal y se publica al final
+    (renombrado y actualización de LATEST), de modo que un servidor nunca
+    carga una versión incompleta.
+
+    Args:
+        scorer (UserKNNScorer | ItemNeighborIndex | MFScorer): Motor a exportar.
+        directory (str): Directorio del modelo (contiene las versiones).
+        version (str): Nombre de la versión; por defecto, la fecha y hora.
+        source (str): Opcional, archivo de origen (se anota en el manifiesto).
+
+    Returns:
+        str: Ruta del directorio de la versión creada.
+    """
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    final_path = os.path.join(directory, version)
+    if os.path.exists(final_path):
+        raise ValueError(f"La versión {version} ya existe en {directory}")
+
+    tmp_path = os.path.join(directory, f".{version}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    # Integrar los ratings pendientes de las actualizaciones incrementales; las
+    # matrices densas se escriben directamente en los archivos de la versión
+    def allocate(name, shape, dtype):
+        return np.lib.format.open_memmap(os.path.join(tmp_path, f"{name}.npy"),
+                                         mode="w+", dtype=dtype, shape=shape)
+
+    if getattr(scorer, "n_updates", 0):
+        scorer = scorer.compact(allocate=allocate)
+
+    arrays = dict(scorer.to_arrays())
+    arrays.update({f"params.{name}": value for name, value in scorer.params.arrays().items()})
+
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "type": type(scorer).__name__,
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "source": source,
+        "params": scorer.params.to_dict(),
+        "arrays": {}
+    }
+    for name, value in arrays.items():
+        path = os.path.join(tmp_path, f"{name}.npy")
+        if isinstance(value, np.memmap) and value.filename == os.path.abspath(path):
+            # Ya escrito en la versión durante la compactación
+            value.flush()
+        else:
+            value = np.asarray(value)
+            np.save(path, value, allow_pickle=False)
+        manifest["arrays"][name] = {"dtype": value.dtype.str, "shape": list(value.shape)}
+
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return publish_version(directory, tmp_path, version)
+
+
+def publish_version(directory, tmp_path, version):
+    """
+    Publica una versión escrita en un directorio temporal: la renombra y
+    actualiza LATEST de forma atómica. Devuelve la ruta de la versión.
+    """
+    final_path = os.path.join(directory, version)
+    os.rename(tmp_path, final_path)
+
+    latest_tmp = os.path.join(directory, f".{LATEST_FILE}.tmp")
+    with open(latest_tmp, "w") as f:
+        f.write(version)
+    os.replace(latest_tmp, os.path.join(directory, LATEST_FILE))
+    return final_path
+
+
+def latest_version(directory):
+    """Ruta de la versión vigente de un directorio de modelo (o None)."""
+    latest = os.path.join(directory, LATEST_FILE)
+    if not os.path.exists(latest):
+        return None
+    with open(latest) as f:
+        return os.path.join(directory, f.read().strip())
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"Formato de artefacto no soportado: {manifest.get('format')}")
+    return manifest
+
+
+def load_artifact(path, mmap_mode="r"):
+    """
+    Carga un motor de puntuación desde un artefacto.
+
+    Los arreglos se abren con memoria mapeada: la carga no lee los datos del
+    disco, y los procesos que abren la misma versión comparten sus páginas.
+
+    Args:
+        path (str): Directorio de una versión, o directorio del modelo (se
+            usa la versión indicada en LATEST).
+        mmap_mode (str): Modo de np.load; None lee los arreglos en memoria.
+
+    Returns:
+        UserKNNScorer | ItemNeighborIndex | MFScorer: Motor de puntuación; su atributo
+        ``version`` indica la versión cargada.
+    """
+    if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        version_path = latest_version(path)
+        if version_path is None:
+            raise FileNotFoundError(f"No hay versiones de modelo publicadas en {path}")
+        path = version_path
+
+    manifest = read_manifest(path)
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+              for name in manifest["arrays"]}
+
+    params_arrays = {name.split(".", 1)[1]: arrays.pop(name)
+                     for name in list(arrays) if name.startswith("params.")}
+    scorer_type = SCORER_TYPES[manifest["type"]]
+    params = getattr(scorer_type, "params_type", KNNParams).from_dict(manifest["params"], params_arrays)
+
+    scorer = scorer_type.from_arrays(params, arrays)
+    scorer.version = manifest["version"]
+    return scorer
+
+
+def scorer_from_model(model, n_neighbors=DEFAULT_NEIGHBORS):
+    """Motor de puntuación para un modelo KNN de Surprise (user o item-based)."""
+    if model.sim_options.get("user_based", True):
+        return UserKNNScorer.from_surprise(model)
+    return ItemNeighborIndex.from_surprise(model, n_neighbors=n_neighbors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta un modelo KNN de Surprise a un artefacto con memoria mapeada")
+    parser.add_argument("model", help="Modelo de Surprise (.joblib)")
+    parser.add_argument("output", help="Directorio del modelo (se crea una versión dentro)")
+    parser.add_argument("--version", help="Nombre de la versión (por defecto, fecha y hora)")
+    parser.add_argument("--neighbors", type=int, default=DEFAULT_NEIGHBORS,
+                        help="Vecinos conservados por película (modelos item-based)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    scorer = scorer_from_model(joblib.load(args.model), n_neighbors=args.neighbors)
+    path = export_artifact(scorer, args.output, version=args.version, source=args.model)
+    print(f"Artefacto {type(scorer).__name__} guardado en {path} "
+          f"({time.perf_counter() - start:.1f} s)")
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict
+
+"""
+Caché acotada (LRU + TTL) para recomendaciones
+"""
+
+
+class RecommendationCache:
+    """
+    Caché de recomendaciones con capacidad máxima, expiración y un índice
+    secundario userId -> claves para invalidar a un usuario en O(1).
+
+    Cada usuario tiene además una generación que aumenta al invalidarlo. Un
+    cálculo que toma la generación antes de empezar (``generation``) y la
+    entrega a ``set`` no se guarda si el usuario se invalidó mientras tanto:
+    sus resultados corresponden a los ratings anteriores.
+
+    Args:
+        max_entries (int): Número máximo de entradas; al superarlo se
+            descarta la menos usada recientemente (LRU).
+        ttl (float): Segundos de vigencia de cada entrada.
+        sweep_interval (float): Segundos entre barridos de entradas vencidas.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600, sweep_interval=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        # Generación de cada usuario invalidado y generación global (clear)
+        self._generations = {}
+        self._generation = 0
+        self._stop = threading.Event()
+        self._sweeper = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_writes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, _, value = entry
+            if expires_at <= time.monotonic():
+                # Borrar caché expirada
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, userId):
+        """Generación vigente de un usuario, para entregarla a ``set`` al terminar un cálculo."""
+        with self._lock:
+            return self._generation, self._generations.get(userId, 0)
+
+    def set(self, key, value, userId=None, generation=None):
+        """
+        Guarda una entrada. Si se indica ``generation`` y el usuario se
+        invalidó después de obtenerla, no se guarda y devuelve False.
+        """
+        with self._lock:
+            if generation is not None and generation != (self._generation, self._generations.get(userId, 0)):
+                self.stale_writes += 1
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, userId, value)
+            if userId is not None:
+                self._user_keys.setdefault(userId, set()).add(key)
+
+            # Descartar las entradas menos usadas si se supera la capacidad
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def _remove(self, key):
+        _, userId, _ = self._entries.pop(key)
+        keys = self._user_keys.get(userId)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[userId]
+
+    def invalidate_user(self, userId):
+        """Elimina todas las entradas de un usuario y descarta sus cálculos en curso."""
+        with self._lock:
+            for key in self._user_keys.pop(userId, ()):
+                del self._entries[key]
+            self._generations[userId] = self._generations.get(userId, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._user_keys.clear()
+
+    def expire(self):
+        """Elimina las entradas vencidas; devuelve cuántas se eliminaron."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (expires_at, _, _) in self._entries.items() if expires_at <= now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def _sweep(self):
+        while not self._stop.wait(self.sweep_interval):
+            self.expire()
+
+    def start(self):
+        """Inicia el barrido periódico de entradas vencidas en segundo plano."""
+        if self._sweeper is None:
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep, name="cache-expiry", daemon=True)
+            self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "users": len(self._user_keys),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_writes": self.stale_writes,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,90 @@
+import numpy as np
+from recommender.knn import top_n_indices
+
+"""
+Lista de candidatas puntuadas de un usuario, agrupada por banda de rating
+"""
+
+
+def rank_predictions(movie_ids, estimates, impossible, catalog, n=None):
+    """
+    Ordena las predicciones de un usuario por rating estimado (redondeado a 2
+    decimales, estable en empates), omitiendo las imposibles y las películas
+    fuera del catálogo.
+
+    Returns:
+        tuple: (top, rows) posiciones ordenadas en movie_ids y fila del
+        catálogo de cada candidata.
+    """
+    rows = catalog.rows(movie_ids)
+    kept = np.flatnonzero(~impossible & (rows >= 0))
+    rounded = np.array([round(e, 2) for e in estimates[kept].tolist()])
+    return kept[top_n_indices(rounded, kept.size if n is None else n)], rows
+
+
+class ScoredCandidates:
+    """
+    Predicciones de un usuario para un modelo, calculadas una sola vez y
+    ordenadas por rating estimado. Cualquier combinación de filtros de rating
+    y cualquier página se sirven desde esta lista sin nuevas predicciones.
+
+    Atributos:
+        items (list): Recomendaciones (movieId, title, genres,
+            predicted_rating) ordenadas por rating estimado descendente.
+        bands (ndarray): Banda de cada recomendación: la parte entera del
+            rating estimado redondeado a un decimal.
+        by_band (dict): Posiciones (en items) de cada banda.
+    """
+
+    def __init__(self, items, bands):
+        self.items = items
+        self.bands = np.asarray(bands, dtype=np.int64)
+        self.by_band = {int(band): np.flatnonzero(self.bands == band)
+                        for band in np.unique(self.bands)}
+
+    @classmethod
+    def from_predictions(cls, movieIds, estimates, impossible, catalog, n=None):
+        """
+        Construye la lista a partir de las predicciones de un conjunto de
+        películas candidatas.
+
+        Args:
+            movieIds (list): Películas candidatas.
+            estimates (ndarray): Rating estimado de cada candidata.
+            impossible (ndarray): Predicciones imposibles (se omiten).
+            catalog (MovieCatalog): Catálogo para títulos y géneros.
+            n (int): Opcional, conservar solo las n mejores.
+        """
+        movie_ids = np.asarray(movieIds, dtype=np.int64)
+        top, rows = rank_predictions(movie_ids, estimates, impossible, catalog, n)
+
+        items = [{
+            'movieId': int(movie_ids[idx]),
+            'title': catalog.titles[rows[idx]],
+            'genres': catalog.genres[rows[idx]],
+            'predicted_rating': round(float(estimates[idx]), 2)
+        } for idx in top]
+        bands = [int(np.floor(round(e, 1))) for e in estimates[top].tolist()]
+        return cls(items, bands)
+
+    def __len__(self):
+        return len(self.items)
+
+    def positions(self, filter_list=None):
+        """Posiciones de las recomendaciones en las bandas indicadas (todas si no hay filtro)."""
+        if not filter_list:
+            return np.arange(len(self.items))
+        selected = [self.by_band[band] for band in set(filter_list) if band in self.by_band]
+        if not selected:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(selected))
+
+    def page(self, filter_list=None, offset=0, limit=9):
+        """
+        Página de recomendaciones filtradas por banda de rating.
+
+        Returns:
+            tuple: (items de la página, total de recomendaciones filtradas).
+        """
+        positions = self.positions(filter_list)
+        return [self.items[pos] for pos in positions[offset:offset + limit]], positions.size
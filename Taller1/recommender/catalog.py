@@ -0,0 +1,228 @@
+import bisect
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+import numpy as np
+from sqlalchemy.orm import Session
+from db.models import movie as DBMovie
+
+"""
+Catálogo de películas en memoria, compartido por todo el proceso
+"""
+
+
+def normalize_title(text):
+    """Texto en minúsculas, sin tildes ni signos, con las palabras separadas por un espacio."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+
+class TitleIndex:
+    """
+    Índice de trigramas de los títulos normalizados para la búsqueda mientras
+    se escribe. Cada título se indexa con un espacio inicial, de modo que los
+    trigramas que empiezan con espacio marcan el inicio de una palabra; se
+    indexan además los bigramas de inicio de palabra para las búsquedas de
+    una sola letra. Las listas guardan posiciones en el orden por título, así
+    que su intersección ya queda ordenada alfabéticamente.
+
+    Args:
+        titles (ndarray): Título de cada fila del catálogo.
+        title_order (ndarray): Filas del catálogo ordenadas por título.
+    """
+
+    def __init__(self, titles, title_order):
+        self._rows = title_order
+        self._texts = [" " + normalize_title(titles[row]) for row in title_order]
+        postings = defaultdict(list)
+        for position, text in enumerate(self._texts):
+            grams = {text[i:i + 3] for i in range(len(text) - 2)}
+            grams.update(text[i:i + 2] for i in range(len(text) - 1) if text[i] == " ")
+            for gram in grams:
+                postings[gram].append(position)
+        self._postings = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+
+    def search(self, query, limit=20):
+        """
+        Filas cuyos títulos contienen la búsqueda al inicio de una palabra:
+        primero los títulos que empiezan por ella y luego el resto, ambos en
+        orden alfabético.
+        """
+        query = " " + normalize_title(query)
+        if len(query) < 2 or limit <= 0:
+            return []
+        grams = {query[i:i + 3] for i in range(len(query) - 2)} or {query}
+        postings = sorted((self._postings.get(gram) for gram in grams),
+                          key=lambda positions: -1 if positions is None else positions.size)
+        if postings[0] is None:
+            return []
+        positions = postings[0]
+        for other in postings[1:]:
+            if positions.size == 0:
+                break
+            positions = np.intersect1d(positions, other, assume_unique=True)
+
+        # Verificar los candidatos; con suficientes títulos que empiezan por
+        # la búsqueda no hace falta revisar el resto
+        prefix, other = [], []
+        for position in positions.tolist():
+            text = self._texts[position]
+            if text.startswith(query):
+                prefix.append(position)
+                if len(prefix) == limit:
+                    break
+            elif len(other) < limit and query in text:
+                other.append(position)
+        return [int(self._rows[position]) for position in (prefix + other)[:limit]]
+
+
+class MovieCatalog:
+    """
+    Catálogo de películas en arreglos (ids, títulos, géneros).
+
+    Atributos:
+        movie_ids (ndarray): movieId de cada fila, en orden ascendente.
+        titles (ndarray): Título de cada fila.
+        genres (ndarray): Género(s) de cada fila.
+        version (int): Versión del catálogo con la que se cargó.
+    """
+
+    def __init__(self, movie_ids, titles, genres, version=0):
+        order = np.argsort(movie_ids, kind="stable")
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)[order]
+        self.titles = np.asarray(titles, dtype=object)[order]
+        self.genres = np.asarray(genres, dtype=object)[order]
+        self.version = version
+
+        # Fila de cada movieId (-1 si no existe) para búsquedas O(1)
+        size = int(self.movie_ids[-1]) + 1 if self.movie_ids.size else 0
+        self._row_of = np.full(size, -1, dtype=np.int32)
+        self._row_of[self.movie_ids] = np.arange(self.movie_ids.size, dtype=np.int32)
+
+        # Vista ordenada por título (y movieId en empate) para paginar; un
+        # título nulo se ordena como texto vacío
+        self.title_order = np.array(sorted(range(self.movie_ids.size), key=self._title_key), dtype=np.int64)
+        # Claves (título, movieId) en ese orden, para paginar por cursor con búsqueda binaria
+        self.title_keys = [self._title_key(row) for row in self.title_order]
+        self._title_index = None
+        self._index_lock = threading.Lock()
+
+    def _title_key(self, row):
+        return str(self.titles[row] or ""), int(self.movie_ids[row])
+
+    @classmethod
+    def from_db(cls, db: Session, version=0):
+        rows = db.query(DBMovie.movieId, DBMovie.title, DBMovie.genres).all()
+        return cls(movie_ids=[row[0] for row in rows],
+                   titles=[row[1] for row in rows],
+                   genres=[row[2] for row in rows],
+                   version=version)
+
+    def __len__(self):
+        return self.movie_ids.size
+
+    def __contains__(self, movieId):
+        return self.row(movieId) >= 0
+
+    def row(self, movieId):
+        """Fila de una película o -1 si no existe."""
+        movieId = int(movieId)
+        if 0 <= movieId < self._row_of.size:
+            return int(self._row_of[movieId])
+        return -1
+
+    def rows(self, movieIds):
+        """Filas de un arreglo de movieId (-1 para los que no existen)."""
+        movieIds = np.asarray(movieIds, dtype=np.int64)
+        rows = np.full(movieIds.size, -1, dtype=np.int64)
+        valid = (movieIds >= 0) & (movieIds < self._row_of.size)
+        rows[valid] = self._row_of[movieIds[valid]]
+        return rows
+
+    def record(self, row):
+        return {
+            'movieId': int(self.movie_ids[row]),
+            'title': self.titles[row],
+            'genres': self.genres[row]
+        }
+
+    def get(self, movieId):
+        row = self.row(movieId)
+        return self.record(row) if row >= 0 else None
+
+    def page(self, offset=0, limit=100, order="asc"):
+        """Página del catálogo ordenado por título."""
+        title_order = self.title_order if order == "asc" else self.title_order[::-1]
+        return [self.record(row) for row in title_order[offset:offset + limit]]
+
+    def page_after(self, after=None, limit=100, order="asc"):
+        """
+        Página del catálogo ordenado por título a partir de un cursor: las
+        películas que siguen a la clave ``after`` (título, movieId) en el
+        orden indicado. A diferencia de ``offset``, el costo no depende de la
+        profundidad de la página y el cursor sigue siendo válido si el
+        catálogo cambia.
+
+        Returns:
+            tuple: (películas de la página, clave de la última o None si no hay más).
+        """
+        if order == "asc":
+            start = bisect.bisect_right(self.title_keys, after) if after is not None else 0
+            rows = self.title_order[start:start + limit]
+            more = start + limit < len(self.title_keys)
+        else:
+            end = bisect.bisect_left(self.title_keys, after) if after is not None else len(self.title_keys)
+            rows = self.title_order[max(0, end - limit):end][::-1]
+            more = end - limit > 0
+        last = self._title_key(rows[-1]) if more and len(rows) else None
+        return [self.record(row) for row in rows], last
+
+    def title_index(self):
+        """Índice de búsqueda por título (se construye la primera vez)."""
+        if self._title_index is None:
+            with self._index_lock:
+                if self._title_index is None:
+                    self._title_index = TitleIndex(self.titles, self.title_order)
+        return self._title_index
+
+    def search(self, query, limit=20):
+        """Películas cuyo título contiene palabras que empiezan por ``query`` (búsqueda mientras se escribe)."""
+        return [self.record(row) for row in self.title_index().search(query, limit)]
+
+
+class CatalogStore:
+    """
+    Mantiene el catálogo vigente del proceso.
+
+    El catálogo se carga una sola vez y se recarga solo cuando su versión
+    queda desactualizada, es decir, después de ``invalidate`` (carga de
+    películas).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalog = None
+        self.version = 0
+
+    def get(self, db: Session):
+        catalog = self._catalog
+        if catalog is not None and catalog.version == self.version:
+            return catalog
+
+        with self._lock:
+            if self._catalog is None or self._catalog.version != self.version:
+                self._catalog = MovieCatalog.from_db(db, version=self.version)
+            return self._catalog
+
+    def current(self):
+        """Catálogo vigente si ya está cargado (sin acceder a la base de datos), o None."""
+        catalog = self._catalog
+        if catalog is not None and catalog.version == self.version:
+            return catalog
+        return None
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
@@ -0,0 +1,451 @@
+# python -m recommender.item_index data/modelItem_pearson.joblib data/itemIndex_pearson.npz
+
+import argparse
+import copy
+import joblib
+import numpy as np
+from recommender.knn import (KNNParams, aggregate, fold_in_params, gather_segments,
+                             pearson_sims, replace_rows, update_moments)
+
+"""
+Índice podado de vecinos ítem-ítem para recomendaciones item-based
+"""
+
+# Número de vecinos conservados por película
+DEFAULT_NEIGHBORS = 200
+
+
+class ItemNeighborIndex:
+    """
+    Conserva solo los K vecinos más similares (Pearson) de cada película en
+    arreglos CSR, en lugar de la matriz densa ítem-ítem del modelo.
+
+    Cuando un usuario tiene al menos ``k`` películas calificadas dentro de los
+    K vecinos de un candidato, la estimación coincide con ``predict``; en otro
+    caso se agregan solo los vecinos conservados. Las similitudes y los ratings
+    se guardan en float64, como en el modelo, para no alterar las estimaciones
+    ni el orden de los empates.
+
+    Los ratings nuevos (``with_ratings``) se guardan como cambios pendientes:
+    historiales de usuario y listas de vecinos reemplazadas, hasta integrarlos
+    con ``compact``.
+
+    Atributos:
+        params (KNNParams): Parámetros de agregación del modelo.
+        indptr (ndarray): Inicio de los vecinos de cada ítem interno.
+        neighbors (ndarray): Ítems internos vecinos, por similitud descendente.
+        sims (ndarray): Similitud de cada vecino.
+        item_raw_ids (ndarray): movieId de cada ítem interno.
+        user_indptr (ndarray): Inicio de los ratings de cada usuario interno.
+        user_items (ndarray): Ítems internos calificados por cada usuario.
+        user_ratings (ndarray): Rating de cada entrada de user_items.
+        user_raw_ids (ndarray): userId de cada usuario interno.
+        n_neighbors (int): Vecinos conservados por película (K); si no se
+            indica, el largo de la lista más larga.
+    """
+
+    def __init__(self, params, indptr, neighbors, sims, item_raw_ids,
+                 user_indptr, user_items, user_ratings, user_raw_ids, n_neighbors=None):
+        self.params = params
+        self.indptr = indptr
+        self.neighbors = neighbors
+        self.sims = sims
+        self.item_raw_ids = item_raw_ids
+        self.user_indptr = user_indptr
+        self.user_items = user_items
+        self.user_ratings = user_ratings
+        self.user_raw_ids = user_raw_ids
+        self._n_neighbors = int(n_neighbors) if n_neighbors is not None else None
+        self.raw2inner_items = {raw: inner for inner, raw in enumerate(item_raw_ids.tolist())}
+        self.raw2inner_users = {raw: inner for inner, raw in enumerate(user_raw_ids.tolist())}
+        # Cambios pendientes: usuario -> (ítems, ratings) e ítem -> (vecinos, similitudes)
+        self.user_rows = {}
+        self.neighbor_rows = {}
+        self.n_updates = 0
+
+    @property
+    def pending_bytes(self):
+        """Memoria ocupada por los cambios pendientes (bytes)."""
+        return sum(array.nbytes for rows in (self.user_rows, self.neighbor_rows)
+                   for row in rows.values() for array in row)
+
+    @property
+    def n_items(self):
+        return self.item_raw_ids.size
+
+    @classmethod
+    def from_surprise(cls, model, n_neighbors=DEFAULT_NEIGHBORS, chunk_size=1024):
+        if model.sim_options.get("user_based", True):
+            raise ValueError("El modelo no es item-based")
+
+        trainset = model.trainset
+        n_items = trainset.n_items
+        n_neighbors = min(n_neighbors, n_items)
+
+        # Top-K vecinos positivos por fila, procesando la matriz densa por bloques
+        indptr = np.zeros(n_items + 1, dtype=np.int64)
+        neighbors, sims = [], []
+        for start in range(0, n_items, chunk_size):
+            block = np.array(model.sim[start:start + chunk_size], dtype=np.float64)
+            if n_neighbors < n_items:
+                top = np.argpartition(-block, n_neighbors - 1, axis=1)[:, :n_neighbors]
+            else:
+                top = np.tile(np.arange(n_items), (block.shape[0], 1))
+            top_sims = np.take_along_axis(block, top, axis=1)
+            # Ordenar por similitud descendente y, en empate, por índice
+            order = np.lexsort((top, -top_sims), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_sims = np.take_along_axis(top_sims, order, axis=1)
+            for row, (cols, vals) in enumerate(zip(top, top_sims)):
+                positive = vals > 0
+                neighbors.append(cols[positive].astype(np.int32))
+                sims.append(vals[positive])
+                indptr[start + row + 1] = positive.sum()
+        np.cumsum(indptr, out=indptr)
+
+        # Ratings de entrenamiento por usuario en formato CSR
+        user_indptr = np.zeros(trainset.n_users + 1, dtype=np.int64)
+        user_items, user_ratings = [], []
+        for u in range(trainset.n_users):
+            ratings = trainset.ur[u]
+            user_indptr[u + 1] = user_indptr[u] + len(ratings)
+            user_items.extend(i for i, _ in ratings)
+            user_ratings.extend(r for _, r in ratings)
+
+        params = KNNParams.from_surprise(model)
+        return cls(params=params,
+                   indptr=indptr,
+                   neighbors=np.concatenate(neighbors) if neighbors else np.empty(0, np.int32),
+                   sims=np.concatenate(sims) if sims else np.empty(0, np.float64),
+                   item_raw_ids=np.array([trainset.to_raw_iid(i) for i in range(n_items)]),
+                   user_indptr=user_indptr,
+                   user_items=np.array(user_items, dtype=np.int32),
+                   user_ratings=np.array(user_ratings, dtype=np.float64),
+                   user_raw_ids=np.array([trainset.to_raw_uid(u) for u in range(trainset.n_users)]),
+                   n_neighbors=n_neighbors)
+
+    def save(self, path):
+        params = self.params
+        optional = {name: getattr(params, name) for name in ("means", "sigmas", "bu", "bi")
+                    if getattr(params, name) is not None}
+        np.savez(path,
+                 kind=params.kind, k=params.k, min_k=params.min_k,
+                 sim_name=params.sim_name or "", min_support=params.min_support,
+                 rating_scale=np.array(params.rating_scale, dtype=np.float64),
+                 global_mean=params.global_mean,
+                 indptr=self.indptr, neighbors=self.neighbors, sims=self.sims,
+                 item_raw_ids=self.item_raw_ids,
+                 user_indptr=self.user_indptr, user_items=self.user_items,
+                 user_ratings=self.user_ratings, user_raw_ids=self.user_raw_ids,
+                 n_neighbors=self.n_neighbors, **optional)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            params = KNNParams(kind=str(data["kind"]),
+                               k=int(data["k"]),
+                               min_k=int(data["min_k"]),
+                               rating_scale=tuple(data["rating_scale"].tolist()),
+                               global_mean=float(data["global_mean"]),
+                               means=data["means"] if "means" in data else None,
+                               sigmas=data["sigmas"] if "sigmas" in data else None,
+                               bu=data["bu"] if "bu" in data else None,
+                               bi=data["bi"] if "bi" in data else None,
+                               user_based=False,
+                               sim_name=str(data["sim_name"]) or None if "sim_name" in data else None,
+                               min_support=int(data["min_support"]) if "min_support" in data else 1)
+            return cls(params=params,
+                       indptr=data["indptr"], neighbors=data["neighbors"], sims=data["sims"],
+                       item_raw_ids=data["item_raw_ids"],
+                       user_indptr=data["user_indptr"], user_items=data["user_items"],
+                       user_ratings=data["user_ratings"], user_raw_ids=data["user_raw_ids"],
+                       n_neighbors=int(data["n_neighbors"]) if "n_neighbors" in data else None)
+
+    def to_arrays(self):
+        return {
+            "indptr": self.indptr,
+            "neighbors": self.neighbors,
+            "sims": self.sims,
+            "item_raw_ids": self.item_raw_ids,
+            "user_indptr": self.user_indptr,
+            "user_items": self.user_items,
+            "user_ratings": self.user_ratings,
+            "user_raw_ids": self.user_raw_ids,
+            "n_neighbors": np.array(self.n_neighbors, dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, params, arrays):
+        return cls(params=params, **arrays)
+
+    @property
+    def n_neighbors(self):
+        # Los índices guardados antes de conservar K usan la lista más larga
+        if self._n_neighbors is not None:
+            return self._n_neighbors
+        return int(np.diff(self.indptr).max(initial=0))
+
+    def user_history(self, userId):
+        """Ítems internos y ratings de entrenamiento de un usuario (o None)."""
+        inner_user = self.raw2inner_users.get(userId)
+        if inner_user is None:
+            return None, None
+        return self._history(inner_user)
+
+    def _history(self, u):
+        if u in self.user_rows:
+            return self.user_rows[u]
+        start, end = self.user_indptr[u], self.user_indptr[u + 1]
+        return self.user_items[start:end], self.user_ratings[start:end]
+
+    def _neighbor_row(self, i):
+        if i in self.neighbor_rows:
+            return self.neighbor_rows[i]
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.neighbors[start:end], self.sims[start:end]
+
+    def _neighbor_entries(self, rows):
+        # Vecinos y similitudes de cada fila, con las listas reemplazadas pendientes
+        seg, idx = gather_segments(self.indptr, rows)
+        nb, sims = self.neighbors[idx], self.sims[idx]
+        replaced = [(s, self.neighbor_rows[row]) for s, row in enumerate(rows.tolist())
+                    if row in self.neighbor_rows]
+        if not replaced:
+            return seg, nb, sims
+        keep = ~np.isin(seg, [s for s, _ in replaced])
+        return (np.concatenate([seg[keep]] + [np.full(len(n), s) for s, (n, _) in replaced]),
+                np.concatenate([nb[keep]] + [n for _, (n, _) in replaced]),
+                np.concatenate([sims[keep]] + [v for _, (_, v) in replaced]))
+
+    def _item_raters(self, i):
+        # Usuarios que calificaron un ítem y sus ratings (recorre el CSR por usuario)
+        positions = np.flatnonzero(self.user_items == i)
+        users = np.searchsorted(self.user_indptr, positions, side="right") - 1
+        ratings = self.user_ratings[positions].astype(np.float64)
+        pending = np.isin(users, np.fromiter(self.user_rows, dtype=np.int64, count=len(self.user_rows)))
+        users, ratings = users[~pending], ratings[~pending]
+
+        extra_users, extra_ratings = [], []
+        for u, (items, values) in self.user_rows.items():
+            hit = np.flatnonzero(items == i)
+            if hit.size:
+                extra_users.append(u)
+                extra_ratings.append(float(values[hit[0]]))
+        return (np.concatenate([users, np.array(extra_users, dtype=np.int64)]),
+                np.concatenate([ratings, np.array(extra_ratings, dtype=np.float64)]))
+
+    def _patch_neighbor(self, j, i, sim, n_neighbors):
+        # Actualiza la similitud de i en la lista de vecinos de j
+        nbrs, sims = self._neighbor_row(j)
+        keep = nbrs != i
+        nbrs, sims = nbrs[keep], sims[keep]
+        if sim > 0 and (nbrs.size < n_neighbors or sim > sims.min()):
+            nbrs = np.append(nbrs, i)
+            sims = np.append(sims, sim)
+            # Ordenar por similitud descendente y, en empate, por índice
+            order = np.lexsort((nbrs, -sims))[:n_neighbors]
+            nbrs, sims = nbrs[order], sims[order]
+        self.neighbor_rows[j] = (nbrs.astype(np.int32), sims.astype(np.float64))
+
+    def with_ratings(self, ratings):
+        """
+        Nueva versión del índice con ratings agregados o actualizados. La
+        versión actual no se modifica (las peticiones en curso la siguen usando).
+
+        Para cada película afectada se recalculan su media, su similitud de
+        Pearson con las demás y su lista de vecinos, y se actualiza su
+        similitud en las listas de las películas con las que comparte
+        usuarios. Una película que sale de una lista podada no se reemplaza
+        por la siguiente (no se conserva); ``compact`` no lo corrige, solo un
+        reentrenamiento. Los usuarios o películas fuera del modelo se omiten.
+
+        Args:
+            ratings (list): Tuplas (userId, movieId, rating).
+
+        Returns:
+            tuple: (nueva versión, número de ratings aplicados).
+        """
+        if self.params.sim_name != "pearson":
+            raise ValueError(f"Actualización incremental no soportada para la similitud {self.params.sim_name}")
+
+        updated = copy.copy(self)
+        updated.user_rows = dict(self.user_rows)
+        updated.neighbor_rows = dict(self.neighbor_rows)
+        touched = {}
+        for userId, movieId, rating in ratings:
+            u = self.raw2inner_users.get(userId)
+            i = self.raw2inner_items.get(movieId)
+            if u is None or i is None:
+                continue
+            items, values = updated._history(u)
+            hit = np.flatnonzero(items == i)
+            if hit.size:
+                values = np.array(values)
+                values[hit[0]] = rating
+            else:
+                items = np.append(items, i).astype(self.user_items.dtype)
+                values = np.append(values, rating).astype(self.user_ratings.dtype)
+            updated.user_rows[u] = (items, values)
+            touched.setdefault(i, set()).add(u)
+            updated.n_updates += 1
+        if not touched:
+            return self, 0
+
+        n_items, n_neighbors = self.n_items, self.n_neighbors
+        item_ratings = {}
+        for i in sorted(touched):
+            raters, rated = updated._item_raters(i)
+            item_ratings[i] = rated
+
+            # Pearson contra todos los ítems calificados por los usuarios de i
+            pending = np.isin(raters, np.fromiter(updated.user_rows, dtype=np.int64,
+                                                  count=len(updated.user_rows)))
+            seg, idx = gather_segments(self.user_indptr, raters[~pending])
+            others = [self.user_items[idx].astype(np.int64)]
+            r_self = [rated[~pending][seg]]
+            r_other = [self.user_ratings[idx].astype(np.float64)]
+            for u, r in zip(raters[pending].tolist(), rated[pending].tolist()):
+                items, values = updated.user_rows[u]
+                others.append(items.astype(np.int64))
+                r_self.append(np.full(items.size, r))
+                r_other.append(values.astype(np.float64))
+            row = pearson_sims(n_items, np.concatenate(others), np.concatenate(r_self),
+                               np.concatenate(r_other), self.params.min_support)
+            row[i] = 1.0
+
+            # Lista de vecinos de i: top-K positivos, en empate por índice
+            top = np.lexsort((np.arange(n_items), -row))[:n_neighbors]
+            top = top[row[top] > 0]
+            updated.neighbor_rows[i] = (top.astype(np.int32), row[top])
+
+            # Ítems cuya similitud con i cambió: los calificados por los usuarios nuevos de i
+            changed = np.unique(np.concatenate([updated._history(u)[0] for u in touched[i]]))
+            for j in changed.tolist():
+                if j != i:
+                    updated._patch_neighbor(j, i, row[j], n_neighbors)
+
+        updated.params = update_moments(self.params, item_ratings)
+        return updated, updated.n_updates - self.n_updates
+
+    def compact(self, allocate=None):
+        """
+        Nueva versión con los cambios pendientes integrados en los arreglos.
+
+        Args:
+            allocate (callable): Se acepta por compatibilidad con
+                ``UserKNNScorer.compact``; el índice no tiene matrices densas y
+                sus arreglos CSR se construyen en memoria.
+        """
+        if not self.n_updates:
+            return self
+
+        indptr, (neighbors, sims) = replace_rows(
+            self.indptr, (self.neighbors, self.sims), self.neighbor_rows)
+        user_indptr, (user_items, user_ratings) = replace_rows(
+            self.user_indptr, (self.user_items, self.user_ratings), self.user_rows)
+
+        compacted = ItemNeighborIndex(params=self.params,
+                                      indptr=indptr, neighbors=neighbors, sims=sims,
+                                      item_raw_ids=self.item_raw_ids,
+                                      user_indptr=user_indptr, user_items=user_items,
+                                      user_ratings=user_ratings, user_raw_ids=self.user_raw_ids,
+                                      n_neighbors=self._n_neighbors)
+        compacted.version = getattr(self, "version", None)
+        return compacted
+
+    def score(self, userId, movieIds):
+        """
+        Predice el rating de un usuario para una lista de películas cruzando
+        los vecinos podados de cada candidata con las películas calificadas.
+
+        Args:
+            userId: Id (raw) del usuario.
+            movieIds (list): Ids (raw) de las películas candidatas.
+
+        Returns:
+            tuple: (est, impossible) arreglos alineados con movieIds.
+        """
+        inner_user = self.raw2inner_users.get(userId)
+        if inner_user is None:
+            return self._predict(self.params, None, None, None, movieIds)
+        rated_items, rated_values = self._history(inner_user)
+        return self._predict(self.params, inner_user, rated_items, rated_values, movieIds)
+
+    def fold_in(self, ratings, movieIds):
+        """
+        Predice el rating de un usuario que no está en el modelo (por ejemplo,
+        creado después del entrenamiento) a partir de sus ratings, sin
+        reentrenar: se cruzan los vecinos de cada candidata con las películas
+        que calificó, igual que para un usuario conocido.
+
+        Args:
+            ratings (dict): movieId -> rating del usuario.
+            movieIds (list): Ids (raw) de las películas candidatas.
+
+        Returns:
+            tuple: (est, impossible) arreglos alineados con movieIds.
+        """
+        rated = [(self.raw2inner_items[m], r) for m, r in ratings.items() if m in self.raw2inner_items]
+        # El usuario nuevo ocupa el índice siguiente al último usuario del modelo
+        params = fold_in_params(self.params, None)
+        if not rated:
+            return self._predict(params, None, None, None, movieIds)
+        rated_items = np.array([i for i, _ in rated], dtype=np.int64)
+        rated_values = np.array([r for _, r in rated], dtype=np.float64)
+        return self._predict(params, self.user_raw_ids.size, rated_items, rated_values, movieIds)
+
+    def _predict(self, params, inner_user, rated_items, rated_values, movieIds):
+        # Cruza los vecinos de cada candidata con el historial del usuario
+        n = len(movieIds)
+        inner_items = np.fromiter((self.raw2inner_items.get(m, -1) for m in movieIds),
+                                  dtype=np.int64, count=n)
+
+        est = np.full(n, params.global_mean, dtype=np.float64)
+        impossible = np.ones(n, dtype=bool)
+        known = inner_items >= 0
+
+        if params.kind == "KNNBaseline":
+            # KNNBaseline nunca es imposible: usa los sesgos conocidos
+            impossible[:] = False
+            if inner_user is not None:
+                est += params.bu[inner_user]
+            est[known] += params.bi[inner_items[known]]
+
+        if inner_user is None or not known.any():
+            return params.clip(est), impossible
+
+        # Posición de cada película en el historial del usuario (-1 si no la calificó)
+        position = np.full(self.n_items, -1, dtype=np.int64)
+        position[rated_items] = np.arange(rated_items.size)
+        rating_of = np.zeros(self.n_items, dtype=np.float64)
+        rating_of[rated_items] = rated_values
+
+        # Conservar solo los vecinos que el usuario ha calificado
+        rows = inner_items[known]
+        seg, nb, sims = self._neighbor_entries(rows)
+        hit = position[nb] >= 0
+        seg, nb, sims = seg[hit], nb[hit], sims[hit]
+        # Recorrer los vecinos en el orden del historial, como hace Surprise con los empates
+        order = np.lexsort((position[nb], seg))
+        seg, nb, sims = seg[order], nb[order], sims[order]
+        y = np.full(rows.size, inner_user, dtype=np.int64)
+
+        est_known, impossible_known, _ = aggregate(
+            params, seg, sims.astype(np.float64), rating_of[nb], nb, rows, y, rows.size)
+        est[known] = est_known
+        impossible[known] = impossible_known
+        return params.clip(est), impossible
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye el índice podado de vecinos ítem-ítem")
+    parser.add_argument("model", help="Modelo item-item de Surprise (.joblib)")
+    parser.add_argument("output", help="Archivo .npz de salida")
+    parser.add_argument("--neighbors", type=int, default=DEFAULT_NEIGHBORS,
+                        help="Vecinos conservados por película")
+    args = parser.parse_args()
+
+    index = ItemNeighborIndex.from_surprise(joblib.load(args.model), n_neighbors=args.neighbors)
+    index.save(args.output)
+    print(f"Índice guardado en {args.output}: {index.n_items} películas, "
+          f"{index.neighbors.size} vecinos")
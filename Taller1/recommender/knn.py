@@ -0,0 +1,719 @@
+import copy
+from itertools import chain
+import numpy as np
+
+"""
+Motor de puntuación vectorizado para modelos KNN de Surprise
+"""
+
+# Algoritmos KNN de Surprise soportados por el motor
+KNN_KINDS = ("KNNBasic", "KNNWithMeans", "KNNWithZScore", "KNNBaseline")
+# Filas de la matriz de similitud copiadas por bloque al compactarla
+COPY_BLOCK_ROWS = 1024
+
+
+class KNNParams:
+    """
+    Parámetros de agregación extraídos de un modelo KNN de Surprise.
+
+    Atributos:
+        kind (str): Nombre del algoritmo (KNNBasic, KNNWithMeans, ...).
+        k (int): Número máximo de vecinos a agregar.
+        min_k (int): Número mínimo de vecinos para una predicción válida.
+        rating_scale (tuple): Escala (mínimo, máximo) de los ratings.
+        global_mean (float): Media global de los ratings de entrenamiento.
+        means (ndarray): Media de cada x (usuario o ítem según el modelo).
+        sigmas (ndarray): Desviación de cada x (solo KNNWithZScore).
+        bu (ndarray): Sesgos de usuario (solo KNNBaseline).
+        bi (ndarray): Sesgos de ítem (solo KNNBaseline).
+        user_based (bool): Si la similitud es entre usuarios o entre ítems.
+        sim_name (str): Medida de similitud (pearson, cosine, msd, ...).
+        min_support (int): Mínimo de elementos en común para una similitud no nula.
+    """
+
+    def __init__(self, kind, k, min_k, rating_scale, global_mean,
+                 means=None, sigmas=None, bu=None, bi=None, user_based=True,
+                 sim_name=None, min_support=1):
+        if kind not in KNN_KINDS:
+            raise ValueError(f"Algoritmo KNN no soportado: {kind}")
+        self.kind = kind
+        self.k = k
+        self.min_k = min_k
+        self.rating_scale = rating_scale
+        self.global_mean = global_mean
+        self.means = means
+        self.sigmas = sigmas
+        self.bu = bu
+        self.bi = bi
+        self.user_based = user_based
+        self.sim_name = sim_name
+        self.min_support = min_support
+
+    @classmethod
+    def from_surprise(cls, model):
+        return cls(
+            kind=type(model).__name__,
+            k=model.k,
+            min_k=model.min_k,
+            rating_scale=tuple(model.trainset.rating_scale),
+            global_mean=model.trainset.global_mean,
+            means=getattr(model, "means", None),
+            sigmas=getattr(model, "sigmas", None),
+            bu=getattr(model, "bu", None),
+            bi=getattr(model, "bi", None),
+            user_based=model.sim_options.get("user_based", True),
+            sim_name=model.sim_options.get("name", "msd"),
+            min_support=model.sim_options.get("min_support", 1),
+        )
+
+    def to_dict(self):
+        """Parámetros escalares del modelo (serializables a JSON)."""
+        return {
+            "kind": self.kind,
+            "k": int(self.k),
+            "min_k": int(self.min_k),
+            "rating_scale": [float(v) for v in self.rating_scale],
+            "global_mean": float(self.global_mean),
+            "user_based": bool(self.user_based),
+            "sim_name": self.sim_name,
+            "min_support": int(self.min_support),
+        }
+
+    def arrays(self):
+        """Arreglos opcionales del modelo (medias, desviaciones, sesgos)."""
+        return {name: getattr(self, name) for name in ("means", "sigmas", "bu", "bi")
+                if getattr(self, name) is not None}
+
+    @classmethod
+    def from_dict(cls, values, arrays):
+        return cls(kind=values["kind"],
+                   k=values["k"],
+                   min_k=values["min_k"],
+                   rating_scale=tuple(values["rating_scale"]),
+                   global_mean=values["global_mean"],
+                   user_based=values["user_based"],
+                   sim_name=values.get("sim_name"),
+                   min_support=values.get("min_support", 1),
+                   **arrays)
+
+    def clip(self, est):
+        lower_bound, higher_bound = self.rating_scale
+        return np.maximum(np.minimum(est, higher_bound), lower_bound)
+
+
+def gather_segments(indptr, rows):
+    """
+    Concatena los segmentos CSR de las filas indicadas.
+
+    Returns:
+        tuple: (seg, idx) donde seg es el número de segmento de cada entrada
+        e idx su posición dentro de los arreglos CSR.
+    """
+    return _segments(indptr[rows], indptr[rows + 1])
+
+
+def sorted_segments(keys, rows):
+    """
+    Igual que ``gather_segments``, para entradas ordenadas por fila en lugar
+    de un CSR (``keys`` indica la fila de cada entrada).
+    """
+    return _segments(np.searchsorted(keys, rows, side="left"), np.searchsorted(keys, rows, side="right"))
+
+
+def _segments(starts, ends):
+    lengths = ends - starts
+    total = int(lengths.sum())
+    seg = np.repeat(np.arange(starts.size), lengths)
+    offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    idx = np.repeat(starts, lengths) + offsets
+    return seg, idx
+
+
+def empty_entries():
+    """Entradas pendientes vacías: (filas, columnas, valores)."""
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+
+def upsert_entries(entries, keys, cols, values, drop=None):
+    """
+    Agrega o reemplaza entradas pendientes dispersas (fila, columna, valor).
+
+    Args:
+        entries (tuple): (filas, columnas, valores) actuales, ordenadas por
+            fila y columna (no se modifican).
+        keys, cols, values (ndarray): Entradas nuevas; ante pares repetidos
+            prevalece la última.
+        drop (ndarray): Opcional, índices cuyas entradas actuales (en su fila
+            o en su columna) se descartan.
+
+    Returns:
+        tuple: (filas, columnas, valores) ordenadas por fila y columna.
+    """
+    old_keys, old_cols, old_values = entries
+    if drop is not None and old_keys.size:
+        keep = ~(np.isin(old_keys, drop) | np.isin(old_cols, drop))
+        old_keys, old_cols, old_values = old_keys[keep], old_cols[keep], old_values[keep]
+    keys = np.concatenate([old_keys, np.asarray(keys, dtype=np.int64)])
+    cols = np.concatenate([old_cols, np.asarray(cols, dtype=np.int64)])
+    values = np.concatenate([old_values, np.asarray(values, dtype=np.float64)])
+
+    # lexsort es estable: la última entrada de cada par queda al final de su grupo
+    order = np.lexsort((cols, keys))
+    keys, cols, values = keys[order], cols[order], values[order]
+    last = np.ones(keys.size, dtype=bool)
+    last[:-1] = (keys[1:] != keys[:-1]) | (cols[1:] != cols[:-1])
+    return keys[last], cols[last], values[last]
+
+
+def merge_entries(pending, rows, seg, nb, values):
+    """
+    Aplica cambios pendientes a las entradas CSR de las filas indicadas.
+
+    Args:
+        pending (tuple): Entradas (fila, vecino, valor) de ``upsert_entries``;
+            reemplazan o agregan entradas.
+        rows (ndarray): Filas consultadas (un segmento por fila).
+        seg, nb, values (ndarray): Entradas de ``gather_segments``.
+
+    Returns:
+        tuple: (seg, nb, values) con las entradas nuevas al final.
+    """
+    keys, cols, new_values = pending
+    added_seg, idx = sorted_segments(keys, rows)
+    if not idx.size:
+        return seg, nb, values
+
+    # Descartar las entradas reemplazadas: clave (segmento, vecino)
+    added_nb = cols[idx]
+    width = int(max(nb.max(initial=0), added_nb.max()) + 1)
+    keep = ~np.isin(seg.astype(np.int64) * width + nb, added_seg * width + added_nb)
+    return (np.concatenate([seg[keep], added_seg.astype(seg.dtype)]),
+            np.concatenate([nb[keep], added_nb]).astype(nb.dtype),
+            np.concatenate([values[keep], new_values[idx]]).astype(values.dtype))
+
+
+def replace_rows(indptr, columns, replacements):
+    """
+    Construye un CSR nuevo con algunas filas reemplazadas.
+
+    Args:
+        indptr (ndarray): Inicio de cada fila.
+        columns (tuple): Arreglos alineados con las entradas del CSR.
+        replacements (dict): Fila -> tupla de arreglos (uno por columna).
+
+    Returns:
+        tuple: (indptr, columnas) del CSR nuevo.
+    """
+    n_rows = indptr.size - 1
+    lengths = np.diff(indptr)
+    for row, values in replacements.items():
+        lengths[row] = len(values[0])
+    new_indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_indptr[1:])
+
+    # Copiar en bloque las filas sin cambios
+    unchanged = np.ones(n_rows, dtype=bool)
+    unchanged[list(replacements)] = False
+    rows = np.flatnonzero(unchanged)
+    _, old_idx = gather_segments(indptr, rows)
+    _, new_idx = gather_segments(new_indptr, rows)
+
+    new_columns = []
+    for c, column in enumerate(columns):
+        new_column = np.empty(int(new_indptr[-1]), dtype=column.dtype)
+        new_column[new_idx] = column[old_idx]
+        for row, values in replacements.items():
+            new_column[new_indptr[row]:new_indptr[row + 1]] = values[c]
+        new_columns.append(new_column)
+    return new_indptr, tuple(new_columns)
+
+
+def pearson_sims(n, other, r_self, r_other, min_support=1):
+    """
+    Similitud de Pearson de un x con todos los demás, con la fórmula de
+    Surprise (medias calculadas sobre los elementos en común).
+
+    Args:
+        n (int): Número de x.
+        other (ndarray): x que comparte cada elemento calificado.
+        r_self (ndarray): Rating del x propio en cada elemento.
+        r_other (ndarray): Rating del otro x en el mismo elemento.
+        min_support (int): Mínimo de elementos en común.
+
+    Returns:
+        ndarray: Similitud con cada x (0 sin suficientes elementos en común).
+    """
+    freq = np.bincount(other, minlength=n).astype(np.float64)
+    prods = np.bincount(other, weights=r_self * r_other, minlength=n)
+    sqi = np.bincount(other, weights=r_self ** 2, minlength=n)
+    sqj = np.bincount(other, weights=r_other ** 2, minlength=n)
+    si = np.bincount(other, weights=r_self, minlength=n)
+    sj = np.bincount(other, weights=r_other, minlength=n)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        num = freq * prods - si * sj
+        denum = np.sqrt((freq * sqi - si ** 2) * (freq * sqj - sj ** 2))
+        sim = np.where((freq >= min_support) & (denum != 0), num / denum, 0.0)
+    return sim
+
+
+def update_moments(params, ratings_by_x):
+    """
+    Copia de los parámetros con la media (y la desviación, en KNNWithZScore)
+    recalculadas para los x indicados.
+
+    Args:
+        params (KNNParams): Parámetros actuales (no se modifican).
+        ratings_by_x (dict): x -> ratings actuales de ese x.
+    """
+    if params.means is None or not ratings_by_x:
+        return params
+
+    updated = copy.copy(params)
+    updated.means = np.array(params.means)
+    if params.sigmas is not None:
+        updated.sigmas = np.array(params.sigmas)
+    for x, ratings in ratings_by_x.items():
+        ratings = np.asarray(ratings, dtype=np.float64)
+        updated.means[x] = ratings.mean()
+        if params.sigmas is not None:
+            sigma = np.sqrt(np.mean((ratings - updated.means[x]) ** 2))
+            # Con desviación 0 Surprise usa la desviación global; se conserva la anterior
+            if sigma != 0.0:
+                updated.sigmas[x] = sigma
+    return updated
+
+
+def fold_in_params(params, ratings, default_sigma=None):
+    """
+    Copia de los parámetros con un usuario adicional al final (índice igual
+    al número de usuarios del modelo), para puntuar a un usuario que no está
+    en el modelo sin reentrenarlo. Su sesgo (KNNBaseline) es 0.
+
+    Args:
+        params (KNNParams): Parámetros actuales (no se modifican).
+        ratings (ndarray): Ratings del usuario nuevo.
+        default_sigma (callable): Desviación a usar cuando la del usuario es 0
+            (KNNWithZScore usa la desviación global de los ratings).
+    """
+    folded = copy.copy(params)
+    if params.user_based and params.means is not None:
+        mean = ratings.mean()
+        folded.means = np.append(params.means, mean)
+        if params.sigmas is not None:
+            sigma = np.sqrt(np.mean((ratings - mean) ** 2))
+            folded.sigmas = np.append(params.sigmas, sigma if sigma != 0.0 else default_sigma())
+    if params.bu is not None:
+        folded.bu = np.append(params.bu, 0.0)
+    return folded
+
+
+def select_top_k(seg, sim, k, n_seg):
+    """
+    Selecciona, por segmento, los k vecinos de mayor similitud positiva.
+
+    Replica ``heapq.nlargest`` de Surprise: los empates conservan el orden
+    original de los vecinos y solo se agregan similitudes positivas.
+
+    Returns:
+        ndarray: Posiciones seleccionadas, ordenadas por segmento y por
+        similitud descendente (mismo orden de acumulación que Surprise).
+    """
+    positive = np.flatnonzero(sim > 0)
+    # lexsort es estable: dentro de cada segmento los empates quedan en orden original
+    order = positive[np.lexsort((-sim[positive], seg[positive]))]
+    seg_sorted = seg[order]
+    counts = np.bincount(seg_sorted, minlength=n_seg)
+    starts = np.cumsum(counts) - counts
+    rank = np.arange(order.size) - starts[seg_sorted]
+    return order[rank < k]
+
+
+def aggregate(params, seg, sim, r, nb, x, y, n_seg):
+    """
+    Calcula las estimaciones de todos los segmentos en una sola pasada.
+
+    Cada segmento corresponde a una predicción (x, y): x es el elemento
+    comparado por similitud (usuario en user-based, ítem en item-based) e y
+    el otro extremo de la predicción.
+
+    Args:
+        params (KNNParams): Parámetros del modelo.
+        seg (ndarray): Segmento de cada vecino candidato.
+        sim (ndarray): Similitud entre x y cada vecino.
+        r (ndarray): Rating del vecino sobre y.
+        nb (ndarray): Índice interno de cada vecino.
+        x (ndarray): Índice interno de x por segmento.
+        y (ndarray): Índice interno de y por segmento.
+        n_seg (int): Número de segmentos.
+
+    Returns:
+        tuple: (est, impossible, actual_k) por segmento, con est ya recortado
+        a la escala de ratings igual que ``predict``.
+    """
+    selected = select_top_k(seg, sim, params.k, n_seg)
+    seg, sim, r, nb = seg[selected], sim[selected], r[selected], nb[selected]
+
+    if params.kind == "KNNBasic":
+        contrib = sim * r
+    elif params.kind == "KNNWithMeans":
+        contrib = sim * (r - params.means[nb])
+    elif params.kind == "KNNWithZScore":
+        contrib = sim * (r - params.means[nb]) / params.sigmas[nb]
+    else:
+        bx, by = _switch_biases(params)
+        nb_bsl = params.global_mean + bx[nb] + by[y[seg]]
+        contrib = sim * (r - nb_bsl)
+
+    sum_sim = np.bincount(seg, weights=sim, minlength=n_seg)
+    sum_ratings = np.bincount(seg, weights=contrib, minlength=n_seg)
+    actual_k = np.bincount(seg, minlength=n_seg)
+
+    enough = (actual_k >= params.min_k) & (sum_sim != 0)
+    term = np.divide(sum_ratings, sum_sim, out=np.zeros(n_seg), where=enough)
+
+    impossible = np.zeros(n_seg, dtype=bool)
+    if params.kind == "KNNBasic":
+        impossible = ~enough
+        est = np.where(impossible, params.global_mean, term)
+    elif params.kind == "KNNWithMeans":
+        est = params.means[x] + term
+    elif params.kind == "KNNWithZScore":
+        est = params.means[x] + term * params.sigmas[x]
+    else:
+        est = baseline_estimate(params, x, y) + term
+
+    return params.clip(est), impossible, actual_k
+
+
+def _switch_biases(params):
+    # x es usuario cuando el modelo es user-based (ver SymmetricAlgo.switch)
+    return (params.bu, params.bi) if params.user_based else (params.bi, params.bu)
+
+
+def baseline_estimate(params, x, y):
+    u, i = (x, y) if params.user_based else (y, x)
+    return params.global_mean + params.bu[u] + params.bi[i]
+
+
+def top_n_indices(values, n):
+    """
+    Posiciones de los n mayores valores usando ``argpartition``.
+
+    El resultado queda ordenado de forma descendente y, ante empates, respeta
+    el orden original (equivale a un ``sort`` estable seguido de ``[:n]``).
+    """
+    if n <= 0 or values.size == 0:
+        return np.empty(0, dtype=np.intp)
+    if n < values.size:
+        threshold = values[np.argpartition(values, values.size - n)[values.size - n]]
+        above = np.flatnonzero(values > threshold)
+        ties = np.flatnonzero(values == threshold)[:n - above.size]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(values.size)
+    # Orden descendente estable por valor y, en empate, por posición original
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+
+def _raw_ids(raw2inner):
+    # Ids raw ordenados por id interno (inverso del diccionario raw -> interno)
+    raw_ids = [None] * len(raw2inner)
+    for raw, inner in raw2inner.items():
+        raw_ids[inner] = raw
+    return np.array(raw_ids)
+
+
+class UserKNNScorer:
+    """
+    Puntuación vectorizada para un modelo KNN user-based de Surprise.
+
+    Extrae una sola vez la matriz de similitud usuario-usuario y los ratings
+    del trainset (en formato CSR por ítem) y calcula las predicciones de todas
+    las películas candidatas de un usuario en una sola operación, con el mismo
+    resultado que ``model.predict(uid, iid).est`` y ``was_impossible``.
+
+    Los ratings nuevos (``with_ratings``) se guardan como cambios pendientes
+    sobre los arreglos base, junto con las similitudes recalculadas de los
+    usuarios afectados que difieren de la matriz base (entradas dispersas, en
+    ambos sentidos), hasta integrarlos con ``compact``.
+    """
+
+    def __init__(self, params, sim, item_indptr, item_users, item_ratings,
+                 raw2inner_users, raw2inner_items):
+        self.params = params
+        self.sim = sim
+        self.item_indptr = item_indptr
+        self.item_users = item_users
+        self.item_ratings = item_ratings
+        self.raw2inner_users = raw2inner_users
+        self.raw2inner_items = raw2inner_items
+        # Cambios pendientes como entradas (fila, columna, valor) ordenadas:
+        # (ítem, usuario, rating) y (usuario, usuario, similitud)
+        self.item_delta = empty_entries()
+        self.sim_delta = empty_entries()
+        self.n_updates = 0
+
+    @property
+    def pending_bytes(self):
+        """Memoria ocupada por los cambios pendientes (bytes)."""
+        return sum(array.nbytes for array in self.item_delta + self.sim_delta)
+
+    @classmethod
+    def from_surprise(cls, model):
+        if not model.sim_options.get("user_based", True):
+            raise ValueError("El modelo no es user-based")
+
+        trainset = model.trainset
+        params = KNNParams.from_surprise(model)
+
+        # Ratings por ítem en formato CSR, conservando el orden de trainset.ir
+        lengths = np.fromiter((len(trainset.ir[i]) for i in range(trainset.n_items)),
+                              dtype=np.int64, count=trainset.n_items)
+        indptr = np.zeros(trainset.n_items + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        entries = chain.from_iterable(trainset.ir[i] for i in range(trainset.n_items))
+        pairs = np.fromiter(chain.from_iterable(entries), dtype=np.float64,
+                            count=2 * int(indptr[-1])).reshape(-1, 2)
+
+        return cls(params=params,
+                   sim=model.sim,
+                   item_indptr=indptr,
+                   item_users=pairs[:, 0].astype(np.int32),
+                   item_ratings=pairs[:, 1],
+                   raw2inner_users=trainset._raw2inner_id_users,
+                   raw2inner_items=trainset._raw2inner_id_items)
+
+    def to_arrays(self):
+        """Arreglos del motor, con los ids raw en el orden de los ids internos."""
+        return {
+            "sim": self.sim,
+            "item_indptr": self.item_indptr,
+            "item_users": self.item_users,
+            "item_ratings": self.item_ratings,
+            "user_raw_ids": _raw_ids(self.raw2inner_users),
+            "item_raw_ids": _raw_ids(self.raw2inner_items),
+        }
+
+    @classmethod
+    def from_arrays(cls, params, arrays):
+        return cls(params=params,
+                   sim=arrays["sim"],
+                   item_indptr=arrays["item_indptr"],
+                   item_users=arrays["item_users"],
+                   item_ratings=arrays["item_ratings"],
+                   raw2inner_users={raw: inner for inner, raw in enumerate(arrays["user_raw_ids"].tolist())},
+                   raw2inner_items={raw: inner for inner, raw in enumerate(arrays["item_raw_ids"].tolist())})
+
+    def score(self, userId, movieIds):
+        """
+        Predice el rating de un usuario para una lista de películas.
+
+        Args:
+            userId: Id (raw) del usuario.
+            movieIds (list): Ids (raw) de las películas candidatas.
+
+        Returns:
+            tuple: (est, impossible) arreglos alineados con movieIds.
+        """
+        inner_user = self.raw2inner_users.get(userId)
+        sim_row = self._sim_row(inner_user) if inner_user is not None else None
+        return self._predict(self.params, inner_user, sim_row, movieIds)
+
+    def fold_in(self, ratings, movieIds):
+        """
+        Predice el rating de un usuario que no está en el modelo (por ejemplo,
+        creado después del entrenamiento) a partir de sus ratings, sin
+        reentrenar: su similitud de Pearson con todos los usuarios se calcula
+        en una sola pasada sobre los ratings de las películas que calificó.
+
+        Args:
+            ratings (dict): movieId -> rating del usuario.
+            movieIds (list): Ids (raw) de las películas candidatas.
+
+        Returns:
+            tuple: (est, impossible) arreglos alineados con movieIds.
+        """
+        rated = [(self.raw2inner_items[m], r) for m, r in ratings.items() if m in self.raw2inner_items]
+        if not rated:
+            return self._predict(self.params, None, None, movieIds)
+
+        items = np.array([y for y, _ in rated], dtype=np.int64)
+        values = np.array([r for _, r in rated], dtype=np.float64)
+        seg, nb, others = self._item_entries(items)
+        # El usuario nuevo ocupa el índice siguiente al último usuario del modelo
+        x = self.sim.shape[0]
+        sim_row = pearson_sims(x + 1, nb, values[seg], others, self.params.min_support)
+        sim_row[x] = 1.0
+
+        params = fold_in_params(self.params, np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings)),
+                                default_sigma=lambda: float(np.std(self.item_ratings)))
+        return self._predict(params, x, sim_row, movieIds)
+
+    def _predict(self, params, inner_user, sim_row, movieIds):
+        # Agrega los vecinos de cada candidata con la fila de similitud del usuario
+        n = len(movieIds)
+        inner_items = np.fromiter((self.raw2inner_items.get(m, -1) for m in movieIds),
+                                  dtype=np.int64, count=n)
+
+        est = np.full(n, params.global_mean, dtype=np.float64)
+        impossible = np.ones(n, dtype=bool)
+        known = inner_items >= 0
+
+        if params.kind == "KNNBaseline":
+            # KNNBaseline nunca es imposible: usa los sesgos conocidos
+            impossible[:] = False
+            if inner_user is not None:
+                est += params.bu[inner_user]
+            est[known] += params.bi[inner_items[known]]
+
+        if inner_user is None or not known.any():
+            return params.clip(est), impossible
+
+        rows = inner_items[known]
+        seg, nb, ratings = self._item_entries(rows)
+        sim = sim_row[nb]
+        x = np.full(rows.size, inner_user, dtype=np.int64)
+
+        est_known, impossible_known, _ = aggregate(
+            params, seg, sim, ratings, nb, x, rows, rows.size)
+        est[known] = est_known
+        impossible[known] = impossible_known
+        return params.clip(est), impossible
+
+    def _item_entries(self, rows):
+        # Usuarios y ratings de cada ítem, con los ratings pendientes al final
+        seg, idx = gather_segments(self.item_indptr, rows)
+        return merge_entries(self.item_delta, rows, seg, self.item_users[idx], self.item_ratings[idx])
+
+    def _sim_row(self, x):
+        # Fila de similitud de un usuario, con las similitudes pendientes
+        row = self.sim[x]
+        keys, cols, values = self.sim_delta
+        start, end = np.searchsorted(keys, (x, x + 1))
+        if start < end:
+            row = np.array(row)
+            row[cols[start:end]] = values[start:end]
+        return row
+
+    def _user_entries(self, x):
+        # Ítems y ratings de un usuario (recorre el CSR por ítem)
+        positions = np.flatnonzero(self.item_users == x)
+        items = np.searchsorted(self.item_indptr, positions, side="right") - 1
+        ratings = dict(zip(items.tolist(), self.item_ratings[positions].tolist()))
+        pending_items, pending_users, pending_ratings = self.item_delta
+        pending = pending_users == x
+        ratings.update(zip(pending_items[pending].tolist(), pending_ratings[pending].tolist()))
+        return (np.fromiter(ratings, dtype=np.int64, count=len(ratings)),
+                np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings)))
+
+    def with_ratings(self, ratings):
+        """
+        Nueva versión del motor con ratings agregados o actualizados. La
+        versión actual no se modifica (las peticiones en curso la siguen usando).
+
+        Se recalculan la media de cada usuario afectado y su fila de similitud
+        de Pearson; los usuarios o películas fuera del modelo se omiten.
+
+        Args:
+            ratings (list): Tuplas (userId, movieId, rating).
+
+        Returns:
+            tuple: (nueva versión, número de ratings aplicados).
+        """
+        if self.params.sim_name != "pearson":
+            raise ValueError(f"Actualización incremental no soportada para la similitud {self.params.sim_name}")
+
+        new = {}
+        applied = 0
+        for userId, movieId, rating in ratings:
+            x = self.raw2inner_users.get(userId)
+            y = self.raw2inner_items.get(movieId)
+            if x is None or y is None:
+                continue
+            new[(y, x)] = float(rating)
+            applied += 1
+        if not new:
+            return self, 0
+
+        updated = copy.copy(self)
+        updated.n_updates = self.n_updates + applied
+        keys = np.array(list(new), dtype=np.int64)
+        updated.item_delta = upsert_entries(self.item_delta, keys[:, 0], keys[:, 1],
+                                            np.fromiter(new.values(), dtype=np.float64, count=len(new)))
+        touched = np.unique(keys[:, 1])
+
+        n_users = self.sim.shape[0]
+        user_ratings = {}
+        entries = []
+        for x in touched.tolist():
+            items, values = updated._user_entries(x)
+            user_ratings[x] = values
+
+            # Pearson contra todos los usuarios que comparten ítems con x
+            seg, nb, others = updated._item_entries(items)
+            row = pearson_sims(n_users, nb, values[seg], others, self.params.min_support)
+            row[x] = 1.0
+            # Solo las similitudes que difieren de la matriz base, más las de
+            # los usuarios del lote (la fila calculada al final prevalece)
+            changed = np.union1d(np.flatnonzero(row != self.sim[x]), touched)
+            entries.append((np.full(changed.size, x), changed, row[changed]))
+            entries.append((changed, np.full(changed.size, x), row[changed]))
+
+        # Las similitudes pendientes de los usuarios del lote se reemplazan
+        keys, cols, values = (np.concatenate(parts) for parts in zip(*entries))
+        updated.sim_delta = upsert_entries(self.sim_delta, keys, cols, values, drop=touched)
+        updated.params = update_moments(self.params, user_ratings)
+        return updated, applied
+
+    def compact(self, allocate=None):
+        """
+        Nueva versión con los cambios pendientes integrados en los arreglos.
+
+        Args:
+            allocate (callable): Opcional, recibe (nombre, forma, dtype) y
+                devuelve el arreglo donde escribir la matriz de similitud (por
+                ejemplo, un .npy mapeado de la versión que se exporta); la
+                matriz se copia por bloques de filas, sin otra copia completa
+                en memoria. Por defecto, se copia en memoria.
+        """
+        if not self.n_updates:
+            return self
+
+        # CSR por ítem: en cada ítem con cambios, descartar las entradas
+        # reemplazadas y agregar las nuevas al final
+        pending_items, pending_users, pending_ratings = self.item_delta
+        rows = np.unique(pending_items)
+        starts = np.searchsorted(pending_items, rows, side="left")
+        ends = np.searchsorted(pending_items, rows, side="right")
+        replacements = {}
+        for y, pending_start, pending_end in zip(rows.tolist(), starts.tolist(), ends.tolist()):
+            start, end = self.item_indptr[y], self.item_indptr[y + 1]
+            new_users = pending_users[pending_start:pending_end]
+            new_ratings = pending_ratings[pending_start:pending_end]
+            users = self.item_users[start:end]
+            keep = ~np.isin(users, new_users)
+            replacements[y] = (np.concatenate([users[keep], new_users]),
+                               np.concatenate([self.item_ratings[start:end][keep], new_ratings]))
+        indptr, (item_users, item_ratings) = replace_rows(
+            self.item_indptr, (self.item_users, self.item_ratings), replacements)
+
+        if allocate is None:
+            sim = np.array(self.sim)
+        else:
+            sim = allocate("sim", self.sim.shape, self.sim.dtype)
+            for start in range(0, self.sim.shape[0], COPY_BLOCK_ROWS):
+                sim[start:start + COPY_BLOCK_ROWS] = self.sim[start:start + COPY_BLOCK_ROWS]
+        keys, cols, values = self.sim_delta
+        sim[keys, cols] = values
+
+        compacted = UserKNNScorer(
+            params=self.params,
+            sim=sim,
+            item_indptr=indptr,
+            item_users=item_users,
+            item_ratings=item_ratings,
+            raw2inner_users=self.raw2inner_users,
+            raw2inner_items=self.raw2inner_items)
+        compacted.version = getattr(self, "version", None)
+        return compacted
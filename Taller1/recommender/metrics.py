@@ -0,0 +1,194 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+Métricas de latencia y contadores expuestos en el formato de texto de Prometheus
+"""
+
+# Límites superiores (en segundos) de los buckets de los histogramas de latencia
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Marcas de tiempo de la petición en curso, compartidas entre el middleware y la ruta
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Histograma acumulado de observaciones (por ejemplo, segundos), con una
+    serie por combinación de etiquetas.
+
+    Args:
+        name (str): Nombre de la métrica.
+        documentation (str): Descripción (línea HELP).
+        labelnames (tuple): Nombres de las etiquetas.
+        buckets (tuple): Límites superiores de los buckets, en orden creciente.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # Valores de las etiquetas -> [conteo por bucket, suma, conteo]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observa la duración (en segundos) del bloque ``with``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                yield "_bucket", key, (("le", _format_value(bound)),), cumulative
+            yield "_sum", key, (), total
+            yield "_count", key, (), count
+
+
+class Counter:
+    """
+    Contador monótono, con una serie por combinación de etiquetas.
+
+    Args:
+        name (str): Nombre de la métrica.
+        documentation (str): Descripción (línea HELP).
+        labelnames (tuple): Nombres de las etiquetas.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield "", key, (), value
+
+
+class Gauge:
+    """
+    Valores leídos al momento de exponer las métricas (por ejemplo, los
+    contadores de la caché o la versión publicada de cada modelo).
+
+    Args:
+        name (str): Nombre de la métrica.
+        documentation (str): Descripción (línea HELP).
+        labelnames (tuple): Nombres de las etiquetas.
+        collect (callable): Devuelve una lista de (valores de las etiquetas, valor).
+        kind (str): "gauge" o "counter" (valores monótonos de otro componente).
+    """
+
+    def __init__(self, name, documentation, labelnames=(), collect=None, kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self):
+        for key, value in self.collect():
+            if value is not None:
+                yield "", tuple(str(v) for v in key), (), value
+
+
+class MetricsRegistry:
+    """Conjunto de métricas del servidor, expuesto por el end-point ``/metrics``."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), collect=None, kind="gauge"):
+        return self.register(Gauge(name, documentation, labelnames, collect, kind))
+
+    def render(self):
+        """Texto de las métricas en el formato de exposición de Prometheus (0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, key, extra, value in metric.samples():
+                labels = _format_labels(metric.labelnames, key, extra)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def start_request():
+    """
+    Inicia el registro de marcas de tiempo de una petición; las rutas
+    ejecutadas en el mismo contexto las agregan con ``mark_handled``.
+    """
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def mark_handled(model):
+    """
+    Marca el fin de la ruta de recomendaciones de un modelo; lo que resta de
+    la petición (validación y serialización de la respuesta) lo mide el middleware.
+    """
+    timings = _request_timings.get()
+    if timings is not None:
+        timings["model"] = model
+        timings["handled"] = time.perf_counter()
@@ -0,0 +1,220 @@
+# python -m recommender.mf data/models/mf --factors 100 --epochs 20
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from surprise import SVD, Dataset, Reader
+from recommender.knn import top_n_indices
+
+"""
+Modelo de factorización matricial (SVD) con recuperación top-N vectorizada
+"""
+
+# Filas de la tabla rating leídas por bloque al entrenar
+CHUNK_SIZE = 1_000_000
+
+
+class MFParams:
+    """
+    Parámetros escalares de un modelo de factorización.
+
+    Atributos:
+        rating_scale (tuple): Escala (mínimo, máximo) de los ratings.
+        global_mean (float): Media global de los ratings de entrenamiento.
+        n_factors (int): Número de factores latentes.
+        reg (float): Regularización de los factores y sesgos de usuario.
+    """
+
+    def __init__(self, rating_scale, global_mean, n_factors, reg):
+        self.rating_scale = rating_scale
+        self.global_mean = global_mean
+        self.n_factors = n_factors
+        self.reg = reg
+
+    def to_dict(self):
+        return {
+            "rating_scale": [float(v) for v in self.rating_scale],
+            "global_mean": float(self.global_mean),
+            "n_factors": int(self.n_factors),
+            "reg": float(self.reg),
+        }
+
+    def arrays(self):
+        return {}
+
+    @classmethod
+    def from_dict(cls, values, arrays):
+        return cls(rating_scale=tuple(values["rating_scale"]),
+                   global_mean=values["global_mean"],
+                   n_factors=values["n_factors"],
+                   reg=values["reg"])
+
+    def clip(self, est):
+        lower_bound, higher_bound = self.rating_scale
+        return np.maximum(np.minimum(est, higher_bound), lower_bound)
+
+
+class MFScorer:
+    """
+    Recomendaciones con un modelo SVD (factores latentes con sesgos): el
+    rating estimado es ``media + b_u + b_i + q_i · p_u``.
+
+    Los factores se guardan como arreglos float32 contiguos; el top-N de un
+    usuario se obtiene sobre todo el catálogo con un solo producto
+    matriz-vector y ``argpartition``.
+
+    Atributos:
+        params (MFParams): Parámetros del modelo.
+        user_factors (ndarray): Factores p_u (usuarios x factores).
+        item_factors (ndarray): Factores q_i (ítems x factores).
+        user_bias (ndarray): Sesgo b_u de cada usuario.
+        item_bias (ndarray): Sesgo b_i de cada ítem.
+        user_raw_ids (ndarray): userId de cada usuario interno.
+        item_raw_ids (ndarray): movieId de cada ítem interno.
+    """
+
+    params_type = MFParams
+
+    def __init__(self, params, user_factors, item_factors, user_bias, item_bias,
+                 user_raw_ids, item_raw_ids):
+        self.params = params
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.user_bias = user_bias
+        self.item_bias = item_bias
+        self.user_raw_ids = user_raw_ids
+        self.item_raw_ids = item_raw_ids
+        self.raw2inner_users = {raw: inner for inner, raw in enumerate(user_raw_ids.tolist())}
+        self.raw2inner_items = {raw: inner for inner, raw in enumerate(item_raw_ids.tolist())}
+
+    @classmethod
+    def from_surprise(cls, model):
+        trainset = model.trainset
+        params = MFParams(rating_scale=tuple(trainset.rating_scale),
+                          global_mean=trainset.global_mean,
+                          n_factors=model.n_factors,
+                          reg=model.reg_pu)
+        as_float32 = lambda values: np.ascontiguousarray(values, dtype=np.float32)
+        return cls(params=params,
+                   user_factors=as_float32(model.pu),
+                   item_factors=as_float32(model.qi),
+                   user_bias=as_float32(model.bu),
+                   item_bias=as_float32(model.bi),
+                   user_raw_ids=np.array([trainset.to_raw_uid(u) for u in range(trainset.n_users)]),
+                   item_raw_ids=np.array([trainset.to_raw_iid(i) for i in range(trainset.n_items)]))
+
+    def to_arrays(self):
+        return {
+            "user_factors": self.user_factors,
+            "item_factors": self.item_factors,
+            "user_bias": self.user_bias,
+            "item_bias": self.item_bias,
+            "user_raw_ids": self.user_raw_ids,
+            "item_raw_ids": self.item_raw_ids,
+        }
+
+    @classmethod
+    def from_arrays(cls, params, arrays):
+        return cls(params=params, **arrays)
+
+    def user_vector(self, userId, ratings=None):
+        """
+        Sesgo y factores de un usuario. Un usuario que no está en el modelo
+        se proyecta a partir de sus ratings (fold-in): se resuelve el mismo
+        problema de mínimos cuadrados regularizado del entrenamiento con los
+        factores de los ítems fijos.
+
+        Returns:
+            tuple: (b_u, p_u); (0, ceros) si no hay ratings conocidos.
+        """
+        inner_user = self.raw2inner_users.get(userId)
+        if inner_user is not None:
+            return float(self.user_bias[inner_user]), self.user_factors[inner_user]
+
+        rated = [(self.raw2inner_items[m], r) for m, r in (ratings or {}).items() if m in self.raw2inner_items]
+        if not rated:
+            return 0.0, np.zeros(self.params.n_factors, dtype=np.float32)
+
+        items = np.array([i for i, _ in rated], dtype=np.int64)
+        values = np.array([r for _, r in rated], dtype=np.float64)
+        # Columna de unos para el sesgo del usuario
+        design = np.hstack([np.ones((items.size, 1)), self.item_factors[items].astype(np.float64)])
+        target = values - self.params.global_mean - self.item_bias[items]
+        penalty = self.params.reg * items.size * np.eye(design.shape[1])
+        solution = np.linalg.solve(design.T @ design + penalty, design.T @ target)
+        return float(solution[0]), solution[1:].astype(np.float32)
+
+    def top_n(self, userId, n, exclude=(), ratings=None):
+        """
+        Las n películas con mayor rating estimado de un usuario, sobre todo el
+        catálogo del modelo.
+
+        Args:
+            userId: Id (raw) del usuario.
+            n (int): Número de recomendaciones.
+            exclude (iterable): movieId a omitir (ya calificados).
+            ratings (dict): Opcional, movieId -> rating; se usan si el
+                usuario no está en el modelo.
+
+        Returns:
+            tuple: (movieIds, est) ordenados por rating estimado descendente.
+        """
+        user_bias, factors = self.user_vector(userId, ratings)
+        scores = self.item_factors @ factors + self.item_bias
+
+        allowed = np.ones(scores.size, dtype=bool)
+        excluded = [self.raw2inner_items[m] for m in exclude if m in self.raw2inner_items]
+        allowed[excluded] = False
+        scores[~allowed] = -np.inf
+
+        top = top_n_indices(scores, min(n, int(allowed.sum())))
+        est = self.params.global_mean + user_bias + scores[top].astype(np.float64)
+        return self.item_raw_ids[top], self.params.clip(est)
+
+
+def train(db: Session, n_factors=100, n_epochs=20, reg=0.02, lr=0.005, random_state=None):
+    """
+    Entrena un modelo SVD de Surprise con todos los ratings de la base de datos.
+
+    Returns:
+        MFScorer: Motor de puntuación del modelo entrenado.
+    """
+    from sqlalchemy import select
+    from db.models import rating as DBRating
+
+    query = select(DBRating.userId, DBRating.movieId, DBRating.rating)
+    chunks = [chunk.astype({"userId": "int64", "movieId": "int64", "rating": "float32"})
+              for chunk in pd.read_sql(query, db.bind, chunksize=CHUNK_SIZE)]
+    ratings = pd.concat(chunks, ignore_index=True)
+    print(f"🔹 Ratings leídos: {len(ratings)}")
+
+    data = Dataset.load_from_df(ratings[["userId", "movieId", "rating"]], Reader(rating_scale=(0.5, 5)))
+    model = SVD(n_factors=n_factors, n_epochs=n_epochs, reg_all=reg, lr_all=lr,
+                random_state=random_state)
+    model.fit(data.build_full_trainset())
+    return MFScorer.from_surprise(model)
+
+
+if __name__ == "__main__":
+    from db.database import SessionLocal
+    from recommender.artifacts import export_artifact
+
+    parser = argparse.ArgumentParser(description="Entrena el modelo de factorización (SVD) con la tabla de ratings")
+    parser.add_argument("output", help="Directorio del modelo (se crea una versión dentro)")
+    parser.add_argument("--factors", type=int, default=100, help="Número de factores latentes")
+    parser.add_argument("--epochs", type=int, default=20, help="Épocas de entrenamiento")
+    parser.add_argument("--reg", type=float, default=0.02, help="Regularización")
+    parser.add_argument("--lr", type=float, default=0.005, help="Tasa de aprendizaje")
+    parser.add_argument("--version", help="Nombre de la versión (por defecto, fecha y hora)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        scorer = train(db, n_factors=args.factors, n_epochs=args.epochs, reg=args.reg, lr=args.lr)
+    finally:
+        db.close()
+    path = export_artifact(scorer, args.output, version=args.version, source="rating")
+    print(f"Modelo de factorización guardado en {path} ({time.perf_counter() - start:.1f} s)")
@@ -0,0 +1,110 @@
+import threading
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db.models import rating as DBRating
+
+"""
+Ranking de popularidad (número de ratings por película) precalculado
+"""
+
+
+class PopularityRanking:
+    """
+    Mantiene en memoria el número de ratings de cada película y la lista de
+    películas ordenada por popularidad.
+
+    El conteo se calcula una sola vez con un ``GROUP BY`` sobre la tabla de
+    ratings, se recalcula tras ``invalidate`` (carga de ratings) y se
+    actualiza incrementalmente con cada nuevo rating.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = None
+        self._ranked = None
+        self._loaded_version = -1
+        self.version = 0
+
+    def _load(self, db: Session):
+        rows = db.query(DBRating.movieId, func.count()).group_by(DBRating.movieId).all()
+        movie_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        counts = np.zeros(int(movie_ids.max()) + 1 if movie_ids.size else 0, dtype=np.int64)
+        counts[movie_ids] = [row[1] for row in rows]
+        self._counts = counts
+        self._ranked = None
+        self._loaded_version = self.version
+
+    def _rank(self):
+        # Orden por número de ratings descendente y movieId ascendente en empate
+        rated = np.flatnonzero(self._counts)
+        order = np.lexsort((rated, -self._counts[rated]))
+        return rated[order]
+
+    def ranked(self, db: Session):
+        """movieId de las películas con ratings, de la más a la menos popular."""
+        ranked = self._ranked
+        if ranked is not None and self._loaded_version == self.version:
+            return ranked
+
+        with self._lock:
+            if self._counts is None or self._loaded_version != self.version:
+                self._load(db)
+            if self._ranked is None:
+                self._ranked = self._rank()
+            return self._ranked
+
+    def top(self, db: Session, n=20):
+        return self.ranked(db)[:n]
+
+    def top_unrated(self, db: Session, catalog_ids, rated_ids, n=500):
+        """
+        Películas candidatas para un usuario: las del catálogo que no ha
+        calificado, limitadas a las n más populares si superan ese número.
+        """
+        return unrated_candidates(catalog_ids, rated_ids, lambda: self.ranked(db), n)
+
+    def increment(self, movieIds):
+        """Suma un rating nuevo a cada película indicada."""
+        movieIds = np.asarray(movieIds, dtype=np.int64)
+        with self._lock:
+            if self._counts is None or movieIds.size == 0:
+                return
+            if movieIds.max() >= self._counts.size:
+                counts = np.zeros(int(movieIds.max()) + 1, dtype=np.int64)
+                counts[:self._counts.size] = self._counts
+                self._counts = counts
+            np.add.at(self._counts, movieIds, 1)
+            self._ranked = None
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+
+def unrated_candidates(catalog_ids, rated_ids, ranked, n=500):
+    """
+    Películas del catálogo no calificadas, limitadas a las n más populares.
+
+    Args:
+        catalog_ids (ndarray): movieId del catálogo.
+        rated_ids (iterable): movieId calificados por el usuario.
+        ranked (callable): Devuelve los movieId ordenados por popularidad
+            (solo se usa si las candidatas superan n).
+        n (int): Número máximo de candidatas.
+    """
+    catalog_ids = np.asarray(catalog_ids, dtype=np.int64)
+    rated_ids = np.fromiter(rated_ids, dtype=np.int64)
+
+    size = int(max(catalog_ids.max(initial=0), rated_ids.max(initial=0))) + 1
+    allowed = np.zeros(size, dtype=bool)
+    allowed[catalog_ids] = True
+    allowed[rated_ids] = False
+
+    unrated = catalog_ids[allowed[catalog_ids]]
+    if unrated.size <= n:
+        return unrated
+
+    ranked = ranked()
+    ranked = ranked[ranked < size]
+    return ranked[allowed[ranked]][:n]
@@ -0,0 +1,411 @@
+# python -m recommender.precompute --processes 8
+# python -m recommender.precompute --changed
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from sqlalchemy.orm import Session
+from db.models import User as DBUser, rating as DBRating
+from recommender.artifacts import MANIFEST_FILE, latest_version, load_artifact, publish_version
+from recommender.candidates import rank_predictions
+from recommender.catalog import MovieCatalog
+from recommender.knn import gather_segments
+from recommender.popularity import PopularityRanking, unrated_candidates
+from recommender.scoring import predict
+
+"""
+Recomendaciones top-N precalculadas por lotes para todos los usuarios
+"""
+
+# Versión del formato del almacén
+STORE_FORMAT = 1
+# Recomendaciones conservadas por usuario
+DEFAULT_TOP_N = 100
+# Películas candidatas por usuario (igual que en el cálculo en línea)
+N_CANDIDATES = 500
+# Usuarios por tarea del pool de procesos
+SHARD_SIZE = 2000
+
+# Estado de cada proceso del lote: motores de puntuación, catálogo y ranking
+_worker = {}
+
+
+def changed_users(db: Session, since):
+    """userId con ratings registrados desde ``since``."""
+    # Sin DISTINCT: la consulta recorre solo el rango de ix_rating_timestamp (con
+    # DISTINCT, SQLite prefiere recorrer la tabla en el orden de la clave primaria)
+    query = db.query(DBRating.userId).filter(DBRating.timestamp >= since)
+    return {row[0] for row in query}
+
+
+def _user_ratings(db: Session, userIds):
+    # Ratings de un grupo de usuarios: userId -> {movieId: rating}
+    ratings = {userId: {} for userId in userIds}
+    query = (db.query(DBRating.userId, DBRating.movieId, DBRating.rating)
+             .filter(DBRating.userId.in_(userIds)))
+    for userId, movieId, rating in query:
+        ratings[userId][movieId] = rating
+    return ratings
+
+
+def _init_worker(artifacts, catalog, ranked, top_n):
+    _worker.update(scorers={kind: load_artifact(path) for kind, path in artifacts.items()},
+                   catalog=catalog, ranked=ranked, top_n=top_n)
+
+
+def _compute_shard(userIds, ratings):
+    # Recomendaciones de un grupo de usuarios con el mismo cálculo que en línea
+    catalog, ranked, top_n = _worker["catalog"], _worker["ranked"], _worker["top_n"]
+    results = {}
+    for kind, scorer in _worker["scorers"].items():
+        n_bands = int(scorer.params.rating_scale[1]) + 1
+        lengths, movie_ids, centis, bands = [], [], [], []
+        band_counts = np.zeros((len(userIds), n_bands), dtype=np.int32)
+        for row, userId in enumerate(userIds):
+            rated = ratings[userId]
+            candidates = unrated_candidates(catalog.movie_ids, rated, lambda: ranked, N_CANDIDATES)
+            estimates, impossible = predict(scorer, userId, candidates.tolist(), ratings=rated)
+            top, _ = rank_predictions(candidates, estimates, impossible, catalog)
+
+            top_estimates = estimates[top].tolist()
+            user_bands = np.array([math.floor(round(e, 1)) for e in top_estimates], dtype=np.int64)
+            band_counts[row] = np.bincount(user_bands, minlength=n_bands)[:n_bands]
+
+            kept = top[:top_n]
+            lengths.append(kept.size)
+            movie_ids.append(candidates[kept])
+            # Rating estimado redondeado a 2 decimales, en centésimas
+            centis.append(np.array([round(round(e, 2) * 100) for e in top_estimates[:top_n]], dtype=np.int16))
+            bands.append(user_bands[:top_n])
+
+        results[kind] = {
+            "user_ids": np.array(userIds, dtype=np.int64),
+            "lengths": np.array(lengths, dtype=np.int64),
+            "movie_ids": np.concatenate(movie_ids).astype(np.int32) if movie_ids else np.empty(0, np.int32),
+            "ratings": np.concatenate(centis) if centis else np.empty(0, np.int16),
+            "bands": np.concatenate(bands).astype(np.int8) if bands else np.empty(0, np.int8),
+            "band_counts": band_counts,
+        }
+    return results
+
+
+def _concat(parts):
+    return {name: (np.vstack if name == "band_counts" else np.concatenate)([part[name] for part in parts])
+            for name in parts[0]}
+
+
+def _select(data, rows):
+    # Subconjunto de usuarios (en el orden indicado) de un conjunto de recomendaciones
+    indptr = np.zeros(data["lengths"].size + 1, dtype=np.int64)
+    np.cumsum(data["lengths"], out=indptr[1:])
+    _, idx = gather_segments(indptr, rows)
+    selected = {name: data[name][idx] for name in ("movie_ids", "ratings", "bands")}
+    selected.update(user_ids=data["user_ids"][rows], lengths=data["lengths"][rows],
+                    band_counts=data["band_counts"][rows])
+    return selected
+
+
+def merge_results(previous, updated):
+    """Combina dos conjuntos de recomendaciones; los usuarios de ``updated`` reemplazan a los anteriores."""
+    keep = np.flatnonzero(~np.isin(previous["user_ids"], updated["user_ids"]))
+    merged = _concat([_select(previous, keep), updated])
+    return _select(merged, np.argsort(merged["user_ids"], kind="stable"))
+
+
+def write_store(data, directory, info, version=None):
+    """
+    Guarda las recomendaciones como una nueva versión del almacén, con un
+    archivo .npy por arreglo y un manifiesto; se publica igual que un
+    artefacto de modelo (LATEST).
+
+    Returns:
+        str: Ruta de la versión creada.
+    """
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    if os.path.exists(os.path.join(directory, version)):
+        raise ValueError(f"La versión {version} ya existe en {directory}")
+
+    tmp_path = os.path.join(directory, f".{version}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    indptr = np.zeros(data["lengths"].size + 1, dtype=np.int64)
+    np.cumsum(data["lengths"], out=indptr[1:])
+    arrays = {name: value for name, value in data.items() if name != "lengths"}
+    arrays["indptr"] = indptr
+
+    manifest = dict(info, format=STORE_FORMAT, version=version,
+                    created_at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    users=int(data["user_ids"].size), arrays={})
+    for name, value in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), value, allow_pickle=False)
+        manifest["arrays"][name] = {"dtype": value.dtype.str, "shape": list(value.shape)}
+
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return publish_version(directory, tmp_path, version)
+
+
+class PrecomputedStore:
+    """
+    Recomendaciones precalculadas de un modelo, cargadas con memoria mapeada.
+
+    Cada usuario conserva sus ``top_n`` mejores recomendaciones (en el mismo
+    orden que el cálculo en línea) y el número de candidatas por banda de
+    rating, de modo que el total de cualquier filtro es exacto. Los usuarios
+    nuevos, los desactualizados (con ratings posteriores al cálculo) y las
+    páginas que superan las recomendaciones conservadas se calculan en línea.
+
+    Atributos:
+        version (str): Versión del almacén.
+        model_version (str): Versión del modelo con la que se calculó.
+        built_at (datetime): Inicio del cálculo.
+        top_n (int): Recomendaciones conservadas por usuario.
+    """
+
+    def __init__(self, manifest, arrays):
+        self.version = manifest["version"]
+        self.model_version = manifest["model_version"]
+        self.built_at = datetime.fromisoformat(manifest["built_at"])
+        self.top_n = manifest["top_n"]
+        self.user_ids = arrays["user_ids"]
+        self.indptr = arrays["indptr"]
+        self.movie_ids = arrays["movie_ids"]
+        self.ratings = arrays["ratings"]
+        self.bands = arrays["bands"]
+        self.band_counts = arrays["band_counts"]
+        self.valid = True
+        self._stale = set()
+
+    @classmethod
+    def load(cls, directory):
+        """Versión vigente del almacén de un modelo (None si no existe)."""
+        path = latest_version(directory)
+        if path is None:
+            return None
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != STORE_FORMAT:
+            raise ValueError(f"Formato de recomendaciones precalculadas no soportado: {manifest.get('format')}")
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+                  for name in manifest["arrays"]}
+        return cls(manifest, arrays)
+
+    def results(self):
+        """Arreglos del almacén (para combinarlo con un cálculo parcial)."""
+        return {
+            "user_ids": np.asarray(self.user_ids),
+            "lengths": np.diff(self.indptr),
+            "movie_ids": np.asarray(self.movie_ids),
+            "ratings": np.asarray(self.ratings),
+            "bands": np.asarray(self.bands),
+            "band_counts": np.asarray(self.band_counts),
+        }
+
+    def _position(self, userId):
+        pos = int(np.searchsorted(self.user_ids, userId))
+        if pos < self.user_ids.size and self.user_ids[pos] == userId:
+            return pos
+        return None
+
+    def __contains__(self, userId):
+        return self._position(userId) is not None
+
+    def mark_stale(self, userIds):
+        """Los usuarios indicados se calculan en línea hasta el siguiente lote."""
+        self._stale.update(userIds)
+
+    def invalidate(self):
+        """Deja de usar el almacén (por ejemplo, tras recargar los ratings)."""
+        self.valid = False
+
+    def page(self, userId, catalog, filter_list=None, offset=0, limit=9):
+        """
+        Página de recomendaciones de un usuario, igual a la del cálculo en línea.
+
+        Returns:
+            tuple: (items de la página, total de recomendaciones filtradas), o
+            None si se debe calcular en línea.
+        """
+        if not self.valid or userId in self._stale or offset < 0 or limit < 0:
+            return None
+        pos = self._position(userId)
+        if pos is None:
+            return None
+
+        start, end = int(self.indptr[pos]), int(self.indptr[pos + 1])
+        bands = self.bands[start:end]
+        counts = self.band_counts[pos]
+        if filter_list:
+            wanted = [band for band in set(filter_list) if 0 <= band < counts.size]
+            positions = np.flatnonzero(np.isin(bands, wanted))
+            total = int(counts[wanted].sum())
+        else:
+            positions = np.arange(end - start)
+            total = int(counts.sum())
+
+        # La página supera las recomendaciones conservadas del usuario
+        if offset + limit > positions.size and positions.size < total:
+            return None
+
+        selected = start + positions[offset:offset + limit]
+        movie_ids = self.movie_ids[selected]
+        rows = catalog.rows(movie_ids)
+        if (rows < 0).any():
+            # El catálogo cambió después del cálculo
+            return None
+
+        items = [{
+            'movieId': int(movieId),
+            'title': catalog.titles[row],
+            'genres': catalog.genres[row],
+            'predicted_rating': int(centi) / 100
+        } for movieId, row, centi in zip(movie_ids.tolist(), rows.tolist(), self.ratings[selected].tolist())]
+        return items, total
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "model_version": self.model_version,
+            "built_at": self.built_at.isoformat(timespec="seconds"),
+            "users": int(self.user_ids.size),
+            "top_n": self.top_n,
+            "stale_users": len(self._stale),
+            "valid": self.valid
+        }
+
+
+def precompute(db: Session, artifacts, output_dir, processes=0, top_n=DEFAULT_TOP_N,
+               shard_size=SHARD_SIZE, changed=False):
+    """
+    Calcula las recomendaciones de todos los usuarios (o solo de los que
+    cambiaron desde el último cálculo) y publica una versión por modelo.
+
+    Los usuarios se reparten por grupos entre los procesos del pool; cada
+    proceso abre los artefactos con memoria mapeada, por lo que los modelos
+    no se copian. Los ratings de cada grupo se leen en el proceso principal
+    mientras los demás grupos se calculan.
+
+    Args:
+        db (Session): Sesión de base de datos.
+        artifacts (dict): Modelo (user, item) -> directorio del artefacto.
+        output_dir (str): Directorio del almacén (una carpeta por modelo).
+        processes (int): Procesos del pool; 0 calcula en el proceso actual.
+        top_n (int): Recomendaciones conservadas por usuario.
+        shard_size (int): Usuarios por tarea.
+        changed (bool): Calcular solo los usuarios nuevos o con ratings
+            posteriores al último cálculo (si el modelo no cambió).
+
+    Returns:
+        dict: Modelo -> ruta de la versión publicada.
+    """
+    started_at = datetime.now()
+    # Fijar la versión de cada modelo durante todo el cálculo
+    paths = {}
+    for kind, directory in artifacts.items():
+        paths[kind] = latest_version(directory)
+        if paths[kind] is None:
+            raise FileNotFoundError(f"No hay versiones de modelo publicadas en {directory}")
+    model_versions = {kind: os.path.basename(path) for kind, path in paths.items()}
+
+    catalog = MovieCatalog.from_db(db)
+    ranked = PopularityRanking().ranked(db)
+    userIds = [row[0] for row in db.query(DBUser.userId).order_by(DBUser.userId)]
+
+    previous = {}
+    if changed:
+        previous = {kind: PrecomputedStore.load(os.path.join(output_dir, kind)) for kind in artifacts}
+        if all(store is not None and store.model_version == model_versions[kind]
+               for kind, store in previous.items()):
+            since = min(store.built_at for store in previous.values())
+            stale = changed_users(db, since)
+            userIds = [userId for userId in userIds
+                       if userId in stale or any(userId not in store for store in previous.values())]
+            print(f"🔹 Usuarios nuevos o con ratings desde {since:%Y-%m-%d %H:%M:%S}: {len(userIds)}")
+        else:
+            print("🔹 El modelo cambió o no hay un cálculo previo: se calculan todos los usuarios")
+            previous = {}
+
+    shards = [userIds[i:i + shard_size] for i in range(0, len(userIds), shard_size)]
+    parts = []
+    start = time.perf_counter()
+
+    def report(done):
+        elapsed = time.perf_counter() - start
+        print(f"🔹 {done}/{len(userIds)} usuarios ({done / elapsed:.0f} usuarios/s)")
+
+    if processes <= 0:
+        _init_worker(paths, catalog, ranked, top_n)
+        done = 0
+        for shard in shards:
+            parts.append(_compute_shard(shard, _user_ratings(db, shard)))
+            done += len(shard)
+            report(done)
+    else:
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(paths, catalog, ranked, top_n)) as pool:
+            # Acotar los grupos en curso para no leer todos los ratings a la vez
+            pending, done = deque(), 0
+            for shard in shards:
+                pending.append((len(shard), pool.submit(_compute_shard, shard, _user_ratings(db, shard))))
+                while len(pending) >= 2 * processes:
+                    size, future = pending.popleft()
+                    parts.append(future.result())
+                    done += size
+                    report(done)
+            while pending:
+                size, future = pending.popleft()
+                parts.append(future.result())
+                done += size
+                report(done)
+
+    published = {}
+    for kind in artifacts:
+        results = _concat([part[kind] for part in parts]) if parts else None
+        if kind in previous:
+            results = merge_results(previous[kind].results(), results) if results else previous[kind].results()
+        if results is None:
+            continue
+        info = {"model": kind, "model_version": model_versions[kind],
+                "built_at": started_at.isoformat(timespec="seconds"), "top_n": top_n}
+        published[kind] = write_store(results, os.path.join(output_dir, kind), info)
+        print(f"🔹 Recomendaciones {kind} guardadas en {published[kind]}")
+    return published
+
+
+if __name__ == "__main__":
+    from db.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Precalcula las recomendaciones top-N de todos los usuarios")
+    parser.add_argument("--models", default="user,item", help="Modelos a calcular (user, item)")
+    parser.add_argument("--user-artifact", default="data/models/user", help="Artefacto del modelo user-user")
+    parser.add_argument("--item-artifact", default="data/models/item", help="Artefacto del modelo item-item")
+    parser.add_argument("--output", default="data/precomputed", help="Directorio del almacén")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_N, help="Recomendaciones por usuario")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Procesos del pool")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Usuarios por tarea")
+    parser.add_argument("--changed", action="store_true",
+                        help="Calcular solo los usuarios nuevos o con ratings desde el último cálculo")
+    args = parser.parse_args()
+
+    available = {"user": args.user_artifact, "item": args.item_artifact}
+    artifacts = {kind: available[kind] for kind in args.models.split(",")}
+
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        precompute(db, artifacts, args.output, processes=args.processes, top_n=args.top,
+                   shard_size=args.shard_size, changed=args.changed)
+    finally:
+        db.close()
+    print(f"Cálculo terminado en {time.perf_counter() - start:.1f} s")
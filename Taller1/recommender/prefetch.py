@@ -0,0 +1,148 @@
+import asyncio
+import collections
+import itertools
+import threading
+
+"""
+Precálculo en segundo plano de las recomendaciones de los usuarios que inician sesión
+"""
+
+
+class PrefetchQueue:
+    """
+    Cola acotada con prioridad de precálculos (userId, modelo), atendida por
+    una sola tarea del event loop. Los precálculos se ejecutan de a uno y
+    solo cuando ``busy()`` es falso (no hay cálculos de peticiones en curso),
+    de modo que una petición espera a lo sumo un precálculo.
+
+    Se atienden primero los de menor ``priority`` y, entre ellos, los más
+    recientes (el usuario que acaba de iniciar sesión). Al llenarse la cola se
+    descarta el precálculo menos prioritario. ``discard`` descarta los
+    pendientes de un usuario y cancela la espera del que está en curso; la
+    puntuación ya iniciada no se interrumpe. ``submit`` y ``discard`` se
+    pueden llamar desde cualquier hilo.
+
+    Args:
+        run (callable): Corrutina ``run(kind, userId)`` que precalcula y
+            devuelve el resultado ("computed", "skipped"...).
+        max_pending (int): Precálculos pendientes como máximo.
+        busy (callable): Indica si hay cálculos de peticiones en curso.
+        poll_interval (float): Segundos entre revisiones mientras hay cálculos en curso.
+    """
+
+    def __init__(self, run, max_pending=1000, busy=lambda: False, poll_interval=0.05):
+        self.run = run
+        self.max_pending = max_pending
+        self.busy = busy
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # (userId, kind) -> (priority, -orden de llegada, posición en la lista de modelos)
+        self._pending = {}
+        self._order = itertools.count()
+        # Precálculo en curso: ((userId, kind), tarea)
+        self._running = None
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self.results = collections.Counter()
+
+    def submit(self, userId, kinds, priority=0):
+        """Encola el precálculo de los modelos ``kinds`` de un usuario (reemplaza los pendientes)."""
+        if self._loop is None or self.max_pending <= 0:
+            return
+        order = next(self._order)
+        with self._lock:
+            for position, kind in enumerate(kinds):
+                self._pending[(userId, kind)] = (priority, -order, position)
+            while len(self._pending) > self.max_pending:
+                del self._pending[max(self._pending, key=self._pending.get)]
+                self.results["dropped"] += 1
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def discard(self, userId):
+        """
+        Descarta los precálculos pendientes de un usuario y cancela el que
+        está en curso (cierre de sesión o nuevo rating).
+
+        Cancelar la tarea no interrumpe la puntuación que espera (en un hilo
+        o en un proceso de puntuación): ``run`` debe revisar si el precálculo
+        sigue vigente antes de enviarlo a puntuar para liberar el pool.
+        """
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == userId]:
+                del self._pending[key]
+                self.results["discarded"] += 1
+            if self._running is not None and self._running[0][0] == userId:
+                # La tarea se cancela en el event loop; el worker la cuenta como descartada
+                self._loop.call_soon_threadsafe(self._running[1].cancel)
+
+    def _pop(self):
+        with self._lock:
+            if not self._pending:
+                return None
+            key = min(self._pending, key=self._pending.get)
+            del self._pending[key]
+            return key
+
+    async def _worker(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                # Ceder el pool de puntuación a las peticiones
+                if self.busy():
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                key = self._pop()
+                if key is None:
+                    break
+                userId, kind = key
+                task = self._loop.create_task(self.run(kind, userId))
+                with self._lock:
+                    self._running = (key, task)
+                try:
+                    # wait no propaga la cancelación de la tarea (discard), solo la del worker
+                    await asyncio.wait({task})
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                finally:
+                    with self._lock:
+                        self._running = None
+
+                if task.cancelled():
+                    result = "discarded"
+                elif task.exception() is not None:
+                    result = "failed"
+                    print(f"❌ Error precalculando las recomendaciones {kind} del usuario {userId}: {task.exception()}")
+                else:
+                    result = task.result()
+                with self._lock:
+                    self.results[result] += 1
+
+    def start(self):
+        """Inicia la tarea de la cola; se debe llamar desde el event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def counts(self):
+        """Precálculos por resultado (computed, skipped, failed, dropped, discarded)."""
+        with self._lock:
+            return dict(self.results)
+
+    def stats(self):
+        return {"pending": len(self._pending), "max_pending": self.max_pending, **self.counts()}
@@ -0,0 +1,194 @@
+import collections
+import contextvars
+import glob
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+"""
+Perfiles bajo demanda de peticiones individuales, con pilas colapsadas listas para un flame graph
+"""
+
+# Perfil de la petición en curso (None en las peticiones normales)
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    """
+    Perfil de muestreo de una petición: un hilo toma cada ``interval``
+    segundos la pila de los hilos que atienden la petición y cuenta las
+    pilas iguales. El resultado está en formato de pilas colapsadas (una
+    línea ``raíz;...;función muestras``), que leen flamegraph.pl y speedscope.
+
+    Args:
+        interval (float): Segundos entre muestras.
+    """
+
+    def __init__(self, interval=0.001):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._threads = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def attach(self):
+        """Incluye el hilo actual en el perfil."""
+        thread = threading.current_thread()
+        self._threads[thread.ident] = thread.name
+
+    def detach(self):
+        self._threads.pop(threading.get_ident(), None)
+
+    def run_attached(self, func, *args):
+        """Ejecuta ``func`` en el hilo actual incluyéndolo en el perfil (por ejemplo, en un pool)."""
+        self.attach()
+        try:
+            return func(*args)
+        finally:
+            self.detach()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, name in list(self._threads.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if stack:
+                    stack.append(name)
+                    self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        # Mientras dura el perfil, el hilo de muestreo obtiene el GIL con la
+        # frecuencia de muestreo (por defecto, cada 5 ms)
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval))
+        self.started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.seconds = time.perf_counter() - self.started
+        sys.setswitchinterval(self._switch_interval)
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """
+    Perfila las peticiones que lo solicitan con la cabecera ``X-Profile-Token``
+    o el parámetro ``profile``, cuyo valor debe ser el token de administración.
+    Sin token configurado, el perfilado está desactivado. Se perfila una
+    petición a la vez y con al menos ``min_interval`` segundos entre perfiles;
+    las demás peticiones se atienden sin perfilar.
+
+    Los perfiles se guardan en ``directory`` (pilas colapsadas ``.folded`` y
+    metadatos ``.json``), conservando los ``keep`` más recientes.
+
+    Args:
+        token (str): Token de administración; vacío desactiva el perfilado.
+        directory (str): Directorio de los perfiles.
+        min_interval (float): Segundos mínimos entre perfiles.
+        interval (float): Segundos entre muestras de un perfil.
+        keep (int): Perfiles conservados en disco.
+    """
+
+    def __init__(self, token, directory, min_interval=10, interval=0.001, keep=50):
+        self.token = token
+        self.directory = directory
+        self.min_interval = min_interval
+        self.interval = interval
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active = False
+        self._last = float("-inf")
+        self.limited = 0
+
+    def authorized(self, value):
+        return bool(self.token) and value is not None and hmac.compare_digest(value, self.token)
+
+    def requested(self, request):
+        if not self.token:
+            return False
+        value = request.headers.get("x-profile-token") or request.query_params.get("profile")
+        return self.authorized(value)
+
+    def start(self):
+        """Inicia un perfil en el contexto actual, o devuelve None si se excede el límite."""
+        with self._lock:
+            now = time.monotonic()
+            if self._active or now - self._last < self.min_interval:
+                self.limited += 1
+                return None
+            self._active = True
+            self._last = now
+        profile = Profile(interval=self.interval)
+        profile.attach()
+        _current_profile.set(profile)
+        profile.start()
+        return profile
+
+    def finish(self, profile, **tags):
+        """Detiene el perfil, lo guarda con sus etiquetas (userId, end-point...) y devuelve sus metadatos."""
+        profile.stop()
+        _current_profile.set(None)
+        with self._lock:
+            self._active = False
+
+        metadata = {"id": profile.id, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "seconds": round(profile.seconds, 4), "samples": profile.samples,
+                    "interval_seconds": profile.interval, **tags}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{profile.id}.folded"), "w") as f:
+                f.write(profile.folded())
+            with open(os.path.join(self.directory, f"{profile.id}.json"), "w") as f:
+                json.dump(metadata, f, indent=2)
+            self._prune()
+        except OSError as e:
+            print(f"❌ Error guardando el perfil {profile.id}: {e}")
+        return metadata
+
+    def _prune(self):
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json")))[:-self.keep or None]:
+            for extension in (".json", ".folded"):
+                try:
+                    os.remove(path[:-len(".json")] + extension)
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """Metadatos de los perfiles guardados, del más reciente al más antiguo."""
+        profiles = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json")), reverse=True):
+            try:
+                with open(path) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def path(self, profile_id):
+        """Archivo de pilas colapsadas de un perfil (None si no existe)."""
+        path = os.path.join(self.directory, f"{os.path.basename(profile_id)}.folded")
+        return path if os.path.exists(path) else None
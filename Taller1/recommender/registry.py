@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+import joblib
+from recommender.artifacts import latest_version, load_artifact
+from recommender.item_index import ItemNeighborIndex
+from recommender.knn import UserKNNScorer
+
+"""
+Carga de modelos en segundo plano y reemplazo en caliente de versiones
+"""
+
+
+class ModelSource:
+    """
+    Ubicación de un modelo, en orden de preferencia: artefacto con memoria
+    mapeada, índice .npz (solo item-item) o modelo de Surprise (.joblib).
+
+    Args:
+        artifact_dir (str): Directorio de versiones del artefacto.
+        model_path (str): Modelo de Surprise (.joblib).
+        index_path (str): Opcional, índice de vecinos ítem-ítem (.npz).
+        required (bool): Si el servidor necesita el modelo para estar listo.
+    """
+
+    def __init__(self, artifact_dir, model_path=None, index_path=None, required=True):
+        self.artifact_dir = artifact_dir
+        self.model_path = model_path
+        self.index_path = index_path
+        self.required = required
+
+    def _file_version(self, path):
+        mtime = time.strftime("%Y%m%d-%H%M%S", time.localtime(os.path.getmtime(path)))
+        return f"{os.path.basename(path)}@{mtime}"
+
+    def current_version(self):
+        """Versión disponible en disco (sin cargarla), o None si no hay modelo."""
+        latest = latest_version(self.artifact_dir)
+        if latest:
+            return os.path.basename(latest)
+        for path in (self.index_path, self.model_path):
+            if path and os.path.exists(path):
+                return self._file_version(path)
+        return None
+
+    def load(self):
+        """Carga el motor de puntuación; su atributo ``version`` identifica la versión."""
+        if latest_version(self.artifact_dir):
+            return load_artifact(self.artifact_dir)
+
+        if self.index_path and os.path.exists(self.index_path):
+            # El índice reemplaza la matriz densa del modelo item-item
+            scorer = ItemNeighborIndex.load(self.index_path)
+            scorer.version = self._file_version(self.index_path)
+            return scorer
+
+        if not self.model_path:
+            raise FileNotFoundError(f"No hay versiones de modelo publicadas en {self.artifact_dir}")
+        model = joblib.load(self.model_path)
+        if model.sim_options.get("user_based", True):
+            scorer = UserKNNScorer.from_surprise(model)
+        else:
+            # Sin índice precalculado, construirlo en memoria
+            scorer = ItemNeighborIndex.from_surprise(model)
+        scorer.version = self._file_version(self.model_path)
+        return scorer
+
+
+class ModelRegistry:
+    """
+    Carga los modelos en segundo plano y los publica en el servicio de
+    puntuación. Una nueva versión reemplaza a la anterior de forma atómica:
+    las peticiones en curso terminan con la versión con la que empezaron.
+
+    Args:
+        scoring_service (ScoringService): Servicio donde se publican los modelos.
+        sources (dict): Nombre del modelo -> ModelSource.
+        watch_interval (float): Segundos entre revisiones de nuevas versiones
+            en disco; 0 desactiva la revisión periódica.
+    """
+
+    def __init__(self, scoring_service, sources, watch_interval=0):
+        self.scoring_service = scoring_service
+        self.sources = sources
+        self.watch_interval = watch_interval
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in sources}
+        self._state = {name: {"status": "pending", "version": None, "loaded_at": None,
+                              "seconds": None, "updates": 0, "error": None}
+                       for name in sources}
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def _set_state(self, name, **values):
+        with self._lock:
+            self._state[name].update(values)
+
+    def load(self, name):
+        """Carga (o recarga) un modelo y lo publica. Devuelve True si tuvo éxito."""
+        with self._load_locks[name]:
+            live = name in self.scoring_service
+            self._set_state(name, status="reloading" if live else "loading", error=None)
+            start = time.perf_counter()
+            try:
+                scorer = self.sources[name].load()
+                self.scoring_service.register(name, scorer)
+            except Exception as e:
+                print(f"❌ Error cargando el modelo {name}: {e}")
+                # Si había una versión publicada, se sigue usando
+                self._set_state(name, status="ready" if live else "failed", error=str(e))
+                return False
+
+            self._set_state(name, status="ready", version=scorer.version,
+                            loaded_at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                            seconds=round(time.perf_counter() - start, 2), updates=0)
+            print(f"🔹 Modelo {name} cargado: versión {scorer.version}")
+            return True
+
+    def update(self, name, func):
+        """
+        Publica ``func(motor actual)`` como nueva versión del modelo (por
+        ejemplo, con ratings incrementales). Se ejecuta con el mismo bloqueo
+        que la carga, para no mezclarse con una recarga desde disco.
+
+        Returns:
+            El motor publicado, o None si el modelo no está disponible.
+        """
+        with self._load_locks[name]:
+            scorer = self.scoring_service.get(name)
+            if scorer is None:
+                return None
+            updated = func(scorer)
+            if updated is not scorer:
+                self.scoring_service.register(name, updated)
+                self._set_state(name, version=updated.version,
+                                updates=getattr(updated, "n_updates", 0))
+            return updated
+
+    def reload(self, names=None):
+        """Recarga en segundo plano los modelos indicados (todos por defecto)."""
+        names = list(names or self.sources)
+        for name in names:
+            threading.Thread(target=self.load, args=(name,), name=f"model-load-{name}",
+                             daemon=True).start()
+        return names
+
+    def _watch(self):
+        while not self._stop.wait(self.watch_interval):
+            for name, source in self.sources.items():
+                try:
+                    version = source.current_version()
+                except OSError:
+                    continue
+                if version and version != self._state[name]["version"] \
+                        and not self._load_locks[name].locked():
+                    self.load(name)
+
+    def start(self):
+        """Inicia la carga de todos los modelos y, si aplica, la revisión periódica."""
+        self.reload()
+        if self.watch_interval > 0 and self._watcher is None:
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name="model-watch", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        self._watcher = None
+
+    def status(self, name):
+        return self._state[name]["status"]
+
+    def ready(self):
+        """Indica si todos los modelos requeridos están publicados."""
+        return all(name in self.scoring_service
+                   for name, source in self.sources.items() if source.required)
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(state) for name, state in self._state.items()}
@@ -0,0 +1,526 @@
+import copy
+import itertools
+import multiprocessing
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+from recommender.knn import KNNParams
+
+"""
+Servicio de puntuación en un pool de procesos con los arreglos de los
+modelos en memoria compartida
+"""
+
+# Intentos de una tarea en el pool antes de puntuarla en el proceso actual
+SCORING_ATTEMPTS = 3
+
+# Motores de puntuación adjuntos en cada proceso del pool
+_worker_scorers = {}
+# Bloques de memoria compartida abiertos por el proceso (mantienen vivos los buffers)
+_worker_blocks = []
+# Versión incremental vigente de cada motor en el proceso: nombre -> (seq, motor, bloques)
+_worker_updates = {}
+
+
+class SharedArray:
+    """Referencia serializable a un arreglo NumPy en memoria compartida."""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def attach(self, blocks):
+        # Los procesos del pool comparten el resource tracker del proceso
+        # principal, que es el único que libera (unlink) los bloques
+        shm = shared_memory.SharedMemory(name=self.name)
+        blocks.append(shm)
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        return array
+
+
+class MappedArray:
+    """Referencia serializable a un arreglo mapeado desde un archivo .npy."""
+
+    def __init__(self, array):
+        self.filename = array.filename
+        self.offset = array.offset
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.order = "F" if array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+
+    def attach(self, blocks):
+        # Los procesos que mapean el mismo archivo comparten sus páginas
+        return np.memmap(self.filename, dtype=self.dtype, mode="r", offset=self.offset,
+                         shape=self.shape, order=self.order)
+
+
+class SharedRows:
+    """
+    Referencia serializable a un diccionario fila -> tupla de arreglos (por
+    ejemplo, las filas pendientes de un motor), empaquetado en arreglos en
+    memoria compartida: ids de fila, inicio de cada fila y una columna por
+    posición de la tupla.
+    """
+
+    def __init__(self, keys, indptr, columns):
+        self.keys = keys
+        self.indptr = indptr
+        self.columns = columns
+
+    def attach(self, blocks):
+        keys = _attach_value(self.keys, blocks).tolist()
+        indptr = _attach_value(self.indptr, blocks).tolist()
+        columns = [_attach_value(column, blocks) for column in self.columns]
+        # Las filas son vistas sobre la memoria compartida (no se copian)
+        return {key: tuple(column[start:end] for column in columns)
+                for key, start, end in zip(keys, indptr, indptr[1:])}
+
+
+class SharedUpdate:
+    """
+    Referencia serializable a una actualización incremental de un motor: los
+    atributos que cambiaron respecto de la versión con la que se inició el
+    pool, serializados en un bloque de memoria compartida. Sus arreglos (por
+    ejemplo, los cambios pendientes) están en sus propios bloques y el bloque
+    de la actualización solo guarda sus referencias, de modo que los procesos
+    los adjuntan sin copiarlos.
+    """
+
+    def __init__(self, seq, name, size):
+        self.seq = seq
+        self.name = name
+        self.size = size
+
+    def load(self):
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            return pickle.loads(bytes(shm.buf[:self.size]))
+        finally:
+            shm.close()
+
+
+class StaleUpdate(Exception):
+    """La actualización pedida ya fue reemplazada y liberada; se reintenta con la vigente."""
+
+
+def _attach_value(value, blocks):
+    if isinstance(value, (SharedArray, MappedArray, SharedRows)):
+        return value.attach(blocks)
+    if isinstance(value, tuple):
+        return tuple(_attach_value(item, blocks) for item in value)
+    if isinstance(value, KNNParams):
+        return _attach(value, blocks)
+    return value
+
+
+def _attach(obj, blocks):
+    # Reemplaza las referencias SharedArray/MappedArray por los arreglos compartidos
+    obj = copy.copy(obj)
+    for name, value in vars(obj).items():
+        setattr(obj, name, _attach_value(value, blocks))
+    return obj
+
+
+def _init_worker(handles):
+    for name, handle in handles.items():
+        _worker_scorers[name] = _attach(handle, _worker_blocks)
+
+
+def _worker_scorer(name, update):
+    # Motor del proceso para la versión pedida: la base del pool o la base con
+    # los atributos de la actualización incremental (se carga una vez por versión)
+    if update is None:
+        return _worker_scorers[name]
+    current = _worker_updates.get(name)
+    if current is not None and current[0] == update.seq:
+        return current[1]
+
+    try:
+        delta = update.load()
+    except FileNotFoundError:
+        raise StaleUpdate(name)
+    blocks = []
+    scorer = copy.copy(_worker_scorers[name])
+    for attr, value in delta.items():
+        setattr(scorer, attr, _attach_value(value, blocks))
+    _worker_updates[name] = (update.seq, scorer, blocks)
+
+    # Cerrar los bloques de la versión anterior; si aún hay vistas sobre
+    # alguno (una tarea en curso), se conserva hasta terminar el proceso
+    if current is not None:
+        previous_blocks = current[2]
+        current = None
+        for shm in previous_blocks:
+            try:
+                shm.close()
+            except BufferError:
+                _worker_blocks.append(shm)
+    return scorer
+
+
+def predict(scorer, userId, movieIds, ratings=None):
+    """
+    Puntúa las películas candidatas de un usuario; los usuarios que no están
+    en el modelo se puntúan con sus ratings (fold-in).
+    """
+    if ratings is not None and userId not in scorer.raw2inner_users:
+        return scorer.fold_in(ratings, movieIds)
+    return scorer.score(userId, movieIds)
+
+
+def _score(name, update, userId, movieIds, ratings=None):
+    return predict(_worker_scorer(name, update), userId, movieIds, ratings)
+
+
+def _top_n(name, update, userId, n, exclude, ratings=None):
+    return _worker_scorer(name, update).top_n(userId, n, exclude, ratings)
+
+
+class ScoringService:
+    """
+    Reparte la puntuación de recomendaciones entre varios procesos.
+
+    Los arreglos NumPy de cada motor de puntuación (similitudes, ratings,
+    sesgos y cambios pendientes) se copian una sola vez a memoria compartida; los procesos del pool
+    los adjuntan sin copiarlos, por lo que la memoria de los modelos no se
+    multiplica por el número de procesos. Los arreglos cargados de un
+    artefacto con memoria mapeada no se copian: cada proceso mapea el archivo.
+    Los diccionarios de ids (pequeños) se envían a cada proceso al iniciarlo.
+
+    Publicar una nueva versión de un modelo con ``register`` la reemplaza de
+    forma atómica: con pool, se crea un pool nuevo y el anterior termina sus
+    tareas en curso antes de liberar la memoria de la versión reemplazada.
+    Los arreglos que la nueva versión comparte con la anterior (por ejemplo,
+    tras una actualización incremental) no se vuelven a copiar.
+
+    Una actualización incremental (misma base y mapas de ids que la versión
+    con la que se inició el pool, con cambios pendientes) no reinicia el
+    pool: los atributos que cambiaron se publican en memoria compartida y
+    cada proceso los adjunta sobre su versión base la primera vez que los
+    usa, sin copiar sus arreglos. El pool se reinicia solo con una versión completa o compactada.
+
+    Si un proceso del pool termina de forma abrupta, el pool se reemplaza
+    por uno nuevo; una tarea que no se completa tras ``SCORING_ATTEMPTS``
+    intentos se puntúa en el proceso actual. Con ``processes=0`` la
+    puntuación se hace en el proceso actual.
+
+    Args:
+        processes (int): Número de procesos del pool.
+    """
+
+    def __init__(self, processes=0):
+        self.processes = processes
+        self._lock = threading.Lock()
+        self._scorers = {}
+        self._handles = {}
+        self._blocks = {}
+        # id(arreglo local) -> (arreglo, SharedArray, bloque) para reutilizar bloques
+        self._shared = {}
+        # Bloques usados por cada pool que aún no termina: id(pool) -> bloques
+        self._live = {}
+        # Motores con los que se inició cada pool y sus actualizaciones
+        # incrementales: id(pool) -> {nombre: [(SharedUpdate, bloques), ...]}
+        self._pool_handles = {}
+        self._updates = {}
+        self._update_seq = itertools.count(1)
+        self._pool = None
+        self._started = False
+
+    def register(self, name, scorer):
+        """Publica un motor de puntuación (UserKNNScorer, ItemNeighborIndex, MFScorer)."""
+        with self._lock:
+            if not self._started:
+                self._scorers[name] = scorer
+                return
+
+            blocks = []
+            handle, local = self._share(scorer, blocks)
+            old_pool = self._pool
+            self._handles[name] = handle
+            self._blocks[name] = blocks
+            self._scorers[name] = local
+
+            base = self._pool_handles.get(id(old_pool), {}).get(name) if old_pool is not None else None
+            if base is not None and _is_incremental(base, handle):
+                self._publish_update(old_pool, name, base, handle, blocks)
+                return
+            self._pool = self._new_pool()
+
+        if old_pool is not None:
+            threading.Thread(target=self._retire, args=(old_pool,),
+                             name="scoring-retire", daemon=True).start()
+
+    def __contains__(self, name):
+        return name in self._scorers
+
+    def get(self, name):
+        """Motor de puntuación publicado (None si no está disponible)."""
+        return self._scorers.get(name)
+
+    def version(self, name):
+        """Versión publicada de un modelo (None si no está disponible)."""
+        return getattr(self._scorers.get(name), "version", None)
+
+    def revision(self, name):
+        """
+        Versión publicada de un modelo y ratings incrementales aplicados sobre
+        ella: cambia con cada lote publicado, aunque la versión sea la misma.
+        """
+        scorer = self._scorers.get(name)
+        return getattr(scorer, "version", None), getattr(scorer, "n_updates", 0)
+
+    def _share(self, obj, blocks):
+        # Copia los arreglos del objeto a memoria compartida. Devuelve un clon
+        # serializable (referencias SharedArray) y un clon local que usa
+        # directamente la memoria compartida
+        handle, local = copy.copy(obj), copy.copy(obj)
+        for name, value in vars(obj).items():
+            if isinstance(value, np.memmap) and value.filename:
+                # Arreglos de un artefacto mapeado: los procesos mapean el mismo archivo
+                setattr(handle, name, MappedArray(value))
+            elif isinstance(value, np.ndarray):
+                shared_array, array = self._share_array(value, blocks)
+                setattr(handle, name, shared_array)
+                setattr(local, name, array)
+            elif isinstance(value, tuple) and value and all(isinstance(item, np.ndarray) for item in value):
+                # Cambios pendientes como tupla de arreglos (filas, columnas, valores)
+                shared = [self._share_array(item, blocks) for item in value]
+                setattr(handle, name, tuple(shared_array for shared_array, _ in shared))
+                setattr(local, name, tuple(array for _, array in shared))
+            elif isinstance(value, dict) and value and all(isinstance(row, tuple) for row in value.values()):
+                # Filas pendientes (fila -> tupla de arreglos): se empaquetan en
+                # arreglos compartidos; el proceso principal conserva el diccionario
+                setattr(handle, name, self._share_rows(value, blocks))
+            elif isinstance(value, KNNParams):
+                handle_params, local_params = self._share(value, blocks)
+                setattr(handle, name, handle_params)
+                setattr(local, name, local_params)
+        return handle, local
+
+    def _share_array(self, value, blocks):
+        # Copia un arreglo a memoria compartida (una sola vez por arreglo).
+        # Devuelve (referencia serializable, arreglo local sobre el bloque)
+        if value.nbytes == 0 or value.dtype == object:
+            return value, value
+        shared = self._shared.get(id(value))
+        if shared is not None and shared[0] is value:
+            # Arreglo ya publicado en memoria compartida por una versión anterior
+            _, shared_array, shm = shared
+            blocks.append(shm)
+            return shared_array, value
+        shm = shared_memory.SharedMemory(create=True, size=value.nbytes)
+        blocks.append(shm)
+        array = np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)
+        array[...] = value
+        array.flags.writeable = False
+        shared_array = SharedArray(shm.name, value.shape, value.dtype)
+        self._shared[id(array)] = (array, shared_array, shm)
+        return shared_array, array
+
+    def _share_rows(self, rows, blocks):
+        keys = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        lengths = np.fromiter((len(row[0]) for row in rows.values()), dtype=np.int64, count=len(rows))
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        columns = [np.concatenate(column) for column in zip(*rows.values())]
+        return SharedRows(self._share_array(keys, blocks)[0], self._share_array(indptr, blocks)[0],
+                          [self._share_array(column, blocks)[0] for column in columns])
+
+    def _new_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self.processes,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker,
+                                   initargs=(dict(self._handles),))
+        self._live[id(pool)] = [shm for blocks in self._blocks.values() for shm in blocks]
+        self._pool_handles[id(pool)] = dict(self._handles)
+        self._updates[id(pool)] = {}
+        return pool
+
+    def _publish_update(self, pool, name, base, handle, blocks):
+        # Serializa en memoria compartida los atributos que difieren de la
+        # versión base del pool (los cambios pendientes acumulados desde ella);
+        # sus arreglos ya están en bloques compartidos y solo se serializan
+        # sus referencias
+        delta = {attr: value for attr, value in vars(handle).items()
+                 if not _same(vars(base).get(attr), value)}
+        data = pickle.dumps(delta, protocol=pickle.HIGHEST_PROTOCOL)
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        shm.buf[:len(data)] = data
+        update = SharedUpdate(next(self._update_seq), shm.name, len(data))
+
+        # Se conservan la versión vigente y la anterior (tareas ya encoladas
+        # con ella); las más antiguas se liberan
+        history = self._updates[id(pool)].setdefault(name, [])
+        history.append((update, blocks + [shm]))
+        stale = [shm for _, update_blocks in history[:-2] for shm in update_blocks]
+        del history[:-2]
+        self._release_unused(stale)
+
+    def _current_update(self, pool, name):
+        history = self._updates.get(id(pool), {}).get(name)
+        return history[-1][0] if history else None
+
+    def _in_use(self):
+        in_use = {id(shm) for live in self._live.values() for shm in live}
+        in_use.update(id(shm) for blocks in self._blocks.values() for shm in blocks)
+        in_use.update(id(shm) for updates in self._updates.values() for history in updates.values()
+                      for _, blocks in history for shm in blocks)
+        return in_use
+
+    def _release_unused(self, blocks):
+        # Libera los bloques que ya no usa ninguna versión vigente ni ningún pool
+        in_use = self._in_use()
+        stale = {id(shm): shm for shm in blocks if id(shm) not in in_use}
+        for key, (_, _, shm) in list(self._shared.items()):
+            if id(shm) in stale:
+                del self._shared[key]
+        _release(stale.values())
+
+    def _retire(self, pool):
+        # Esperar las tareas en curso del pool anterior antes de liberar la
+        # memoria que ya no usa ninguna versión vigente
+        pool.shutdown(wait=True)
+        with self._lock:
+            blocks = self._live.pop(id(pool), [])
+            self._pool_handles.pop(id(pool), None)
+            for history in self._updates.pop(id(pool), {}).values():
+                blocks.extend(shm for _, update_blocks in history for shm in update_blocks)
+            self._release_unused(blocks)
+
+    def start(self):
+        """Mueve los modelos a memoria compartida e inicia el pool de procesos."""
+        with self._lock:
+            if self.processes <= 0 or self._started:
+                return
+            self._started = True
+
+            for name, scorer in self._scorers.items():
+                # El proceso principal también usa la copia compartida; los
+                # arreglos originales se liberan al quedar sin referencias
+                self._blocks[name] = []
+                self._handles[name], self._scorers[name] = self._share(scorer, self._blocks[name])
+            if self._handles:
+                self._pool = self._new_pool()
+
+    def score(self, name, userId, movieIds, ratings=None):
+        """
+        Predice el rating de un usuario para una lista de películas.
+
+        Args:
+            ratings (dict): Opcional, movieId -> rating del usuario; si el
+                usuario no está en el modelo, se puntúa con estos ratings.
+
+        Returns:
+            tuple: (est, impossible) arreglos alineados con movieIds.
+        """
+        if self._pool is not None:
+            if ratings is not None and userId in self._scorers[name].raw2inner_users:
+                # Usuario conocido: no enviar sus ratings al proceso
+                ratings = None
+            result = self._run(_score, name, userId, list(movieIds), ratings)
+            if result is not None:
+                return result
+        return predict(self._scorers[name], userId, movieIds, ratings)
+
+    def top_n(self, name, userId, n, exclude=(), ratings=None):
+        """
+        Mejores n películas de un usuario sobre todo el catálogo (modelos con
+        recuperación top-N, como MFScorer).
+
+        Returns:
+            tuple: (movieIds, est) ordenados por rating estimado descendente.
+        """
+        if self._pool is not None:
+            if ratings is not None and userId in self._scorers[name].raw2inner_users:
+                ratings = None
+            result = self._run(_top_n, name, userId, n, list(exclude), ratings)
+            if result is not None:
+                return result
+        return self._scorers[name].top_n(userId, n, exclude, ratings)
+
+    def _run(self, function, name, *args):
+        # Ejecuta una tarea en el pool vigente, con un número acotado de
+        # intentos: se reintenta si el pool fue reemplazado por una nueva
+        # versión, si se rompió (se reemplaza por uno nuevo) o si la
+        # actualización incremental se liberó antes de atender la tarea.
+        # Devuelve None si no hay pool o se agotan los intentos
+        for _ in range(SCORING_ATTEMPTS):
+            pool = self._pool
+            if pool is None:
+                return None
+            try:
+                return pool.submit(function, name, self._current_update(pool, name), *args).result()
+            except BrokenProcessPool as e:
+                self._replace_broken(pool, e)
+            except StaleUpdate:
+                continue
+            except RuntimeError:
+                # El pool fue reemplazado por una nueva versión (no admite tareas nuevas)
+                if pool is self._pool:
+                    raise
+        return None
+
+    def _replace_broken(self, pool, error):
+        # Un proceso del pool terminó de forma abrupta (por ejemplo, sin
+        # memoria) y el pool ya no acepta tareas: se inicia uno nuevo con las
+        # versiones vigentes de los modelos
+        with self._lock:
+            if pool is not self._pool:
+                return
+            print(f"❌ El pool de puntuación se interrumpió ({error}); se inicia uno nuevo")
+            self._pool = self._new_pool()
+        threading.Thread(target=self._retire, args=(pool,),
+                         name="scoring-retire", daemon=True).start()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            blocks = {id(shm): shm for name_blocks in self._blocks.values() for shm in name_blocks}
+            blocks.update({id(shm): shm for live in self._live.values() for shm in live})
+            blocks.update({id(shm): shm for updates in self._updates.values() for history in updates.values()
+                           for _, update_blocks in history for shm in update_blocks})
+            # Descartar los arreglos que apuntan a la memoria compartida antes de liberarla
+            self._scorers = {}
+            self._handles = {}
+            self._blocks = {}
+            self._shared = {}
+            self._live = {}
+            self._pool_handles = {}
+            self._updates = {}
+            self._started = False
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        _release(blocks.values())
+
+
+def _same(base, value):
+    # Mismo valor publicado: el mismo objeto o el mismo archivo mapeado
+    if base is value:
+        return True
+    if isinstance(base, MappedArray) and isinstance(value, MappedArray):
+        return vars(base) == vars(value)
+    return False
+
+
+def _is_incremental(base, handle):
+    # Versión con cambios pendientes sobre la misma base que ``base``: comparte
+    # los arreglos y los mapas de ids (los cambios están en otros atributos)
+    if type(base) is not type(handle) or not getattr(handle, "n_updates", 0):
+        return False
+    return all(_same(vars(base).get(attr), value) for attr, value in vars(handle).items()
+               if isinstance(value, (SharedArray, MappedArray)) or attr.startswith("raw2inner"))
+
+
+def _release(blocks):
+    for shm in blocks:
+        try:
+            shm.close()
+        except BufferError:
+            # Todavía hay vistas sobre el bloque; se libera al terminar el proceso
+            pass
+        shm.unlink()
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+"""
+Agrupación de cálculos concurrentes con la misma clave (single-flight)
+"""
+
+
+class SingleFlight:
+    """
+    Ejecuta una sola vez los cálculos concurrentes con la misma clave: la
+    primera petición inicia el cálculo como una tarea del event loop y las
+    siguientes, mientras no termina, esperan esa misma tarea y reciben su
+    resultado o su excepción.
+
+    La espera de cada petición está limitada a ``timeout`` segundos; al
+    vencer, la petición recibe ``asyncio.TimeoutError`` pero el cálculo
+    continúa para las demás (y, por ejemplo, para llenar la caché).
+
+    Args:
+        timeout (float): Segundos máximos de espera por el resultado (None: sin límite).
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    async def run(self, key, compute):
+        """
+        Resultado del cálculo de ``key``, iniciándolo con ``compute()`` (una
+        corrutina) si no hay uno en curso.
+
+        Returns:
+            tuple: (resultado, True si la petición se unió a un cálculo en curso).
+        """
+        with self._lock:
+            task = self._flights.get(key)
+            coalesced = task is not None
+            if not coalesced:
+                task = asyncio.ensure_future(compute())
+                self._flights[key] = task
+                task.add_done_callback(lambda done: self._finish(key, done))
+        # shield: si la espera de una petición vence o se cancela, el cálculo sigue
+        return await asyncio.wait_for(asyncio.shield(task), self.timeout), coalesced
+
+    def _finish(self, key, task):
+        with self._lock:
+            if self._flights.get(key) is task:
+                del self._flights[key]
+        # Marcar la excepción como leída aunque todas las peticiones hayan dejado de esperar
+        if not task.cancelled():
+            task.exception()
+
+    def forget(self, predicate):
+        """
+        Desvincula los cálculos en curso cuyas claves cumplen ``predicate``
+        (por ejemplo, los de un usuario que acaba de calificar): las
+        peticiones siguientes inician un cálculo nuevo.
+        """
+        with self._lock:
+            for key in [key for key in self._flights if predicate(key)]:
+                del self._flights[key]
+
+    def __len__(self):
+        return len(self._flights)
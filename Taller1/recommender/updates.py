@@ -0,0 +1,142 @@
+import threading
+from recommender.artifacts import export_artifact, load_artifact
+
+"""
+Actualización incremental de los modelos KNN con los ratings nuevos
+"""
+
+
+class IncrementalUpdater:
+    """
+    Acumula los ratings recibidos y los aplica por lotes a los modelos
+    publicados, sin reentrenarlos: cada lote recalcula solo las medias y las
+    similitudes de los usuarios/películas afectados y se publica como una
+    nueva versión en memoria (copy-on-write).
+
+    Cuando un modelo acumula ``compact_threshold`` ratings pendientes, o sus
+    cambios pendientes ocupan ``compact_bytes``, se integran en sus arreglos y
+    se exporta una nueva versión del artefacto, que es la que se carga al
+    reiniciar el servidor.
+
+    Args:
+        registry (ModelRegistry): Registro con los modelos publicados.
+        interval (float): Segundos entre lotes; 0 desactiva el hilo de fondo
+            (los lotes se aplican llamando a ``flush``).
+        compact_threshold (int): Ratings pendientes que disparan la
+            compactación y exportación del modelo; 0 la desactiva.
+        compact_bytes (int): Memoria de los cambios pendientes (bytes) que
+            dispara la compactación; 0 la desactiva.
+        on_publish (callable): Opcional, recibe los userIds de cada lote
+            aplicado (por ejemplo, para invalidar la caché).
+    """
+
+    def __init__(self, registry, interval=5, compact_threshold=10000, compact_bytes=256 * 2 ** 20,
+                 on_publish=None):
+        self.registry = registry
+        self.interval = interval
+        self.compact_threshold = compact_threshold
+        self.compact_bytes = compact_bytes
+        self.on_publish = on_publish
+        self._lock = threading.Lock()
+        self._pending = []
+        self._stop = threading.Event()
+        self._worker = None
+        self.batches = 0
+        self.applied = {name: 0 for name in registry.sources}
+        self.compactions = {name: 0 for name in registry.sources}
+        self.skipped = set()
+
+    def add(self, userId, movieId, rating):
+        """Encola un rating para el siguiente lote."""
+        with self._lock:
+            self._pending.append((userId, movieId, float(rating)))
+
+    def add_many(self, ratings):
+        """Encola varios ratings (userId, movieId, rating) para el siguiente lote."""
+        ratings = [(userId, movieId, float(rating)) for userId, movieId, rating in ratings]
+        with self._lock:
+            self._pending.extend(ratings)
+
+    def _apply(self, name, batch):
+        def apply(scorer):
+            if not hasattr(scorer, "with_ratings"):
+                raise ValueError(f"{type(scorer).__name__} no tiene actualización incremental")
+            updated, applied = scorer.with_ratings(batch)
+            self.applied[name] += applied
+            if self._should_compact(updated):
+                updated = self._compact(name, updated)
+            return updated
+        return apply
+
+    def _should_compact(self, scorer):
+        if self.compact_threshold and scorer.n_updates >= self.compact_threshold:
+            return True
+        return bool(self.compact_bytes) and getattr(scorer, "pending_bytes", 0) >= self.compact_bytes
+
+    def _compact(self, name, scorer):
+        # Exportar la versión compactada y publicarla desde el artefacto, con
+        # memoria mapeada como al iniciar el servidor
+        try:
+            path = export_artifact(scorer, self.registry.sources[name].artifact_dir,
+                                   source="actualización incremental")
+            compacted = load_artifact(path)
+        except Exception as e:
+            print(f"❌ Error compactando el modelo {name}: {e}")
+            return scorer
+        self.compactions[name] += 1
+        print(f"🔹 Modelo {name} compactado: versión {compacted.version}")
+        return compacted
+
+    def flush(self):
+        """Aplica los ratings pendientes; devuelve cuántos se tomaron del lote."""
+        if not self.registry.ready():
+            # Los modelos aún cargan: conservar los ratings para el siguiente lote
+            return 0
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+
+        for name in self.registry.sources:
+            if name in self.skipped:
+                continue
+            try:
+                self.registry.update(name, self._apply(name, batch))
+            except ValueError as e:
+                # Similitud sin soporte incremental: el modelo se actualiza al reentrenarlo
+                print(f"❌ El modelo {name} no admite actualización incremental: {e}")
+                self.skipped.add(name)
+            except Exception as e:
+                print(f"❌ Error actualizando el modelo {name}: {e}")
+
+        self.batches += 1
+        if self.on_publish is not None:
+            self.on_publish({userId for userId, _, _ in batch})
+        return len(batch)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        """Inicia la aplicación periódica de lotes en segundo plano."""
+        if self.interval > 0 and self._worker is None:
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="model-updates", daemon=True)
+            self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._worker = None
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "applied": dict(self.applied),
+            "compactions": dict(self.compactions),
+            "skipped": sorted(self.skipped),
+            "interval_seconds": self.interval,
+            "compact_threshold": self.compact_threshold,
+            "compact_bytes": self.compact_bytes
+        }
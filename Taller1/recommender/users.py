@@ -0,0 +1,82 @@
+import threading
+import numpy as np
+from sqlalchemy.orm import Session
+from db.models import User as DBUser
+
+"""
+Registro en memoria de los usuarios existentes, compartido por todo el proceso
+"""
+
+
+class UserRegistry:
+    """
+    Mantiene en memoria un mapa de bits indexado por userId con los usuarios
+    existentes, para verificar la existencia de un usuario y obtener el mayor
+    userId en O(1) sin consultar la base de datos.
+
+    El mapa se carga una sola vez con una consulta sobre la tabla user, se
+    recarga tras ``invalidate`` (carga de ratings, que reconstruye la tabla)
+    y se actualiza incrementalmente con ``add`` al crear usuarios.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._present = None
+        self._max_id = 0
+        self._count = 0
+        self._loaded_version = -1
+        self.version = 0
+
+    def _load(self, db: Session):
+        user_ids = np.fromiter((userId for (userId,) in db.query(DBUser.userId)), dtype=np.int64)
+        user_ids = user_ids[user_ids >= 0]
+        present = np.zeros(int(user_ids.max()) + 1 if user_ids.size else 0, dtype=bool)
+        present[user_ids] = True
+        self._present = present
+        self._max_id = int(user_ids.max()) if user_ids.size else 0
+        self._count = int(np.count_nonzero(present))
+        self._loaded_version = self.version
+
+    def _current(self, db: Session):
+        present = self._present
+        if present is not None and self._loaded_version == self.version:
+            return present
+
+        with self._lock:
+            if self._present is None or self._loaded_version != self.version:
+                self._load(db)
+            return self._present
+
+    def exists(self, db: Session, userId):
+        """Indica si el usuario existe."""
+        present = self._current(db)
+        userId = int(userId)
+        return 0 <= userId < present.size and bool(present[userId])
+
+    def max_id(self, db: Session):
+        """Mayor userId registrado (0 si no hay usuarios)."""
+        self._current(db)
+        return self._max_id
+
+    def add(self, userIds):
+        """Registra usuarios recién creados."""
+        userIds = np.asarray(userIds, dtype=np.int64)
+        with self._lock:
+            if self._present is None or userIds.size == 0:
+                return
+            if userIds.max() >= self._present.size:
+                # Crecer con holgura para no copiar el mapa en cada usuario nuevo
+                present = np.zeros(max(int(userIds.max()) + 1, self._present.size * 5 // 4), dtype=bool)
+                present[:self._present.size] = self._present
+                self._present = present
+            self._count += int(np.count_nonzero(~self._present[userIds]))
+            self._present[userIds] = True
+            self._max_id = max(self._max_id, int(userIds.max()))
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def stats(self):
+        return {"users": self._count, "max_id": self._max_id,
+                "bytes": int(self._present.nbytes) if self._present is not None else 0}
@@ -59,26 +59,54 @@ async function loadPopularMovies() {
     }
 }
 
+// Función para llenar el selector de películas
+function fillMovieSelect(movies) {
+    const movieSelect = document.getElementById('movieSelect');
+    movieSelect.innerHTML = '<option value="">Seleccionar película...</option>';
+    
+    movies.forEach(movie => {
+        const option = document.createElement('option');
+        option.value = movie.movieId;
+        option.textContent = movie.title;
+        movieSelect.appendChild(option);
+    });
+}
+
 // Función para cargar todas las películas
 async function loadAllMovies() {
     try {
         const response = await fetch('/movies?limit=100&offset=100&order=asc');
         allMovies = await response.json();
-        
-        const movieSelect = document.getElementById('movieSelect');
-        movieSelect.innerHTML = '<option value="">Seleccionar película...</option>';
-        
-        allMovies.forEach(movie => {
-            const option = document.createElement('option');
-            option.value = movie.movieId;
-            option.textContent = movie.title;
-            movieSelect.appendChild(option);
-        });
+        fillMovieSelect(allMovies);
     } catch (error) {
         console.error('Error cargando películas:', error);
     }
 }
 
+// Función para buscar películas por título mientras se escribe
+let searchTimer = null;
+let searchSeq = 0;
+function searchMovies(query) {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(async () => {
+        const seq = ++searchSeq;
+        if (!query.trim()) {
+            fillMovieSelect(allMovies);
+            return;
+        }
+        try {
+            const response = await fetch(`/movies/search?q=${encodeURIComponent(query)}&limit=20`);
+            const movies = await response.json();
+            // Ignorar respuestas de búsquedas anteriores que llegan tarde
+            if (seq === searchSeq) {
+                fillMovieSelect(movies);
+            }
+        } catch (error) {
+            console.error('Error buscando películas:', error);
+        }
+    }, 150);
+}
+
 // Función para cargar los ratings de un usuario
 async function loadUserRatings(userId) {
     try {
@@ -605,6 +633,7 @@ document.getElementById('submitRatingBtn').addEventListener('click', async () =>
 
 // Inicializar la aplicación
 window.addEventListener('DOMContentLoaded', async () => {
+    document.getElementById('movieSearch').addEventListener('input', (event) => searchMovies(event.target.value));
     await loadPopularMovies();
     await loadAllMovies();
 });
\ No newline at end of file
@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+# Los módulos del proyecto se importan desde Taller1 (db, recommender)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def sqlite_db():
+    """Sesión sobre una base de datos SQLite en memoria con las tablas de db.models."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from db.models import Base
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        yield db
+    finally:
+        db.close()
+        engine.dispose()
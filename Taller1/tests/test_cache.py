@@ -0,0 +1,99 @@
+import pytest
+from recommender import cache as cache_module
+from recommender.cache import RecommendationCache
+
+"""
+Caché de recomendaciones: desalojo LRU, vencimiento por TTL, invalidación
+por usuario y rechazo de los resultados calculados antes de invalidar
+"""
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Reloj controlado por la prueba en lugar de time.monotonic
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_evicts_least_recently_used():
+    cache = RecommendationCache(max_entries=2)
+    cache.set("a", 1, userId=1)
+    cache.set("b", 2, userId=2)
+    # Leer "a" la vuelve la más reciente: al llenarse se descarta "b"
+    assert cache.get("a") == 1
+    cache.set("c", 3, userId=3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+    # El índice por usuario no conserva las claves desalojadas
+    assert cache.stats()["users"] == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = RecommendationCache(ttl=10)
+    cache.set("a", 1, userId=1)
+    clock[0] += 5
+    cache.set("b", 2, userId=2)
+
+    clock[0] += 5
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.expirations == 1
+
+    clock[0] += 5
+    assert cache.expire() == 1
+    assert len(cache) == 0 and cache.stats()["users"] == 0
+
+
+def test_invalidate_user_removes_only_their_entries():
+    cache = RecommendationCache()
+    cache.set(("user", 1, "v1"), "u1", userId=1)
+    cache.set(("item", 1, "v1"), "i1", userId=1)
+    cache.set(("user", 2, "v1"), "u2", userId=2)
+
+    cache.invalidate_user(1)
+
+    assert cache.get(("user", 1, "v1")) is None
+    assert cache.get(("item", 1, "v1")) is None
+    assert cache.get(("user", 2, "v1")) == "u2"
+    # Invalidar un usuario sin entradas no falla
+    cache.invalidate_user(3)
+
+
+def test_generation_changes_on_invalidate_and_clear():
+    cache = RecommendationCache()
+    first = cache.generation(1)
+
+    cache.invalidate_user(2)
+    assert cache.generation(1) == first
+
+    cache.invalidate_user(1)
+    invalidated = cache.generation(1)
+    assert invalidated != first
+
+    cache.clear()
+    assert cache.generation(1) not in (first, invalidated)
+
+
+def test_rejects_writes_computed_before_invalidation():
+    cache = RecommendationCache()
+    generation = cache.generation(1)
+    other = cache.generation(2)
+
+    # Un nuevo rating del usuario 1 mientras se calculaban sus recomendaciones
+    cache.invalidate_user(1)
+
+    assert cache.set("a", "stale", userId=1, generation=generation) is False
+    assert cache.get("a") is None
+    assert cache.stale_writes == 1
+    # Los cálculos de otros usuarios y los que empiezan después se guardan
+    assert cache.set("b", "fresh", userId=2, generation=other) is True
+    assert cache.set("a", "fresh", userId=1, generation=cache.generation(1)) is True
+    assert cache.get("a") == "fresh"
+
+    # clear invalida los cálculos en curso de todos los usuarios
+    generation = cache.generation(2)
+    cache.clear()
+    assert cache.set("b", "stale", userId=2, generation=generation) is False
@@ -0,0 +1,98 @@
+from recommender.catalog import MovieCatalog
+
+"""
+Catálogo en memoria: paginación por cursor en ambos órdenes, cursores de un
+catálogo anterior, títulos nulos y búsqueda por título mientras se escribe
+"""
+
+MOVIES = [
+    (1, "Toy Story (1995)", "Animation"),
+    (2, "Jumanji (1995)", "Adventure"),
+    (3, "Heat (1995)", "Action"),
+    (4, "Casino (1995)", "Drama"),
+    (5, "Sabrina (1995)", "Comedy"),
+    (6, "Heat (1986)", "Action"),
+    (7, "Águila Roja", "Action"),
+    (8, "Toy Soldiers", "Drama"),
+]
+
+
+def make_catalog(movies=MOVIES, version=0):
+    return MovieCatalog(movie_ids=[movie[0] for movie in movies], titles=[movie[1] for movie in movies],
+                        genres=[movie[2] for movie in movies], version=version)
+
+
+def walk(catalog, limit, order="asc"):
+    # Recorre todas las páginas siguiendo el cursor
+    ids, after = [], None
+    while True:
+        movies, after = catalog.page_after(after, limit=limit, order=order)
+        ids.extend(movie["movieId"] for movie in movies)
+        if after is None:
+            return ids
+
+
+def test_page_after_matches_offset_pages_in_both_orders():
+    catalog = make_catalog()
+    for order in ("asc", "desc"):
+        expected = [movie["movieId"] for movie in catalog.page(0, len(catalog), order=order)]
+        for limit in (1, 3, len(catalog), len(catalog) + 5):
+            assert walk(catalog, limit, order) == expected
+    # Mismo título: desempata el movieId
+    assert walk(catalog, 2)[:4] == [4, 6, 3, 2]
+    assert walk(catalog, 2, "desc")[-4:] == [2, 3, 6, 4]
+
+
+def test_cursor_on_last_row_returns_empty_page():
+    catalog = make_catalog()
+    last = catalog.title_keys[-1]
+    assert catalog.page_after(last, limit=3) == ([], None)
+
+    first = catalog.title_keys[0]
+    assert catalog.page_after(first, limit=3, order="desc") == ([], None)
+
+    # La penúltima página termina sin cursor siguiente
+    movies, after = catalog.page_after(catalog.title_keys[-2], limit=3)
+    assert [movie["movieId"] for movie in movies] == [int(catalog.movie_ids[catalog.title_order[-1]])]
+    assert after is None
+
+
+def test_cursor_missing_after_reload_continues_at_its_position():
+    catalog = make_catalog()
+    movies, after = catalog.page_after(None, limit=2)
+    assert after == ("Heat (1986)", 6)
+
+    # La película del cursor se borra al recargar: la página sigue después de su clave
+    reloaded = make_catalog([movie for movie in MOVIES if movie[0] != 6], version=1)
+    movies, _ = reloaded.page_after(after, limit=2)
+    assert [movie["movieId"] for movie in movies] == [3, 2]
+    movies, _ = reloaded.page_after(after, limit=2, order="desc")
+    assert [movie["movieId"] for movie in movies] == [4]
+
+
+def test_null_titles_sort_first_and_paginate():
+    catalog = make_catalog(MOVIES + [(9, None, "Drama"), (10, "", "Drama")])
+    assert walk(catalog, 3)[:2] == [9, 10]
+    assert walk(catalog, 3, "desc")[-2:] == [10, 9]
+    assert catalog.page_after(("", 9), limit=1)[0][0]["movieId"] == 10
+    assert catalog.search("drama") == []
+
+
+def test_search_single_character_uses_word_start_bigrams():
+    catalog = make_catalog()
+    # "h" solo al inicio de palabra: Heat, no "Toy Story" ni "Sabrina"
+    assert [movie["movieId"] for movie in catalog.search("h")] == [6, 3]
+    # Sin tildes ni mayúsculas
+    assert [movie["movieId"] for movie in catalog.search("A")] == [7]
+    assert [movie["movieId"] for movie in catalog.search("s")] == [5, 8, 1]
+    assert catalog.search("x") == []
+    assert catalog.search("") == []
+
+
+def test_search_lists_title_prefixes_first():
+    catalog = make_catalog()
+    # Títulos que empiezan por la búsqueda y luego los que la contienen en otra palabra
+    assert [movie["movieId"] for movie in catalog.search("sto")] == [1]
+    assert [movie["movieId"] for movie in catalog.search("toy")] == [8, 1]
+    assert [movie["movieId"] for movie in catalog.search("1995", limit=2)] == [4, 3]
+    assert catalog.search("toy", limit=0) == []
@@ -0,0 +1,53 @@
+import io
+import pytest
+from sqlalchemy import inspect, text
+from db.loadtables import create_rating
+from db.migrate import missing_indexes
+
+"""
+Carga del archivo de ratings en una tabla auxiliar y reemplazo de la tabla
+rating: pares repetidos, ratings incompletos y cargas fallidas
+"""
+
+RATINGS_CSV = """userId,movieId,rating,timestamp
+1,10,4.0,1000
+1,10,2.0,2000
+1,11,3.5,
+1,11,1.0,500
+2,10,5.0,1000
+2,10,3.0,1000
+3,12,2.5,100
+"""
+
+
+def rows(db):
+    return db.execute(text('SELECT "userId", "movieId", rating FROM rating ORDER BY 1, 2')).all()
+
+
+def test_create_rating_keeps_latest_of_repeated_pairs(sqlite_db):
+    db = sqlite_db
+    db.execute(text("INSERT INTO rating VALUES (99, 1, 4, NULL)"))
+    db.commit()
+
+    result = create_rating(db, io.StringIO(RATINGS_CSV), chunksize=3)
+
+    assert (result["rows"], result["discarded"]) == (4, 3)
+    # El más reciente; los ratings sin fecha solo si no hay otro; a igual fecha, el último del archivo
+    # (el rating se guarda en medias estrellas)
+    assert rows(db) == [(1, 10, 4), (1, 11, 2), (2, 10, 6), (3, 12, 5)]
+    assert db.execute(text('SELECT "userId" FROM "user" ORDER BY 1')).scalars().all() == [1, 2, 3]
+    inspector = inspect(db.get_bind())
+    assert sorted(inspector.get_table_names()) == ["movie", "rating", "user"]
+    assert not missing_indexes(db.get_bind())
+
+
+def test_failed_load_keeps_rating_table(sqlite_db):
+    db = sqlite_db
+    create_rating(db, io.StringIO(RATINGS_CSV))
+    before = rows(db)
+
+    with pytest.raises(ValueError):
+        create_rating(db, io.StringIO("userId,movieId\n1,2\n"))
+
+    assert rows(db) == before
+    assert sorted(inspect(db.get_bind()).get_table_names()) == ["movie", "rating", "user"]
@@ -0,0 +1,55 @@
+from datetime import datetime
+from sqlalchemy import text
+from db.models import User as DBUser, rating as DBRating
+from db.ratings import upsert_ratings
+
+"""
+Inserción o actualización de los ratings de un usuario en una sola sentencia
+(SQLite): ratings nuevos y existentes, pares repetidos y usuario inexistente
+"""
+
+BEFORE = datetime(2024, 1, 1, 12, 0)
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def rows(db):
+    return db.execute(text('SELECT "userId", "movieId", rating, timestamp FROM rating ORDER BY 1, 2')).all()
+
+
+def test_upsert_mixes_new_and_existing_ratings(sqlite_db):
+    db = sqlite_db
+    db.add_all([DBUser(1, "ana"), DBUser(2, "luis")])
+    db.add_all([DBRating(1, 10, 3.0, BEFORE), DBRating(1, 11, 2.0, BEFORE), DBRating(2, 10, 1.0, BEFORE)])
+    db.commit()
+
+    # 10 existe y se actualiza; 12 y 13 son nuevos; "13" repite la película 13
+    inserted = upsert_ratings(db, 1, {10: 4.5, 12: 5.0, 13: 1.0, "13": 2.5}, NOW)
+    db.commit()
+
+    assert sorted(inserted) == [12, 13]
+    # La columna guarda medias estrellas (el doble del rating); queda el último par repetido
+    assert [row[:3] for row in rows(db)] == [(1, 10, 9), (1, 11, 4), (1, 12, 10), (1, 13, 5), (2, 10, 2)]
+    timestamps = {(userId, movieId): timestamp for userId, movieId, _, timestamp in rows(db)}
+    assert str(timestamps[(1, 10)]).startswith("2024-06-01")
+    assert str(timestamps[(1, 11)]).startswith("2024-01-01")
+    assert str(timestamps[(2, 10)]).startswith("2024-01-01")
+
+
+def test_upsert_only_existing_ratings_returns_empty(sqlite_db):
+    db = sqlite_db
+    db.add(DBUser(1, "ana"))
+    db.add(DBRating(1, 10, 3.0, BEFORE))
+    db.commit()
+
+    assert upsert_ratings(db, 1, {10: 0.5}, NOW) == []
+    assert [row[:3] for row in rows(db)] == [(1, 10, 1)]
+    assert upsert_ratings(db, 1, {}, NOW) == []
+
+
+def test_upsert_unknown_user_writes_nothing(sqlite_db):
+    db = sqlite_db
+    db.add(DBUser(1, "ana"))
+    db.commit()
+
+    assert upsert_ratings(db, 7, {10: 4.0, 11: 3.0}, NOW) is None
+    assert rows(db) == []
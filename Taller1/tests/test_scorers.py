@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import Dataset, KNNWithMeans, Reader
+from recommender.artifacts import export_artifact, load_artifact
+from recommender.item_index import ItemNeighborIndex
+from recommender.knn import UserKNNScorer, top_n_indices
+
+"""
+Paridad de los motores de puntuación con Surprise: predicciones y top-N
+iguales a ``predict()``, y actualizaciones incrementales y fold-in iguales
+a reentrenar el modelo
+"""
+
+N_USERS = 120
+N_ITEMS = 150
+TOP_N = 20
+
+
+def make_ratings(seed=0):
+    # Ratings sintéticos en medias estrellas, sin pares repetidos
+    rng = np.random.default_rng(seed)
+    rows = [(userId, int(movieId), rng.integers(1, 11) / 2)
+            for userId in range(1, N_USERS + 1)
+            for movieId in rng.choice(np.arange(1, N_ITEMS + 1), rng.integers(5, 40), replace=False)]
+    return pd.DataFrame(rows, columns=["userId", "movieId", "rating"])
+
+
+def train(ratings, user_based):
+    # Misma configuración que los modelos del servidor (KNNWithMeans, Pearson)
+    dataset = Dataset.load_from_df(ratings[["userId", "movieId", "rating"]], Reader(rating_scale=(0.5, 5.0)))
+    model = KNNWithMeans(k=20, sim_options={"name": "pearson", "user_based": user_based}, verbose=False)
+    model.fit(dataset.build_full_trainset())
+    return model
+
+
+def build_scorer(model, user_based):
+    if user_based:
+        return UserKNNScorer.from_surprise(model)
+    # Sin poda: el índice conserva todos los vecinos y debe coincidir con predict()
+    return ItemNeighborIndex.from_surprise(model, n_neighbors=N_ITEMS)
+
+
+def with_new_ratings(ratings, new):
+    # Aplica (userId, movieId, rating) sobre el DataFrame: actualiza o agrega
+    ratings = ratings.set_index(["userId", "movieId"])
+    for userId, movieId, rating in new:
+        ratings.loc[(userId, movieId), "rating"] = rating
+    return ratings.reset_index()
+
+
+def predictions(model, userId, movieIds):
+    predicted = [model.predict(userId, movieId) for movieId in movieIds]
+    return (np.array([p.est for p in predicted]),
+            np.array([p.details["was_impossible"] for p in predicted]))
+
+
+def assert_same_scores(scorer, model, userIds):
+    movieIds = list(range(1, N_ITEMS + 1))
+    for userId in userIds:
+        est, impossible = scorer.score(userId, movieIds)
+        expected_est, expected_impossible = predictions(model, userId, movieIds)
+        np.testing.assert_array_equal(impossible, expected_impossible)
+        np.testing.assert_allclose(est, expected_est, rtol=0, atol=1e-12)
+
+
+@pytest.fixture(scope="module")
+def ratings():
+    return make_ratings()
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["user", "item"])
+def trained(request, ratings):
+    user_based = request.param
+    model = train(ratings, user_based)
+    return user_based, model, build_scorer(model, user_based)
+
+
+def test_scores_match_predict(trained):
+    user_based, model, scorer = trained
+    assert_same_scores(scorer, model, range(1, N_USERS + 1, 3))
+
+
+def test_top_n_matches_predict(trained, ratings):
+    user_based, model, scorer = trained
+    for userId in range(1, N_USERS + 1, 3):
+        rated = set(ratings.movieId[ratings.userId == userId])
+        candidates = np.array([movieId for movieId in range(1, N_ITEMS + 1) if movieId not in rated])
+        est, _ = scorer.score(userId, candidates.tolist())
+        expected, _ = predictions(model, userId, candidates.tolist())
+        np.testing.assert_array_equal(candidates[top_n_indices(est, TOP_N)],
+                                      candidates[top_n_indices(expected, TOP_N)])
+
+
+def test_with_ratings_matches_retrain(trained, ratings, tmp_path):
+    user_based, model, scorer = trained
+    rng = np.random.default_rng(1)
+    # Ratings nuevos y recalificaciones de usuarios y películas del modelo
+    new = [(int(rng.integers(1, N_USERS + 1)), int(rng.integers(1, N_ITEMS + 1)), rng.integers(1, 11) / 2)
+           for _ in range(30)]
+    retrained = train(with_new_ratings(ratings, new), user_based)
+
+    updated = scorer
+    for start in range(0, len(new), 7):
+        updated, _ = updated.with_ratings(new[start:start + 7])
+    userIds = sorted({userId for userId, _, _ in new}) + list(range(1, N_USERS + 1, 10))
+    assert_same_scores(updated, retrained, userIds)
+    assert_same_scores(updated.compact(), retrained, userIds)
+    # Compactación al exportar el artefacto (escrita en los archivos de la versión)
+    assert_same_scores(load_artifact(export_artifact(updated, str(tmp_path))), retrained, userIds)
+    # La versión anterior no cambia
+    assert_same_scores(scorer, model, userIds)
+
+
+def test_user_fold_in_matches_retrain(ratings):
+    scorer = build_scorer(train(ratings, True), True)
+    rng = np.random.default_rng(2)
+    for newId in range(N_USERS + 1, N_USERS + 4):
+        rated = rng.choice(np.arange(1, N_ITEMS + 1), rng.integers(3, 25), replace=False)
+        user_ratings = {int(movieId): rng.integers(1, 11) / 2 for movieId in rated}
+        retrained = train(with_new_ratings(ratings, [(newId, movieId, rating)
+                                                     for movieId, rating in user_ratings.items()]), True)
+        # Solo las películas sin calificar: en el modelo reentrenado, el
+        # usuario es su propio vecino en las que calificó
+        movieIds = [movieId for movieId in range(1, N_ITEMS + 1) if movieId not in user_ratings]
+        est, impossible = scorer.fold_in(user_ratings, movieIds)
+        expected_est, expected_impossible = predictions(retrained, newId, movieIds)
+        np.testing.assert_array_equal(impossible, expected_impossible)
+        np.testing.assert_allclose(est, expected_est, rtol=0, atol=1e-12)
+
+
+def test_item_fold_in_matches_known_user(ratings):
+    # En item-item un usuario nuevo modifica las similitudes entre películas:
+    # el fold-in usa las del modelo, igual que la puntuación de un usuario conocido
+    scorer = build_scorer(train(ratings, False), False)
+    movieIds = list(range(1, N_ITEMS + 1))
+    for userId in range(1, N_USERS + 1, 7):
+        history = ratings[ratings.userId == userId]
+        user_ratings = dict(zip(history.movieId.tolist(), history.rating.tolist()))
+        est, impossible = scorer.fold_in(user_ratings, movieIds)
+        expected_est, expected_impossible = scorer.score(userId, movieIds)
+        np.testing.assert_array_equal(impossible, expected_impossible)
+        np.testing.assert_allclose(est, expected_est, rtol=0, atol=1e-12)
@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from recommender.singleflight import SingleFlight
+
+"""
+Cálculos compartidos (single-flight): un solo cálculo por clave para las
+peticiones simultáneas, espera acotada y desvinculación con ``forget``
+"""
+
+
+class Computation:
+    """Corrutina de cálculo que cuenta sus ejecuciones y espera ``release``."""
+
+    def __init__(self, result="candidates"):
+        self.result = result
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.result
+
+
+def test_concurrent_callers_share_one_computation():
+    async def scenario():
+        flights = SingleFlight()
+        compute = Computation()
+        waiters = [asyncio.ensure_future(flights.run("key", compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert len(flights) == 1
+        compute.release.set()
+        results = await asyncio.gather(*waiters)
+        return compute.calls, results, len(flights)
+
+    calls, results, pending = asyncio.run(scenario())
+
+    assert calls == 1
+    assert [result for result, _ in results] == ["candidates"] * 5
+    # Solo la primera petición inicia el cálculo; las demás se unen
+    assert [coalesced for _, coalesced in results] == [False, True, True, True, True]
+    assert pending == 0
+
+
+def test_errors_reach_every_caller():
+    async def failing():
+        await asyncio.sleep(0)
+        raise LookupError("usuario no encontrado")
+
+    async def scenario():
+        flights = SingleFlight()
+        return await asyncio.gather(flights.run("key", failing), flights.run("key", failing),
+                                    return_exceptions=True)
+
+    assert all(isinstance(error, LookupError) for error in asyncio.run(scenario()))
+
+
+def test_timeout_keeps_computation_running():
+    # La espera vencida llega como TimeoutError (la API responde 504), pero el
+    # cálculo continúa y la petición siguiente recibe su resultado
+    async def scenario():
+        flights = SingleFlight(timeout=0.01)
+        compute = Computation()
+        with pytest.raises(asyncio.TimeoutError):
+            await flights.run("key", compute)
+        assert len(flights) == 1
+
+        waiter = asyncio.ensure_future(flights.run("key", compute))
+        await asyncio.sleep(0)
+        compute.release.set()
+        return compute.calls, await waiter
+
+    calls, (result, coalesced) = asyncio.run(scenario())
+
+    assert calls == 1
+    assert result == "candidates" and coalesced
+
+
+def test_forget_detaches_later_callers():
+    async def scenario():
+        flights = SingleFlight()
+        stale, fresh = Computation("stale"), Computation("fresh")
+        first = asyncio.ensure_future(flights.run(("user", 1), stale))
+        other = asyncio.ensure_future(flights.run(("user", 2), Computation("other")))
+        await asyncio.sleep(0)
+
+        # Nuevo rating del usuario 1: su cálculo en curso usa los ratings anteriores
+        flights.forget(lambda key: key[1] == 1)
+        assert len(flights) == 1
+
+        second = asyncio.ensure_future(flights.run(("user", 1), fresh))
+        await asyncio.sleep(0)
+        # Terminar primero el cálculo desvinculado no debe quitar el nuevo
+        stale.release.set()
+        result_first = await first
+        assert len(flights) == 2
+        fresh.release.set()
+        result_second = await second
+        other.cancel()
+        return result_first, result_second, stale.calls, fresh.calls
+
+    first, second, stale_calls, fresh_calls = asyncio.run(scenario())
+
+    # La petición que ya esperaba recibe el cálculo anterior; la siguiente, uno nuevo
+    assert first == ("stale", False)
+    assert second == ("fresh", False)
+    assert stale_calls == fresh_calls == 1